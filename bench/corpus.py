@@ -0,0 +1,111 @@
+"""
+Deterministic synthetic images, used by the benchmarks.
+The same seed always generates the same pixels and the same files.
+"""
+
+from base64 import b64encode
+from pathlib import Path
+
+import numpy
+from PIL import Image
+
+from imgdb.db import DB_TMPL, _head_html, img_to_html
+
+# (format, extension, save options)
+FORMATS = (
+    ('JPEG', 'jpg', {'quality': 90}),
+    ('PNG', 'png', {}),
+    ('WEBP', 'webp', {'quality': 85}),
+)
+SIZES = ((640, 480), (1600, 1200), (3000, 4000), (4000, 3000))
+MAKERS = ('Canon-EOS-5D', 'Nikon-D750', 'Sony-A7III', 'Fujifilm-X-T3', '')
+
+
+def make_photo(width: int, height: int, seed: int = 1) -> Image.Image:
+    """A deterministic synthetic "photo": smooth gradients, some blocks and a little noise."""
+    rng = numpy.random.default_rng(seed)
+    y, x = numpy.mgrid[0:height, 0:width].astype(numpy.float32)
+    r = 127 + 100 * numpy.sin(x / width * 6.28) * numpy.cos(y / height * 3.14)
+    g = 255 * (x + y) / (width + height)
+    b = 127 + 100 * numpy.cos(x / width * 12.5 + y / height * 4.2)
+    arr = numpy.dstack([r, g, b])
+    for _ in range(12):
+        bx, by = int(rng.integers(0, width * 3 // 4)), int(rng.integers(0, height * 3 // 4))
+        arr[by : by + height // 6, bx : bx + width // 6] = rng.integers(0, 255, 3)
+    arr += rng.normal(0, 6, arr.shape)
+    return Image.fromarray(numpy.clip(arr, 0, 255).astype(numpy.uint8), 'RGB')
+
+
+def make_exif(seed: int) -> Image.Exif:
+    """Camera maker, model, date and ISO, like a real photo."""
+    exif = Image.Exif()
+    exif[0x010F] = 'Canon'  # Make
+    exif[0x0110] = f'EOS {seed % 9 + 1}D'  # Model
+    exif[0x0132] = f'2020:0{seed % 9 + 1}:1{seed % 10} 12:34:56'  # DateTime
+    sub = exif.get_ifd(0x8769)
+    sub[0x9003] = exif[0x0132]  # DateTimeOriginal
+    sub[0x8827] = 100 * (seed % 8 + 1)  # ISOSpeedRatings
+    return exif
+
+
+def make_corpus(folder: Path | str, count: int = 24) -> list[Path]:
+    """
+    Generate a corpus of images, cycling through all the formats and sizes,
+    every second image has EXIF. Existing files are not generated again.
+    """
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    files = []
+    for i in range(count):
+        fmt, ext, opts = FORMATS[i % len(FORMATS)]
+        width, height = SIZES[i // len(FORMATS) % len(SIZES)]
+        pth = folder / f'img-{i:04}-{width}x{height}.{ext}'
+        if not pth.is_file():
+            img = make_photo(width, height, seed=i)
+            if i % 2 == 0:
+                opts = {**opts, 'exif': make_exif(i)}
+            img.save(pth, fmt, **opts)
+        files.append(pth)
+    return files
+
+
+def make_db_img(i: int, rng: numpy.random.Generator, thumb_bytes: int = 1024) -> dict[str, str]:
+    """The attributes of a synthetic DB image, with a random thumb."""
+    fmt, ext, _ = FORMATS[i % len(FORMATS)]
+    width, height = SIZES[i % len(SIZES)]
+    img_id = rng.bytes(16).hex()
+    attrs = {
+        'id': img_id,
+        'src': 'data:image/webp;base64,' + b64encode(rng.bytes(thumb_bytes * 3 // 4)).decode(),
+        'data-pth': f'/archive/{2000 + i % 24}/{img_id}.{ext}',
+        'data-format': fmt,
+        'data-mode': 'RGB',
+        'data-size': f'{width},{height}',
+        'data-bytes': str(int(rng.integers(100_000, 20_000_000))),
+        'data-mtime': str(1_500_000_000 + i),
+        'data-blake2b': img_id,
+        'data-dhash': rng.bytes(8).hex(),
+        'data-illumination': str(int(rng.integers(0, 100))),
+    }
+    if i % 4:
+        attrs['data-date'] = f'{2000 + i % 24}-{i % 12 + 1:02}-{i % 28 + 1:02} 12:{i % 60:02}:{i // 60 % 60:02}'
+    if MAKERS[i % len(MAKERS)]:
+        attrs['data-maker-model'] = MAKERS[i % len(MAKERS)]
+        attrs['data-iso'] = str(100 * (i % 8 + 1))
+    return attrs
+
+
+def make_db(fname: Path | str, count: int, thumb_bytes: int = 1024, seed: int = 1) -> Path:
+    """
+    Generate a DB file with synthetic images, in the same format as ImgDB.save.
+    Existing files are not generated again.
+    """
+    fname = Path(fname)
+    if fname.is_file():
+        return fname
+    rng = numpy.random.default_rng(seed)
+    imgs = [make_db_img(i, rng, thumb_bytes) for i in range(count)]
+    imgs.sort(key=lambda x: x.get('data-date', '00' + x['id']), reverse=True)
+    head = _head_html({'application-name': 'img-DB', 'date-created': '2020-01-01T00:00'})
+    fname.write_text(DB_TMPL.format(head, '\n'.join(img_to_html(x) for x in imgs)), encoding='utf-8')
+    return fname
@@ -0,0 +1,79 @@
+"""
+Benchmark filtering the DB images: checking the filter on the metas of each row,
+and ImgDB, that checks the numbers, dates, categoricals and paths on the columns, with NumPy,
+and only the rest of the expressions, eg: a regex on a number, on the metas of each row.
+The selective date ranges and categoricals are found with the secondary indexes,
+and they are also checked on the whole columns, without the indexes.
+
+Run: python -m bench.db_filter [--size 500000] [--repeat 3]
+"""
+
+import argparse
+import sys
+import timeit
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from bench.corpus import make_db
+from imgdb import store
+from imgdb.config import Config
+from imgdb.db import ImgDB
+from imgdb.img import ImgMeta
+from imgdb.util import compile_query
+
+QUERIES = (
+    'width > 3000 ; bytes > 1000000 ; date >= 2020',
+    'format = JPEG ; iso >= 400 ; date < 2010',
+    'maker-model ~~ canon ; illumination > 50',
+    'pth ~ /2010/ ; height = 1200',
+    'date ~ -12-25 ; bytes > 1000000',
+    'date >= 2023-06 ; width > 3000',
+    'date < 2001 ; format = PNG',
+    'format = GIF ; date > 2020 ; bytes < 5000000',
+)
+
+
+def rows_filter(db: ImgDB, query: str) -> int:
+    expr = compile_query(query)
+    return sum(1 for row in range(len(db)) if expr(ImgMeta(db.store.attrs(row))))
+
+
+def columns_filter(db: ImgDB, query: str) -> int:
+    return sum(1 for _ in db._match_rows(query))
+
+
+def scan_filter(db: ImgDB, query: str) -> int:
+    ratio = store.INDEX_MAX_RATIO
+    store.INDEX_MAX_RATIO = -1
+    try:
+        return columns_filter(db, query)
+    finally:
+        store.INDEX_MAX_RATIO = ratio
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='bench.db_filter')
+    parser.add_argument('--size', default=500_000, type=int, help='nr of images in the DB')
+    parser.add_argument('--repeat', default=3, type=int, help='nr of runs of each filter')
+    parser.add_argument('--folder', default='', help='keep the generated DB in this folder')
+    args = parser.parse_args()
+
+    with TemporaryDirectory(prefix='imgdb-') as tmpdir:
+        folder = Path(args.folder or tmpdir)
+        folder.mkdir(parents=True, exist_ok=True)
+        fname = make_db(folder / f'db-{args.size}-64.htm', args.size, thumb_bytes=64)
+        db = ImgDB(str(fname), config=Config(verbose=False, silent=True))
+
+        print(f'{"query":<50} {"found":>8} {"rows ms":>10} {"scan ms":>9} {"columns ms":>11} {"speedup":>8}')
+        for query in QUERIES:
+            found = rows_filter(db, query)
+            assert columns_filter(db, query) == scan_filter(db, query) == found
+            old = min(timeit.repeat(lambda q=query: rows_filter(db, q), number=1, repeat=args.repeat)) * 1000
+            scan = min(timeit.repeat(lambda q=query: scan_filter(db, q), number=1, repeat=args.repeat)) * 1000
+            new = min(timeit.repeat(lambda q=query: columns_filter(db, q), number=1, repeat=args.repeat)) * 1000
+            print(f'{query:<50} {found:>8,} {old:>10.1f} {scan:>9.2f} {new:>11.2f} {old / new:>7.0f}x')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
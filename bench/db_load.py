@@ -0,0 +1,114 @@
+"""
+Benchmark loading the DB: the line parser of ImgDB (that also writes the binary index),
+loading from the binary index, and the old BeautifulSoup loader.
+Each load runs in a new process, to measure the peak memory of the loader alone:
+the growth of the peak RSS during the load, without the imports.
+
+Run: python -m bench.db_load [--sizes 10000,100000,500000] [--max-old 100000]
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import timeit
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from bench.corpus import make_db
+from imgdb.config import Config
+from imgdb.db import ImgDB
+from imgdb.dbindex import index_name
+from imgdb.store import is_valid_img
+
+MB = 1024 * 1024
+
+
+def load_old(fname: str) -> int:
+    """The old loader: parse the whole file with BeautifulSoup, then validate every IMG."""
+    from bs4 import BeautifulSoup
+
+    with open(fname, encoding='utf-8') as fd:
+        db = BeautifulSoup(fd.read(), 'lxml')
+    return sum(1 for el in db.find_all('img') if is_valid_img(el))
+
+
+def load_new(fname: str) -> int:
+    return len(ImgDB(fname, config=Config(verbose=False, silent=True)))
+
+
+def run_child(loader: str, fname: str) -> dict:
+    """Load the DB in a new process, return the time, nr of images and memory."""
+    cmd = [sys.executable, '-m', 'bench.db_load', '--child', loader, fname]
+    proc = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout)
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of the process, Linux only, so the imports are not counted."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as fd:
+            fd.write('5')
+    except OSError:
+        pass
+
+
+def proc_status_mb(key: str) -> float:
+    """The VmRSS, or VmHWM (peak RSS) of the process, from /proc, Linux only."""
+    try:
+        with open('/proc/self/status') as fd:
+            for line in fd:
+                if line.startswith(key + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='bench.db_load')
+    parser.add_argument('--sizes', default='10000,100000,500000', help='nr of images in the DBs, comma separated')
+    parser.add_argument('--max-old', default=100_000, type=int, help='skip the old loader for bigger DBs')
+    parser.add_argument('--thumb-bytes', default=1024, type=int, help='size of the base64 thumb of each image')
+    parser.add_argument('--folder', default='', help='keep the generated DBs in this folder')
+    parser.add_argument('--child', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        loader, fname = args.child
+        reset_peak_rss()
+        rss = proc_status_mb('VmRSS')
+        start = timeit.default_timer()
+        count = load_old(fname) if loader == 'old' else load_new(fname)
+        seconds = timeit.default_timer() - start
+        print(
+            json.dumps(
+                {'seconds': round(seconds, 3), 'images': count, 'rss_mb': round(proc_status_mb('VmHWM') - rss, 1)}
+            )
+        )
+        return 0
+
+    print(f'{"images":>8} {"DB MB":>8} {"loader":>7} {"seconds":>9} {"+RSS MB":>8}')
+    with TemporaryDirectory(prefix='imgdb-') as tmpdir:
+        folder = Path(args.folder or tmpdir)
+        folder.mkdir(parents=True, exist_ok=True)
+        for size in (int(s) for s in args.sizes.split(',')):
+            fname = make_db(folder / f'db-{size}-{args.thumb_bytes}.htm', size, args.thumb_bytes)
+            db_mb = fname.stat().st_size / MB
+            loaders = ('old', 'new', 'index') if size <= args.max_old else ('new', 'index')
+            results = {}
+            for loader in loaders:
+                if loader == 'new':
+                    index_name(fname).unlink(missing_ok=True)
+                results[loader] = res = run_child(loader, str(fname))
+                print(f'{size:>8,} {db_mb:>8.1f} {loader:>7} {res["seconds"]:>9.3f} {res["rss_mb"]:>8.1f}')
+            assert results['new']['images'] == results['index']['images']
+            if 'old' in results:
+                assert results['old']['images'] == results['new']['images']
+                print(f'{"":>17} speedup x{results["old"]["seconds"] / results["new"]["seconds"]:.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
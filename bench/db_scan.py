@@ -0,0 +1,77 @@
+"""
+Benchmark the repeated accesses of the DB images, after the DB is loaded:
+the old BeautifulSoup tree, where each access walks the whole tree,
+and ImgDB, that keeps the images in order and updates them in place.
+
+Run: python -m bench.db_scan [--sizes 10000,100000] [--repeat 5]
+"""
+
+import argparse
+import sys
+import timeit
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from bench.corpus import make_db
+from imgdb.config import Config
+from imgdb.db import ImgDB
+
+
+def old_ops(soup, img_ids: list[str]) -> dict:
+    return {
+        'len': lambda: len(soup.find_all('img')),
+        'images': lambda: soup.find_all('img'),
+        'scan': lambda: sum(1 for el in soup.find_all('img') if el.attrs.get('data-bytes')),
+        'get_by_id': lambda: [soup.find('img', {'id': i}) for i in img_ids],
+    }
+
+
+def new_ops(db: ImgDB, img_ids: list[str]) -> dict:
+    return {
+        'len': lambda: len(db),
+        'images': lambda: db.images,
+        'scan': lambda: sum(1 for el in db.images if el.attrs.get('data-bytes')),
+        'get_by_id': lambda: [db.get_by_id(i) for i in img_ids],
+    }
+
+
+def time_ops(ops: dict, repeat: int) -> dict[str, float]:
+    """The best time of each operation, in ms. The first run is not counted."""
+    result = {}
+    for name, func in ops.items():
+        func()
+        result[name] = min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='bench.db_scan')
+    parser.add_argument('--sizes', default='10000,100000', help='nr of images in the DBs, comma separated')
+    parser.add_argument('--repeat', default=5, type=int, help='nr of runs of each operation')
+    parser.add_argument('--lookups', default=100, type=int, help='nr of IDs for get_by_id')
+    parser.add_argument('--folder', default='', help='keep the generated DBs in this folder')
+    args = parser.parse_args()
+
+    from bs4 import BeautifulSoup
+
+    print(f'{"images":>8} {"operation":>10} {"old ms":>10} {"new ms":>10} {"speedup":>9}')
+    with TemporaryDirectory(prefix='imgdb-') as tmpdir:
+        folder = Path(args.folder or tmpdir)
+        folder.mkdir(parents=True, exist_ok=True)
+        for size in (int(s) for s in args.sizes.split(',')):
+            fname = make_db(folder / f'db-{size}-1024.htm', size)
+            db = ImgDB(str(fname), config=Config(verbose=False, silent=True))
+            with open(fname, encoding='utf-8') as fd:
+                soup = BeautifulSoup(fd.read(), 'lxml')
+            step = max(1, len(db) // args.lookups)
+            img_ids = db.store.ids[::step][: args.lookups]
+            old = time_ops(old_ops(soup, img_ids), args.repeat)
+            new = time_ops(new_ops(db, img_ids), args.repeat)
+            for name in old:
+                speedup = old[name] / max(new[name], 1e-6)
+                print(f'{size:>8,} {name:>10} {old[name]:>10.2f} {new[name]:>10.3f} {speedup:>8.0f}x')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Benchmark the reduced-resolution (draft) JPEG decoding, against the full decoding.
+The thumbs, visual hashes and algorithms must stay within tolerance.
+
+Run: python -m bench.draft_decode
+"""
+
+import sys
+import timeit
+from base64 import b64decode
+from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy
+from PIL import Image
+
+from bench.corpus import make_photo
+from imgdb.config import Config
+from imgdb.img import img_to_meta
+from imgdb.vhash import VISUAL_HASH_BASE
+
+SIZES = ((1600, 1200), (4000, 3000), (8192, 5464))
+REPEAT = 3
+
+V_HASHES = ('ahash', 'dhash', 'vhash', 'rchash', 'jhash', 'chash')
+ALGORITHMS = ('illumination', 'saturation', 'contrast')
+
+# max mean absolute pixel difference between the thumbs, from 0 to 255
+THUMB_TOLERANCE = 4.0
+# max ratio of different bits in the visual hashes
+VHASH_TOLERANCE = 0.25
+# max absolute difference for the algorithms, from 0 to 100
+ALGO_TOLERANCE = 1.5
+
+
+def b64_to_array(thumb: str) -> numpy.ndarray:
+    return numpy.asarray(Image.open(BytesIO(b64decode(thumb))).convert('RGB'), dtype=numpy.int16)
+
+
+def hash_bits(algo: str, val: str) -> str:
+    if algo in ('jhash', 'rchash', 'chash'):
+        return ''.join(f'{b:08b}' for b in b64decode(val))
+    return f'{int(val, VISUAL_HASH_BASE):b}'
+
+
+def bits_distance(algo: str, v1: str, v2: str) -> float:
+    b1, b2 = hash_bits(algo, v1), hash_bits(algo, v2)
+    width = max(len(b1), len(b2))
+    b1, b2 = b1.zfill(width), b2.zfill(width)
+    return sum(x != y for x, y in zip(b1, b2, strict=True)) / width
+
+
+def compare(full: dict, draft: dict) -> dict:
+    result: dict = {}
+    t1, t2 = b64_to_array(full['__thumb']), b64_to_array(draft['__thumb'])
+    result['thumb'] = float(numpy.abs(t1 - t2).mean()) if t1.shape == t2.shape else float('inf')
+    for algo in V_HASHES:
+        result[algo] = bits_distance(algo, full[algo], draft[algo])
+    for algo in ALGORITHMS:
+        result[algo] = abs(full[algo] - draft[algo])
+    return result
+
+
+def main() -> int:
+    ok = True
+    base = {'c_hashes': '', 'uid': '{dhash}', 'v_hashes': ','.join(V_HASHES), 'algorithms': ','.join(ALGORITHMS)}
+    c_full = Config(**base, verbose=False, silent=True)
+    c_draft = Config(**base, draft=True, verbose=False, silent=True)
+
+    with TemporaryDirectory(prefix='imgdb-') as tmpdir:
+        for width, height in SIZES:
+            pth = Path(tmpdir) / f'photo-{width}x{height}.jpg'
+            make_photo(width, height).save(pth, quality=90)
+            mpx = width * height / 1_000_000
+
+            t_full = min(timeit.repeat(lambda p=pth: img_to_meta(p, c_full), number=1, repeat=REPEAT))
+            t_draft = min(timeit.repeat(lambda p=pth: img_to_meta(p, c_draft), number=1, repeat=REPEAT))
+            _, m_full = img_to_meta(pth, c_full)
+            _, m_draft = img_to_meta(pth, c_draft)
+            diff = compare(m_full, m_draft)
+
+            print(f'{width}x{height} ({mpx:.1f} MP): full {t_full:.3f}s, draft {t_draft:.3f}s, x{t_full / t_draft:.1f}')
+            for key, val in diff.items():
+                if key == 'thumb':
+                    limit = THUMB_TOLERANCE
+                elif key in V_HASHES:
+                    limit = VHASH_TOLERANCE
+                else:
+                    limit = ALGO_TOLERANCE
+                status = 'ok' if val <= limit else 'FAIL'
+                ok = ok and val <= limit
+                print(f'  {key:<14} {val:8.3f}  (max {limit})  {status}')
+
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
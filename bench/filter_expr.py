@@ -0,0 +1,62 @@
+"""
+Benchmark the filter expressions on the image meta-data:
+the old way, that evaluates all the expressions of every image, searching the regexes through the re cache,
+and the compiled filter, that checks the cheap expressions first and stops at the first mismatch.
+
+Run: python -m bench.filter_expr [--size 500000] [--repeat 3]
+"""
+
+import argparse
+import sys
+import timeit
+
+import numpy
+
+from bench.corpus import make_db_img
+from imgdb.img import el_to_meta
+from imgdb.util import compile_query, parse_query_expr
+
+QUERIES = (
+    'format = JPEG ; bytes > 1000000',
+    'width > 1000 ; height > 700 ; maker-model ~~ canon',
+    'date ~ 20[0-9]{2}-12-2[0-9] ; format != PNG ; bytes < 5000000',
+    'pth ~ /2010/ ; mode = RGB ; bytes >= 500000',
+)
+
+
+def old_filter(metas: list[dict], query: str) -> int:
+    expr = parse_query_expr(query)
+    found = 0
+    for m in metas:
+        ok = [func(m.get(prop), val) for prop, func, val in expr]
+        if ok and all(ok):
+            found += 1
+    return found
+
+
+def new_filter(metas: list[dict], query: str) -> int:
+    expr = compile_query(query)
+    return sum(1 for m in metas if expr(m))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='bench.filter_expr')
+    parser.add_argument('--size', default=500_000, type=int, help='nr of images')
+    parser.add_argument('--repeat', default=3, type=int, help='nr of runs of each filter')
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(1)
+    metas = [el_to_meta(make_db_img(i, rng, thumb_bytes=0), native=False) for i in range(args.size)]
+
+    print(f'{"query":<64} {"found":>8} {"old ms":>9} {"new ms":>9} {"speedup":>8}')
+    for query in QUERIES:
+        found = old_filter(metas, query)
+        assert new_filter(metas, query) == found
+        old = min(timeit.repeat(lambda q=query: old_filter(metas, q), number=1, repeat=args.repeat)) * 1000
+        new = min(timeit.repeat(lambda q=query: new_filter(metas, q), number=1, repeat=args.repeat)) * 1000
+        print(f'{query:<64} {found:>8,} {old:>9.1f} {new:>9.1f} {old / new:>7.1f}x')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
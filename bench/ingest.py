@@ -0,0 +1,176 @@
+"""
+Benchmark the import: the throughput of each stage of img_to_meta,
+and the end-to-end add operation with 1..N workers.
+The results are saved as JSON, and can be compared with the results of other versions.
+
+Run: python -m bench.ingest --out results.json [--compare old-results.json]
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import timeit
+import tomllib
+from collections import defaultdict
+from collections.abc import Callable
+from datetime import datetime
+from multiprocessing import cpu_count
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+
+from PIL import Image
+
+from bench.corpus import make_corpus
+from imgdb.algorithm import ALGORITHMS, run_algo
+from imgdb.config import Config
+from imgdb.img import HASH_THUMBS, img_to_meta, pil_exif, pil_xmp
+from imgdb.main import add_op
+from imgdb.util import hash_pixels, img_to_b64, make_thumbs
+from imgdb.vhash import VHASHES, run_vhash
+
+C_HASHES = ('blake2b', 'sha256', 'md5')
+MB = 1024 * 1024
+
+
+def version() -> dict[str, str]:
+    root = Path(__file__).parent.parent
+    with open(root / 'pyproject.toml', 'rb') as fd:
+        ver = tomllib.load(fd)['project']['version']
+    try:
+        cmd = ['git', 'rev-parse', '--short', 'HEAD']
+        commit = subprocess.run(cmd, cwd=root, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'version': ver, 'commit': commit}
+
+
+def best_of(func: Callable, repeat: int) -> tuple[Any, float]:
+    """Run the function a few times, return the last result and the best time."""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        result = func()
+        best = min(best, timeit.default_timer() - start)
+    return result, best
+
+
+def _decode(pth: Path) -> Image.Image:
+    img = Image.open(pth)
+    img.load()
+    return img
+
+
+def bench_stages(files: list[Path], c: Config, repeat: int) -> dict[str, float]:
+    """The total time of each stage, for all the files."""
+    times: dict[str, float] = defaultdict(float)
+    sizes = {'thumb': c.thumb_sz, '64px': 64, '256px': 256}
+    for pth in files:
+        img, t = best_of(lambda p=pth: _decode(p), repeat)
+        times['decode'] += t
+        times['exif'] += best_of(lambda i=img: (pil_xmp(i), pil_exif(i)), repeat)[1]
+        thumbs, t = best_of(lambda i=img: make_thumbs(i, sizes, exact=HASH_THUMBS), repeat)
+        times['thumbs'] += t
+        times['thumb-encode'] += best_of(lambda t=thumbs: img_to_b64(t['thumb'], c.thumb_type, c.thumb_qual), repeat)[1]
+        images = {'img': img, **thumbs}
+        for algo in ALGORITHMS:
+            # some algorithms cache intermediary images, so they get a fresh copy
+            times[f'algo:{algo}'] += best_of(lambda a=algo, i=images: run_algo(dict(i), a), repeat)[1]
+        for algo in VHASHES:
+            times[f'vhash:{algo}'] += best_of(lambda a=algo, i=images: run_vhash(dict(i), a), repeat)[1]
+        for algo in C_HASHES:
+            times[f'hash:{algo}'] += best_of(lambda a=algo, i=img: hash_pixels(i, [a]), repeat)[1]
+        times['img_to_meta'] += best_of(lambda p=pth: img_to_meta(p, c), repeat)[1]
+    return times
+
+
+def bench_add(folder: Path, workers: list[int], c_kw: dict[str, Any]) -> dict[int, float]:
+    """The time of the add operation, with different number of workers."""
+    times = {}
+    for w in workers:
+        with TemporaryDirectory(prefix='imgdb-') as tmpdir:
+            cfg = Config(db=f'{tmpdir}/bench.htm', workers=w, **c_kw)
+            start = timeit.default_timer()
+            add_op([folder], cfg)
+            times[w] = timeit.default_timer() - start
+    return times
+
+
+def throughput(seconds: float, count: int, total_bytes: int) -> dict[str, float]:
+    return {
+        'seconds': round(seconds, 4),
+        'images_s': round(count / seconds, 2) if seconds else 0.0,
+        'mb_s': round(total_bytes / MB / seconds, 2) if seconds else 0.0,
+    }
+
+
+def compare(new: dict, old: dict):
+    print(f'\nCompared with {old["version"]} ({old["commit"]}), from {old["date"]}:')
+    for section in ('stages', 'add_op'):
+        for key, val in new[section].items():
+            if key in old[section]:
+                ratio = val['images_s'] / old[section][key]['images_s'] if old[section][key]['images_s'] else 0
+                print(f'  {section} {key:<20} x{ratio:.2f}')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog='bench.ingest')
+    parser.add_argument('--corpus', default='', help='corpus folder, default is a temp folder')
+    parser.add_argument('--count', default=24, type=int, help='nr of images in the corpus')
+    parser.add_argument('--repeat', default=3, type=int, help='repeat each stage and keep the best time')
+    parser.add_argument('--max-workers', default=cpu_count(), type=int, help='benchmark add with 1..N workers')
+    parser.add_argument('--out', default='ingest-results.json', help='JSON results file')
+    parser.add_argument('--compare', default='', help='compare with older JSON results')
+    args = parser.parse_args()
+
+    workers = sorted({1, *(2**i for i in range(1, args.max_workers.bit_length())), args.max_workers})
+    c_kw = {
+        'c_hashes': 'blake2b',
+        'v_hashes': 'dhash',
+        'algorithms': 'illumination,saturation,contrast',
+        'silent': True,
+        'verbose': False,
+    }
+
+    with TemporaryDirectory(prefix='imgdb-corpus-') as tmpdir:
+        folder = Path(args.corpus or tmpdir)
+        files = make_corpus(folder, args.count)
+        total_bytes = sum(f.stat().st_size for f in files)
+        print(f'Corpus: {len(files)} images, {total_bytes / MB:.1f} MB, in "{folder}"')
+
+        stages = bench_stages(files, Config(**c_kw), args.repeat)
+        add_times = bench_add(folder, workers, c_kw)
+
+    results = {
+        **version(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': cpu_count(),
+        'corpus': {'count': len(files), 'bytes': total_bytes},
+        'config': c_kw,
+        'stages': {k: throughput(v, len(files), total_bytes) for k, v in stages.items()},
+        'add_op': {str(w): throughput(v, len(files), total_bytes) for w, v in add_times.items()},
+    }
+
+    print(f'\n{"stage":<22} {"img/s":>10} {"MB/s":>10}')
+    for key, val in results['stages'].items():
+        print(f'{key:<22} {val["images_s"]:>10.2f} {val["mb_s"]:>10.2f}')
+    for key, val in results['add_op'].items():
+        print(f'{"add, " + key + " workers":<22} {val["images_s"]:>10.2f} {val["mb_s"]:>10.2f}')
+
+    with open(args.out, 'w') as fd:
+        json.dump(results, fd, indent=2)
+    print(f'\nResults saved in "{args.out}"')
+
+    if args.compare:
+        with open(args.compare) as fd:
+            compare(results, json.load(fd))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,6 +25,10 @@ def main(argv: list[str] | None = None):  # pragma: no cover
     )
     p_info.add_argument('--algorithms', default='', help='algorithms to run (top-colors, illumination, etc)')
     p_info.add_argument('--ai', default='', help='AI algorithms to run (object detection, embedding, etc)')
+    p_info.add_argument('--draft', action='store_true', help='fast JPEG decoding at reduced size (no content hashes)')
+    p_info.add_argument(
+        '--raw-mode', default='full', help='RAW decoding: full, half or preview (half & preview need no content hashes)'
+    )
     p_info.add_argument('--silent', action='store_true', help='only show error logs')
     p_info.add_argument('--verbose', action='store_true', help='show all logs')
 
@@ -41,6 +45,7 @@ def main(argv: list[str] | None = None):  # pragma: no cover
     p_add.add_argument('inputs', nargs='+')
     p_add.add_argument('-o', '--output', default='', help='import in output folder')
     p_add.add_argument('--db', default='imgdb.htm', help='DB file name')
+    p_add.add_argument('--cache', default='', help='meta-data cache file name, to skip processing unchanged images')
     p_add.add_argument('--config', default='', help='optional JSON config file')
     p_add.add_argument(
         '--operation',
@@ -56,9 +61,15 @@ def main(argv: list[str] | None = None):  # pragma: no cover
     p_add.add_argument('-f', '--filter', default='', help='filter expressions')
     p_add.add_argument('--exts', default='', help='only add images with specified extensions')
     p_add.add_argument('--limit', default=0, type=int, help='limit imported files')
+    p_add.add_argument('--workers', default=0, type=int, help='nr of worker processes (default: all CPU cores)')
+    p_add.add_argument('--read-ahead', default=0, type=int, help='read files ahead of the workers, memory in MB')
     p_add.add_argument('--thumb-sz', default=96, type=int, help='DB thumb size')
     p_add.add_argument('--thumb-qual', default=70, type=int, help='DB thumb quality')
     p_add.add_argument('--thumb-type', default='webp', help='DB thumb type')
+    p_add.add_argument('--draft', action='store_true', help='fast JPEG decoding at reduced size (no content hashes)')
+    p_add.add_argument(
+        '--raw-mode', default='full', help='RAW decoding: full, half or preview (half & preview need no content hashes)'
+    )
     p_add.add_argument('--skip-imported', action='store_true', help='skip files that are already imported in the DB')
     p_add.add_argument('--deep', action='store_true', help='deep (recursive) search for files to import')
     p_add.add_argument('--shuffle', action='store_true', help='randomize files before import')
@@ -109,10 +120,15 @@ def main(argv: list[str] | None = None):  # pragma: no cover
     p_db = subparsers.add_parser('db', help='run DB operations')
     p_db.add_argument('op', help='operation name')
     p_db.add_argument('--db', required=True, default='imgdb.htm', help='DB file name')
+    p_db.add_argument('--cache', default='', help='meta-data cache file name')
     p_db.add_argument('--config', default='', help='optional JSON config file')
     p_db.add_argument('--output', default='', help='DB export output')
-    p_db.add_argument('--format', default='jl', help='DB export format')
+    p_db.add_argument('--format', default='jl', help='DB export format: json, jl (JSON lines), csv, table, npz (NumPy)')
     p_db.add_argument('-f', '--filter', default='', help='filter expressions')
+    p_db.add_argument('--shard-by', default='year', help='split the DB in shards, per: year, or id (prefix)')
+    p_db.add_argument(
+        '--archive-subfolder-len', default=1, type=int, help='the length of the ID prefix, when sharding per id'
+    )
     p_db.add_argument('--silent', action='store_true', help='only show error logs')
     p_db.add_argument('--verbose', action='store_true', help='show all logs')
 
@@ -120,6 +136,7 @@ def main(argv: list[str] | None = None):  # pragma: no cover
     p_rename = subparsers.add_parser('rename', help='rename images in the input folder(s)')
     p_rename.add_argument('inputs', nargs='+')
     p_rename.add_argument('--name', required=True, help='base name used to rename all images')
+    p_rename.add_argument('--cache', default='', help='meta-data cache file name, to skip processing unchanged images')
     p_rename.add_argument('--c-hashes', default='blake2b', help='cryptographic hashes (separated by space or comma)')
     p_rename.add_argument('--v-hashes', default='dhash', help='visual hashes (separated by space or comma)')
     p_rename.add_argument(
@@ -127,6 +144,8 @@ def main(argv: list[str] | None = None):  # pragma: no cover
     )
     p_rename.add_argument('--exts', default='', help='only use images with specified extensions')
     p_rename.add_argument('--limit', default=0, type=int, help='limit renamed files')
+    p_rename.add_argument('--workers', default=0, type=int, help='nr of worker processes (default: all CPU cores)')
+    p_rename.add_argument('--read-ahead', default=0, type=int, help='read files ahead of the workers, memory in MB')
     p_rename.add_argument('--force', action='store_true', help='force overwrite existing files')
     p_rename.add_argument('--deep', action='store_true', help='deep (recursive) search for files to rename')
     p_rename.add_argument('--shuffle', action='store_true', help='randomize files before rename')
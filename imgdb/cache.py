@@ -0,0 +1,154 @@
+"""
+Persistent cache for the meta-data extracted from images.
+Re-importing images that didn't change on disk is very fast,
+because they are not decoded and processed again.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+from .config import Config
+from .log import log
+
+# Config fields that change the meta-data extracted from an image
+CACHE_CONFIG_FIELDS = (
+    'uid',
+    'c_hashes',
+    'v_hashes',
+    'algorithms',
+    'ai',
+    'metadata',
+    'thumb_sz',
+    'thumb_qual',
+    'thumb_type',
+    'hash_digest_size',
+    'draft',
+    'raw_mode',
+)
+
+# cached meta-data not used for more than X days is evicted
+CACHE_MAX_AGE = 90
+# don't update the last used time on every read
+CACHE_TOUCH_AGE = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metas (
+    pth TEXT NOT NULL,
+    cfg TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    used INTEGER NOT NULL,
+    meta TEXT NOT NULL,
+    PRIMARY KEY (pth, cfg)
+)
+""".strip()
+
+
+def config_key(c: Config) -> str:
+    """A short fingerprint of the Config fields that change the meta-data."""
+    values = [getattr(c, f) for f in CACHE_CONFIG_FIELDS]
+    return hashlib.blake2b(json.dumps(values).encode(), digest_size=8).hexdigest()
+
+
+class MetaCache:
+    """
+    SQLite cache for the img_to_meta results, keyed by the file path,
+    file size, modification time and inode, plus the relevant Config fields.
+    The cache is supposed to be used only from the main process.
+    """
+
+    def __init__(self, fname: str | Path, c: Config):
+        self.fname = Path(fname)
+        self.cfg = config_key(c)
+        self.db = sqlite3.connect(self.fname)
+        self.db.execute(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pth: str | Path) -> Optional[dict[str, Any]]:
+        """Return the cached meta-data, if the file didn't change."""
+        try:
+            st = os.stat(pth)
+        except OSError:
+            return None
+        row = self.db.execute(
+            'SELECT bytes, mtime, inode, used, meta FROM metas WHERE pth = ? AND cfg = ?',
+            (str(pth), self.cfg),
+        ).fetchone()
+        if not row or row[:3] != (st.st_size, st.st_mtime_ns, st.st_ino):
+            self.misses += 1
+            return None
+        self.hits += 1
+        now = int(time.time())
+        if now - row[3] > CACHE_TOUCH_AGE:
+            self.db.execute('UPDATE metas SET used = ? WHERE pth = ? AND cfg = ?', (now, str(pth), self.cfg))
+        meta = json.loads(row[4])
+        # the file could have been moved, or renamed
+        meta['pth'] = str(pth)
+        meta['mtime'] = int(st.st_mtime)
+        return meta
+
+    def put(self, pth: str | Path, meta: dict[str, Any]):
+        """Save the meta-data of a file."""
+        try:
+            st = os.stat(pth)
+        except OSError:
+            return
+        m = {k: v for k, v in meta.items() if k != '__e'}
+        self.db.execute(
+            'INSERT OR REPLACE INTO metas VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (
+                str(pth),
+                self.cfg,
+                st.st_size,
+                st.st_mtime_ns,
+                st.st_ino,
+                int(time.time()),
+                json.dumps(m, ensure_ascii=False, default=str),
+            ),
+        )
+
+    def evict(self, max_age: int = CACHE_MAX_AGE) -> int:
+        """Remove the meta-data not used for more than X days."""
+        cur = self.db.execute('DELETE FROM metas WHERE used < ?', (int(time.time()) - max_age * 86400,))
+        self.db.commit()
+        return cur.rowcount
+
+    def purge(self) -> int:
+        """Remove the meta-data of files that were deleted, or changed."""
+        stale = []
+        for pth, size, mtime, inode in self.db.execute('SELECT pth, bytes, mtime, inode FROM metas'):
+            try:
+                st = os.stat(pth)
+            except OSError:
+                stale.append((pth,))
+                continue
+            if (size, mtime, inode) != (st.st_size, st.st_mtime_ns, st.st_ino):
+                stale.append((pth,))
+        self.db.executemany('DELETE FROM metas WHERE pth = ?', stale)
+        self.db.commit()
+        return len(stale)
+
+    def clear(self) -> int:
+        """Invalidate the whole cache."""
+        cur = self.db.execute('DELETE FROM metas')
+        self.db.commit()
+        self.db.execute('VACUUM')
+        return cur.rowcount
+
+    def close(self):
+        if self.hits or self.misses:
+            log.debug(f'Meta cache: {self.hits:,} hits, {self.misses:,} misses')
+        self.evict()
+        self.db.commit()
+        self.db.close()
+
+    def count(self) -> int:
+        """The number of cached images, for all configs."""
+        return self.db.execute('SELECT COUNT(*) FROM metas').fetchone()[0]
@@ -52,6 +52,7 @@ IMG_ATTRS_LIST = [
     'width',
     'height',
     'date',
+    'mtime',
     'maker-model',
 ]
 IMG_ATTRS_LIST.extend(IMG_ATTRS_BASE)
@@ -64,8 +65,10 @@ JSON_SAFE_PROPS = {
     'ai',
     'algorithms',
     'deep',
+    'draft',
     'exts',
     'metadata',
+    'raw_mode',
     'shuffle',
     'sym_links',
     'thumb_qual',
@@ -73,6 +76,8 @@ JSON_SAFE_PROPS = {
     'thumb_type',
     'c_hashes',
     'v_hashes',
+    'read_ahead',
+    'workers',
     'wrap_at',
 }
 
@@ -89,6 +94,7 @@ CLI_ONLY_PROPS = {
 BOOL_TRUE_VALUES = {'1', 'true', 'yes', 'y', 'on'}
 BOOL_FIELDS = {
     'deep',
+    'draft',
     'shuffle',
     'force',
     'skip_imported',
@@ -98,10 +104,13 @@ INT_FIELDS = {
     'bytes',
     'iso',
     'limit',
+    'mtime',
     'thumb_qual',
     'thumb_sz',
     'width',
     'height',
+    'read_ahead',
+    'workers',
 }
 FLOAT_FIELDS = {
     'illumination',
@@ -183,6 +192,10 @@ class Config:
     dry_run: bool = field(default=False)
     # database file name
     db: str = field(default='imgdb.htm')
+    # meta-data cache file name (SQLite), usually next to the DB
+    cache: str = field(default='')
+    # split the DB in shards: per year, or per ID prefix, using archive_subfolder_len
+    shard_by: str = field(default='', validator=validators.in_(['', 'year', 'id']))
     # general export format
     format: str = field(default='')
 
@@ -205,6 +218,10 @@ class Config:
 
     # limit operations to nr of files
     limit: int = field(default=0, validator=validators.ge(0))
+    # nr of worker processes for importing, 0 = all CPU cores
+    workers: int = field(default=0, validator=validators.ge(0))
+    # memory budget in MB, for reading the files ahead of the workers, 0 = disabled
+    read_ahead: int = field(default=0, validator=validators.ge(0))
     # filter by extension, eg: JPG, PNG, etc
     exts: list[str] = field(default='', converter=split_exts)
     # custom filter for some operations
@@ -234,6 +251,13 @@ class Config:
     # AI algorithms to run (object detection, embedding, etc)
     ai: list[str] = field(default='', converter=convert_ai, validator=validate_ai)
 
+    # decode JPEGs at a reduced size, when no content hash is needed;
+    # the thumbs and visual hashes will be a little different
+    draft: bool = field(default=False)
+    # RAW decoding: full demosaic, half size demosaic, or the embedded JPEG preview
+    # half and preview are MUCH faster, but only used when there are no content hashes
+    raw_mode: str = field(default='full', validator=validators.in_(['full', 'half', 'preview']))
+
     # DB thumb size, quality and type
     thumb_sz: int = field(default=128, validator=validators.and_(validators.ge(16), validators.le(512)))
     thumb_qual: int = field(default=70, validator=validators.and_(validators.ge(25), validators.le(99)))
@@ -271,6 +295,8 @@ class Config:
         self.top_clr_round_to = round(255 / self.top_color_channels)
         if self.db:
             self.db = expanduser(self.db)
+        if self.cache:
+            self.cache = expanduser(self.cache)
         if self.metadata == ['*']:
             self.metadata = sorted(EXTRA_META)
         if self.algorithms == ['*']:
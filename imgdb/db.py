@@ -1,24 +1,59 @@
 import csv
 import json
+import mmap
 import os
 import os.path
+import re
 import sys
+import warnings
+from array import array
 from collections import Counter
+from collections.abc import Iterable, Iterator, Mapping
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from html import unescape
+from io import BytesIO
+from multiprocessing import cpu_count
 from pathlib import Path
 from typing import Any, Optional
 
 import attr
+import numpy
 from bs4 import BeautifulSoup
 from bs4.element import Tag
 from texttable import Texttable
 
 from .chart import Bar
 from .config import Config, g_config
+from .dbindex import index_name, load_index, write_index
 from .fsys import find_files
-from .img import el_to_meta
+from .img import IMG_FIELDS, META_DEFAULTS, META_NATIVE, META_SIZE, ImgMeta, el_to_meta
+from .journal import (
+    GEN_META,
+    append_journal,
+    db_generation,
+    del_line,
+    journal_generation,
+    journal_name,
+    meta_line,
+    needs_compact,
+    read_journal,
+)
 from .log import log
-from .util import parse_query_expr
+from .shards import is_manifest, new_manifest, read_manifest, shard_file, shard_keys, write_manifest
+from .store import (
+    DATE_NA,
+    RE_ATTR,
+    ImgRecord,
+    RecordStore,
+    el_attrs,
+    img_to_html,
+    is_valid_img,
+    parse_attrs,
+    quote_attr,
+)
+from .thumbs import PACK_CHUNK, PACK_META, THUMB_ATTR, ThumbPack, pack_name
+from .util import QueryFilter, compile_query
 from .vhash import VHASHES
 
 DB_HEAD = """
@@ -44,6 +79,7 @@ Notable metadata fields include:
 - data-size: the image size in pixels, as "Width,Height" (eg. "1920,1080")
 - data-bytes: the image size in bytes, as an integer
 - data-date: the image creation date, in ISO format (eg. "2012-11-25 11:22:33")
+- data-mtime: the file modification time, as UNIX timestamp; used to skip imported files
 - data-[sha1|sha224|sha256|sha384|sha512|sha3_224|sha3_256|sha3_384|sha3_512|shake_128|shake_256|blake2b]: the respective hash of the image file, as a hex string
 - data-[ahash|bhash|dhash|rchash|vhash]: (optional) visual (perceptual) hash of image, calculated with different algorithms
 - data-[illumination|saturation|contrast]: (optional) calculated value for the respective algorithms, a number between 0 and 100
@@ -60,9 +96,21 @@ Notable metadata fields include:
 </body></html>
 """.strip()  # NOQA
 
+
 func_ident = lambda el: el
 func_noop = lambda _: None
 
+# the binary index is written only for DBs with more images
+INDEX_MIN_IMAGES = 1000
+# the write buffer of the DB file, on save
+SAVE_BUFFER = 1024 * 1024
+# the formats of the DB export: JSON, JSON lines, CSV, HTML table and NumPy columns
+EXPORT_FORMATS = ('json', 'jl', 'jsonl', 'csv', 'html', 'table', 'npz')
+# the images are validated by the store; the old name is kept for compatibility
+_is_valid_img = is_valid_img
+# the default meta tags of a new DB
+DEFAULT_META = dict(re.findall(r'<meta name="([^"]+)" content="([^"]+)">', DB_HEAD))
+
 
 def _db_or_elems(x: Any) -> list | tuple:  # pragma: no cover
     if isinstance(x, ImgDB):
@@ -77,24 +125,214 @@ def _db_or_elems(x: Any) -> list | tuple:  # pragma: no cover
         raise Exception(f'DB or elem internal error! Invalid param type {type(x)}')
 
 
-def _is_valid_img(elem: Any) -> bool:
-    return (
-        elem
-        and len(elem.attrs.get('id', '')) > 3
-        and len(elem.attrs.get('data-pth', '')) > 3
-        and elem.attrs.get('data-bytes')
-        and elem.attrs.get('data-mode')
-        and elem.attrs.get('data-format')
-    )
+def _head_html(meta: dict[str, Any]) -> str:
+    lines = ['<head>', ' <meta charset="utf-8"/>']
+    lines.extend(f' <meta content={quote_attr(str(v))} name={quote_attr(str(k))}/>' for k, v in meta.items())
+    lines.append('</head>')
+    return '\n'.join(lines)
+
+
+def _db_lines(fd: Any) -> Iterator[tuple[str, bytes]]:
+    """
+    Iterate a DB file saved with one IMG per line, opened in binary mode, as (part, line).
+    The part is one of: head, comment, img, blank, end.
+    Raises ValueError if the file is not in this format.
+    """
+    line = fd.readline()
+    if not line.startswith(b'<!DOCTYPE html>'):
+        raise ValueError('Not a DB file')
+    yield 'head', line
+    in_head = True
+    in_comment = False
+    for line in fd:
+        if in_head:
+            in_head = line != b'<body>\n'
+            yield 'head', line
+        elif in_comment:
+            in_comment = line != b'-->\n'
+            yield 'comment', line
+        elif line.startswith(b'<img '):
+            yield 'img', line
+        elif line.rstrip(b'\n') == b'</body></html>':
+            yield 'end', line
+            return
+        elif line == b'<!--\n':
+            in_comment = True
+            yield 'comment', line
+        elif not line.strip():
+            yield 'blank', line
+        else:
+            raise ValueError(f'Invalid DB line: {line[:80]!r}')
+    raise ValueError('The DB file is not complete')
+
+
+def _load_lines(fname: Path) -> tuple[dict[str, str], RecordStore]:
+    """
+    Load the meta and the images from a DB file saved with one IMG per line.
+    The file is kept in memory as it is, and the images point inside it.
+    """
+    meta: dict[str, str] = {}
+    spans: list[tuple[int, int]] = []
+    data = fname.read_bytes()
+    pos = 0
+    for part, line in _db_lines(BytesIO(data)):
+        if part == 'img':
+            spans.append((pos, pos + len(line.rstrip(b'\n'))))
+        elif part == 'head' and line.lstrip().startswith(b'<meta '):
+            attrs = parse_attrs(line.decode('utf-8'))
+            if 'name' in attrs and 'content' in attrs:
+                meta[attrs['name']] = attrs['content']
+        pos += len(line)
+    return meta, RecordStore(data, spans)
+
+
+def _is_packed(fname: Path) -> bool:
+    """If the thumbs of a DB file are packed, reading only the head of the DB."""
+    try:
+        with open(fname, 'rb') as fd:
+            for part, line in _db_lines(fd):
+                if part != 'head':
+                    break
+                if line.lstrip().startswith(b'<meta ') and parse_attrs(line.decode('utf-8')).get('name') == PACK_META:
+                    return True
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return False
+
+
+def _load_soup(content: bytes | str) -> tuple[dict[str, str], RecordStore]:
+    """Load the meta and the images from any HTML, slow."""
+    soup = BeautifulSoup(content, 'lxml')
+    if soup.head and soup.head.meta:
+        meta = {
+            el.attrs['name']: el.attrs['content']
+            for el in soup.head.find_all('meta', attrs={'name': True, 'content': True})
+        }
+    else:
+        meta = dict(DEFAULT_META)
+    return meta, RecordStore.from_attrs(el_attrs(el) for el in soup.find_all('img'))
+
+
+def _update_index(fname: Path, store: RecordStore, meta: dict[str, Any]):
+    """The index is written for big DBs, or updated if it exists."""
+    if len(store) < INDEX_MIN_IMAGES and not index_name(fname).is_file():
+        return
+    try:
+        write_index(fname, store, meta)
+    except OSError as err:
+        log.debug(f'Cannot write the DB index: {err}')
+
+
+def _fsync_dir(folder: Path):
+    """Persist a rename on disk. Not all systems can open a folder."""
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _write_db(fname: Path, meta: dict[str, Any], store: RecordStore, rows: Iterable[int]) -> tuple[Any, numpy.ndarray]:
+    """
+    Write the images of the rows, in order, into a DB file: streamed into a temp file,
+    synced on disk and renamed, because the old file may be memory-mapped.
+    Returns the new file memory-mapped, and the spans of the images.
+    """
+    tmp_name = fname.with_name(fname.name + '.tmp')
+    before, html_imgs, after = DB_TMPL.split('{}')
+    spans = array('q')
+    with open(tmp_name, 'wb', buffering=SAVE_BUFFER) as fd:
+        pos = fd.write((before + _head_html(meta) + html_imgs).encode('utf-8'))
+        for i, row in enumerate(rows):
+            if i:
+                pos += fd.write(b'\n')
+            line = store.line_bytes(row)
+            spans.extend((pos, pos + len(line)))
+            pos += fd.write(line)
+        pos += fd.write(after.encode('utf-8'))
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(tmp_name, fname)
+    _fsync_dir(fname.parent)
+    log.debug(f'Saved {len(spans) // 2:,} imgs, disk size {pos // 1024:,} KB')
+
+    with open(fname, 'rb') as fd:
+        data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+    return data, numpy.frombuffer(spans, numpy.int64).reshape(-1, 2)
+
+
+def _index_shard(fname: str):
+    """Parse a shard and write its index, in a worker process."""
+    ImgDB._load(Path(fname))
+
+
+def _save_order(store: RecordStore, sort_by: str) -> Optional[numpy.ndarray]:
+    """
+    The rows of the DB in the saved order, without the duplicate images,
+    or None if the rows are already in order.
+    The images are sorted by sort_by descending, the images without sort_by
+    are sorted by ID, at the end.
+    """
+    size = len(store)
+    keep = numpy.ones(size, bool)
+    # the duplicate images can only have the same ID
+    if store.has_duplicates():
+        seen: dict[str, list[bytes]] = {}
+        for row, img_id in enumerate(store.ids):
+            first = store.row_of_id(img_id)
+            if first == row:
+                continue
+            lines = seen.setdefault(img_id, [store.line_bytes(first)])  # type: ignore
+            line = store.line_bytes(row)
+            if line in lines:
+                keep[row] = False
+            else:
+                lines.append(line)
+
+    if sort_by == 'date':
+        # the dates in the DB have the same order as their epoch
+        keys = store.column('date')
+        has_key = keys != DATE_NA
+    else:
+        values = [store.attrs(row).get(f'data-{sort_by}') for row in range(size)]
+        has_key = numpy.array([v is not None for v in values], bool)
+        keys = numpy.array([v or '' for v in values], object)
+    ids = store.ids
+
+    rows = numpy.flatnonzero(keep)
+    with_key = rows[has_key[rows]]
+    no_key = rows[~has_key[rows]]
+    sorted_key = bool(numpy.all(keys[with_key[:-1]] >= keys[with_key[1:]]))
+    sorted_ids = all(ids[a] >= ids[b] for a, b in zip(no_key[:-1].tolist(), no_key[1:].tolist(), strict=True))
+    key_first = not len(no_key) or not len(with_key) or no_key[0] > with_key[-1]
+    if len(rows) == size and sorted_key and sorted_ids and key_first:
+        return None
+    if not sorted_key:
+        # a stable sort, descending
+        with_key = with_key[::-1][numpy.argsort(keys[with_key[::-1]], kind='stable')][::-1]
+    if not sorted_ids:
+        no_key = numpy.array(sorted(no_key.tolist(), key=ids.__getitem__, reverse=True), numpy.int64)
+    return numpy.concatenate([with_key, no_key])
 
 
 class ImgDB:
-    """Database class for managing image metadata stored in HTML format."""
+    """
+    Database class for managing image metadata stored in HTML format.
+    The images are kept in a compact, columnar store, the attributes and
+    the BeautifulSoup Tags are created only when they are needed,
+    and the Tags share the same attributes.
+    """
 
     fname: Path = Path('imgdb.htm')
-    db: BeautifulSoup = BeautifulSoup('', 'lxml')
     meta: dict[str, Any] = {}
     config: Config = g_config
+    # the manifest of a sharded DB
+    manifest: Optional[dict[str, Any]] = None
 
     def __init__(
         self, fname: Optional[str] = None, elems: Optional[list | tuple] = None, config: Optional[Config] = None
@@ -106,108 +344,515 @@ class ImgDB:
             raise Exception('DB init error: either fname, elems, or config must be provided')
         self.config = config or g_config
         self.fname = Path(fname or self.config.db)
+        self._shard_bufs: dict[str, int] = {}
         if elems:
             # In case of elems, we lose all the head meta info
-            html = DB_TMPL.format(DB_HEAD, '\n'.join(str(el) for el in elems))
-            self.db = BeautifulSoup(html, 'lxml')
-            del html
+            meta, store = dict(DEFAULT_META), RecordStore.from_attrs(el_attrs(el) for el in elems)
+        elif is_manifest(self.fname):
+            self.manifest = read_manifest(self.fname)
+            meta, store = self._load_shards()
         elif self.fname.is_file():
-            self.db = BeautifulSoup(self.fname.read_bytes(), 'lxml')
+            meta, store = self._load(self.fname)
         else:
-            self.db = BeautifulSoup(DB_TMPL.format(DB_HEAD, ''), 'lxml')
+            meta, store = dict(DEFAULT_META), RecordStore()
+        self.store = store
+        # the image elements, in DB order, created on first use and dropped when the rows change
+        self._images: Optional[list[Tag]] = None
 
-        for elem in self.db.find_all('img'):
-            if not _is_valid_img(elem):
-                log.warning(f'Invalid img found in DB will be removed: {str(elem)[:80]}...')
-                elem.decompose()
+        self.meta: dict[str, Any] = meta
+        # the changes that are not persisted yet: the removed IDs, the meta
+        # and the images written in the journal after the DB was saved
+        self._removed: set[str] = set()
+        self._saved_meta = dict(meta)
+        if not elems and self.manifest is None and self.fname.is_file():
+            self._replay(self.fname)
+        # the thumbs pack is opened only when the thumbs are needed
+        self.thumbs: Optional[ThumbPack] = None
+        if self.meta.get(PACK_META):
+            self.thumbs = ThumbPack(self.fname.parent / self.meta[PACK_META])
+        # create date-created meta tag
+        if 'date-created' not in self.meta:
+            self.meta['date-created'] = datetime.now().strftime('%Y-%m-%dT%H:%M')
 
-        if not (self.db.head and self.db.head.meta):
-            self.db.head = BeautifulSoup(DB_HEAD, 'lxml').head  # type: ignore
+    def _load_shards(self) -> tuple[dict[str, Any], RecordStore]:
+        """
+        Load all the shards of the DB. The big shards that don't have a valid index
+        are parsed in parallel processes, that write the index, then all the shards
+        are loaded from the index, memory-mapped.
+        """
+        manifest: dict[str, Any] = self.manifest  # type: ignore
+        files = [shard_file(self.fname, sh['key']) for sh in manifest['shards']]
+        to_index = [
+            str(f)
+            for f, sh in zip(files, manifest['shards'], strict=True)
+            if sh['count'] >= INDEX_MIN_IMAGES and load_index(f) is None
+        ]
+        if len(to_index) > 1:
+            workers = min(len(to_index), self.config.workers or cpu_count())
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(_index_shard, to_index))
+        shards = [ImgDB(str(f), config=self.config) for f in files]
+        store = RecordStore.concat([db.store for db in shards])
+        # the images are in the same order as in a single DB file
+        rows = _save_order(store, 'date')
+        if rows is not None:
+            store.take(rows)
+        # the shard of each buffer, to find the shards that were changed
+        self._shard_bufs = {sh['key']: i for i, sh in enumerate(manifest['shards'])}
+        log.debug(f'Loaded {len(store):,} imgs from {len(shards):,} shards')
+        return dict(manifest['meta']), store
 
-        # create date-created meta tag
-        date_now = datetime.now().strftime('%Y-%m-%dT%H:%M')
-        date_created = self.db.head.find_all('meta', attrs={'name': 'date-created'})  # type: ignore
-        if not date_created:
-            self.db.head.append(self.db.new_tag('meta', attrs={'name': 'date-created', 'content': date_now}))  # type: ignore
+    @staticmethod
+    def _load(fname: Path) -> tuple[dict[str, Any], RecordStore]:
+        """Load the DB from the index, or parse the HTML."""
+        loaded = load_index(fname)
+        if loaded:
+            return loaded
+        try:
+            meta, store = _load_lines(fname)
+        except (ValueError, UnicodeDecodeError):
+            return _load_soup(fname.read_bytes())
+        _update_index(fname, store, meta)
+        return meta, store
+
+    def _replay(self, fname: Path):
+        """Apply the changes from the journal, on top of the DB file."""
+        imgs: dict[str, Optional[dict[str, str]]] = {}
+        for tag, attrs in read_journal(fname, db_generation(self.meta)):
+            if tag == 'img':
+                imgs[attrs['id']] = attrs
+            elif tag == 'del':
+                imgs[attrs['id']] = None
+            elif tag == 'meta':
+                if 'content' in attrs:
+                    self.meta[attrs['name']] = attrs['content']
+                else:
+                    self.meta.pop(attrs['name'], None)
+        if not imgs:
+            return
+        self.remove(*[img_id for img_id, attrs in imgs.items() if attrs is None])
+        for img_id, attrs in imgs.items():
+            if attrs is None:
+                continue
+            row = self.store.row_of_id(img_id)
+            rec = self.store.append(attrs) if row is None else self.store.replace(row, attrs)
+            rec.saved = img_to_html(rec).encode('utf-8')
+            rec.dirty = False
+        self._images = None
+        self._removed.clear()
+        self._saved_meta = dict(self.meta)
+        log.debug(f'Replayed {len(imgs):,} imgs from the DB journal')
+
+    def _journal_lines(self) -> tuple[list[str], list[tuple[ImgRecord, str]]]:
+        """The changes since the DB was saved, or written in the journal, as journal entries."""
+        lines = [del_line(img_id) for img_id in sorted(self._removed)]
+        imgs: list[tuple[ImgRecord, str]] = []
+        for row, rec in self.store.dirty_records():
+            line = img_to_html(rec).encode('utf-8')
+            old_line = self.store.source_line(row)
+            if line == old_line:
+                continue
+            if old_line is not None:
+                # the ID of the image was changed
+                old_id = _line_attr(old_line.decode('utf-8'), 'id')
+                if old_id and old_id != rec['id'] and self.store.row_of_id(old_id) is None:
+                    lines.append(del_line(old_id))
+            imgs.append((rec, line.decode('utf-8')))
+        for k in self._saved_meta.keys() - self.meta.keys():
+            lines.append(meta_line(k, None))
+        for k, v in self.meta.items():
+            if self._saved_meta.get(k) != v:
+                lines.append(meta_line(k, v))
+        return lines, imgs
 
-        self.meta: dict[str, Any] = {}
-        for meta in self.db.head.find_all('meta', attrs={'name': True, 'content': True}):  # type: ignore
-            self.meta[meta.attrs['name']] = meta.attrs['content']  # type: ignore
+    def _tag(self, row: int) -> Tag:
+        """The Tag of a row, created on first use. The Tag and the record share the attributes."""
+        rec = self.store.record(row)
+        if rec.tag is None:
+            rec.tag = Tag(name='img', can_be_empty_element=True)
+            rec.tag.attrs = rec
+        return rec.tag
 
     @property
     def images(self) -> list:
-        """Return all image elements in the DB."""
-        return self.db.find_all('img')
+        """Return all image elements in the DB. The list is cached, don't change it."""
+        if self._images is None:
+            self._images = [self._tag(row) for row in range(len(self.store))]
+        return self._images
+
+    @property
+    def db(self) -> BeautifulSoup:
+        """
+        Deprecated: the DB as a BeautifulSoup document, eg: db.img, or db.find_all('img').
+        It's a copy of the DB, created on each access, so the changes are not saved; use the images instead.
+        """
+        warnings.warn('ImgDB.db is deprecated, use ImgDB.images', DeprecationWarning, stacklevel=2)
+        imgs = '\n'.join(self.store.line(row) for row in range(len(self.store)))
+        return BeautifulSoup(DB_TMPL.format(_head_html(self.meta), imgs), 'lxml')
+
+    def get_by_id(self, img_id: str) -> Optional[dict[str, Any]]:
+        """Get an image meta-data by its ID."""
+        row = self.store.row_of_id(img_id)
+        if row is None:
+            return None
+        return el_to_meta(self.store.attrs(row))
+
+    def get_by_path(self, pth: Path | str) -> Optional[dict[str, Any]]:
+        """Get an image meta-data by its path."""
+        row = self.store.row_of_pth(str(pth))
+        if row is None:
+            return None
+        return el_to_meta(self.store.attrs(row))
 
-    def get_by_id(self, img_id: str) -> Optional[Tag]:
-        """Get an image element by its ID."""
-        elem = self.db.find('img', {'id': img_id})
-        if elem is not None:
-            return el_to_meta(elem)
+    def get_el_by_id(self, img_id: str) -> Optional[Tag]:
+        """Get an image element by its ID. The element can be changed."""
+        row = self.store.row_of_id(img_id)
+        if row is None:
+            return None
+        return self._tag(row)
+
+    def __contains__(self, img_id: str) -> bool:
+        return self.store.row_of_id(img_id) is not None
+
+    def has_path(self, pth: Path | str) -> bool:
+        return self.store.row_of_pth(str(pth)) is not None
+
+    def add(self, el: Tag | dict[str, Any]) -> Tag:
+        """
+        Add an image element in the DB. If the ID is already in the DB,
+        the image attributes are updated with the new, non-blank values.
+        The DB is not saved on disk.
+        """
+        attrs = el_attrs(el)
+        if self.thumbs is not None:
+            self._pack_thumb(attrs)
+        row = self.store.row_of_id(attrs['id'])
+        if row is not None:
+            rec = self.store.record(row)
+            if THUMB_ATTR in attrs and 'src' in rec:
+                del rec['src']
+            for k, v in attrs.items():
+                if v.strip():
+                    rec[k] = v
+            return self._tag(row)
+        self.store.append(attrs)
+        self._images = None
+        return self._tag(len(self.store) - 1)
+
+    def _pack_thumb(self, attrs: dict[str, str]):
+        ref = self.thumbs.add(attrs.get('src', ''))  # type: ignore
+        if ref:
+            del attrs['src']
+            attrs[THUMB_ATTR] = ref
+
+    def thumb_src(self, attrs: dict[str, str]) -> str:
+        """The thumb of an image, inlined from the pack, if the thumbs are packed."""
+        ref = attrs.get(THUMB_ATTR)
+        if ref and self.thumbs is not None:
+            return self.thumbs.src(ref)
+        return attrs.get('src', '')
+
+    def with_thumbs(self, imgs: list[Tag]) -> list[Tag]:
+        """
+        The image elements with the thumbs inlined, eg: to export them in a gallery.
+        The packed images are copied, so the DB images are not changed.
+        """
+        if self.thumbs is None:
+            return imgs
+        result = []
+        for img in imgs:
+            if THUMB_ATTR in img.attrs:
+                attrs = {k: v for k, v in img.attrs.items() if k != THUMB_ATTR}
+                attrs['src'] = self.thumb_src(img.attrs)
+                img = Tag(name='img', can_be_empty_element=True, attrs=attrs)
+            result.append(img)
+        return result
+
+    def pack_thumbs(self) -> int:
+        """
+        Move the thumbs of all the images into a new pack file, and save the DB.
+        The old pack is rebuilt without the thumbs of the removed images.
+        Returns the number of packed thumbs.
+        """
+        old = self.thumbs
+        name = pack_name(self.fname, self.meta.get(PACK_META, ''))
+        self.thumbs = ThumbPack(self.fname.parent / name)
+        self.thumbs.fname.unlink(missing_ok=True)
+        packed = 0
+        for row in range(len(self.store)):
+            attrs = self.store.attrs(row)
+            ref = attrs.get(THUMB_ATTR)
+            src = old.src(ref) if ref and old is not None else attrs.get('src', '')
+            ref = self.thumbs.add(src)
+            if not ref:
+                continue
+            rec = self.store.record(row)
+            rec.pop('src', None)
+            rec[THUMB_ATTR] = ref
+            packed += 1
+            if self.thumbs.pending_size() > PACK_CHUNK:
+                self.thumbs.flush()
+        self.meta[PACK_META] = name
+        self.save()
+        if old is not None:
+            old.close()
+            old.fname.unlink(missing_ok=True)
+        log.info(f'Packed {packed:,} thumbs in {name}')
+        return packed
+
+    def unpack_thumbs(self) -> int:
+        """Move the thumbs back in the image elements, save the DB and remove the pack."""
+        if self.thumbs is None:
+            return 0
+        unpacked = 0
+        for row in range(len(self.store)):
+            ref = self.store.attrs(row).get(THUMB_ATTR)
+            if not ref:
+                continue
+            rec = self.store.record(row)
+            rec['src'] = self.thumbs.src(ref)
+            del rec[THUMB_ATTR]
+            unpacked += 1
+        old, self.thumbs = self.thumbs, None
+        del self.meta[PACK_META]
+        self.save()
+        old.close()
+        old.fname.unlink(missing_ok=True)
+        log.info(f'Moved {unpacked:,} thumbs back in the DB')
+        return unpacked
+
+    def remove(self, *ids: str) -> int:
+        """Remove the images with the given IDs. The DB is not saved on disk."""
+        ids_set = set(ids)
+        rows = [row for row in map(self.store.row_of_id, ids_set) if row is not None]
+        if not rows:
+            return 0
+        keep = numpy.ones(len(self.store), bool)
+        keep[rows] = False
+        # the duplicates of the removed IDs are removed too
+        if self.store.has_duplicates():
+            keep &= numpy.fromiter((i not in ids_set for i in self.store.ids), bool, len(self.store))
+        removed = len(self.store) - int(keep.sum())
+        self._removed.update(img_id for img_id in ids_set if self.store.row_of_id(img_id) is not None)
+        self.store.take(numpy.flatnonzero(keep))
+        self._images = None
+        return removed
+
+    def fingerprints(self) -> set[tuple[str, int, int]]:
+        """
+        The (path, bytes, mtime) of all images in the DB, from the columns, without reading the images.
+        Used to check if a file is already imported, without decoding it.
+        The images imported without mtime (by older versions) are not included.
+        """
+        size = self.store.column('bytes')
+        mtime = self.store.column('mtime')
+        rows = numpy.flatnonzero(~numpy.isnan(mtime)).tolist()
+        return {(self.store.pths[row], int(size[row]), int(mtime[row])) for row in rows}
 
     def __iter__(self):
         """Iterate over images in the DB."""
-        for elem in self.db.find_all('img'):
-            yield el_to_meta(elem)
+        for row in range(len(self.store)):
+            yield ImgMeta(self.store.attrs(row))
 
     def __len__(self) -> int:
         """Return the number of images in the DB."""
-        return len(self.images)
+        return len(self.store)
 
     def save(self, fname: Optional[Path | str] = None, sort_by='date'):
         """Persist DB on disk."""
         if fname is None:
             fname = self.fname
-        if not (self.db.head and self.db.head.meta):
-            self.db.head = BeautifulSoup(DB_HEAD, 'lxml').head  # type: ignore
 
         # update date-updated meta tag
-        date_now = datetime.now().strftime('%Y-%m-%dT%H:%M')
-        date_updated = self.db.head.find_all('meta', attrs={'name': 'date-updated'})  # type: ignore
-        if date_updated:
-            date_updated[0]['content'] = date_now
-        else:
-            self.db.head.append(self.db.new_tag('meta', attrs={'name': 'date-updated', 'content': date_now}))  # type: ignore
+        self.meta['date-updated'] = datetime.now().strftime('%Y-%m-%dT%H:%M')
+        # the journals of the older generations are never replayed
+        self.meta[GEN_META] = str(int(db_generation(self.meta)) + 1)
+        # the new thumbs are persisted before the images that point to them
+        if self.thumbs is not None:
+            self.thumbs.flush()
+
+        rows = _save_order(self.store, sort_by)
+        if rows is not None:
+            self._images = None
+            self.store.take(rows)
+
+        fname = Path(fname)
+        if self.manifest is not None:
+            return self._save_shards(fname)
+        data, spans = _write_db(fname, self.meta, self.store, range(len(self.store)))
+        self.store.rebase(data, spans)
+        # the journal is folded into the DB
+        journal_name(fname).unlink(missing_ok=True)
+        self._removed.clear()
+        self._saved_meta = dict(self.meta)
+        _update_index(fname, self.store, self.meta)
+        return len(data)
+
+    def to_shards(self, fname: Path | str, shard_by: str) -> int:
+        """Save the DB as a sharded DB, with the manifest in fname."""
+        self.manifest = new_manifest(shard_by, self.config.archive_subfolder_len)
+        self._shard_bufs = {}
+        self.fname = Path(fname)
+        return self.save()
+
+    def _save_shards(self, fname: Path) -> int:
+        """Write the shards that were changed, and the manifest."""
+        manifest: dict[str, Any] = self.manifest  # type: ignore
+        if fname != self.fname:
+            # all the shards are written next to the new manifest
+            self.fname = fname
+            self._shard_bufs = {}
+        store = self.store
+        keys = shard_keys(store, manifest)
+        rows_by_key: dict[str, list[int]] = {}
+        for row, key in enumerate(keys):
+            rows_by_key.setdefault(key, []).append(row)
+        counts = {sh['key']: sh['count'] for sh in manifest['shards']}
+
+        # a shard is dirty if it has new, removed, moved, or changed images
+        dirty = {key for key in counts.keys() | rows_by_key.keys() if counts.get(key) != len(rows_by_key.get(key, ()))}
+        dirty.update(keys[row] for row, _ in store.dirty_records())
+        for key, rows in rows_by_key.items():
+            index = self._shard_bufs.get(key)
+            if (
+                key in dirty
+                or index is None
+                or store.src is None
+                or (store.src[rows] != index).any()
+                or (store.spans[rows, 0] < 0).any()
+            ):
+                dirty.add(key)
+
+        size = 0
+        for key in sorted(dirty & counts.keys() - rows_by_key.keys()):
+            # the shard is empty
+            shard = shard_file(fname, key)
+            for name in (shard, index_name(shard), journal_name(shard)):
+                name.unlink(missing_ok=True)
+            self._shard_bufs.pop(key, None)
+        for key in sorted(dirty & rows_by_key.keys()):
+            shard = shard_file(fname, key)
+            rows = numpy.array(rows_by_key[key], numpy.int64)
+            data, spans = _write_db(shard, self.meta, store, rows)
+            self._shard_bufs[key] = store.rebase_rows(rows, data, spans)
+            journal_name(shard).unlink(missing_ok=True)
+            _update_index(shard, store.subset(rows, data), self.meta)
+            size += len(data)
+
+        manifest['meta'] = {k: str(v) for k, v in self.meta.items()}
+        # the shards are in the order of their images, eg: the newest year first
+        manifest['shards'] = [{'key': key, 'count': len(rows)} for key, rows in rows_by_key.items()]
+        write_manifest(fname, manifest)
+        log.debug(f'Saved {len(dirty):,} of {len(rows_by_key):,} shards')
+        self._removed.clear()
+        self._saved_meta = dict(self.meta)
+        return size
+
+    def commit(self, sort_by='date') -> int:
+        """
+        Persist the changes on disk. The changes of a big DB are appended in the journal,
+        and the DB is saved (compacted) only when the journal is big enough.
+        The small DBs are always saved.
+        """
+        if self.manifest is not None:
+            # only the changed shards are written
+            return self.save(sort_by=sort_by)
+        if not (self.fname.is_file() and (len(self.store) >= INDEX_MIN_IMAGES or journal_name(self.fname).is_file())):
+            return self.save(sort_by=sort_by)
+        gen = db_generation(self.meta)
+        if journal_generation(self.fname) not in (None, gen):
+            # eg: the DB was restored from a backup; the journal was not replayed, and it can't be appended
+            log.warning(f'The DB journal "{journal_name(self.fname)}" is stale, the DB will be saved')
+            return self.save(sort_by=sort_by)
+        lines, imgs = self._journal_lines()
+        if not (lines or imgs):
+            return 0
+        self.meta['date-updated'] = datetime.now().strftime('%Y-%m-%dT%H:%M')
+        if self.thumbs is not None:
+            self.thumbs.flush()
+        lines.append(meta_line('date-updated', self.meta['date-updated']))
+        size = append_journal(self.fname, lines + [line for _, line in imgs], gen)
+        log.debug(f'Committed {len(lines) + len(imgs):,} changes in the DB journal, size {size // 1024:,} KB')
+        if needs_compact(self.fname):
+            return self.save(sort_by=sort_by)
+        self._removed.clear()
+        self._saved_meta = dict(self.meta)
+        for rec, line in imgs:
+            rec.saved = line.encode('utf-8')
+            rec.dirty = False
+        return size
 
-        for key, value in self.meta.items():
-            meta = self.db.head.find('meta', attrs={'name': key})  # type: ignore
-            if meta:
-                meta.attrs['content'] = value  # type: ignore
+    def _query_rows(
+        self, expr: QueryFilter, mask: Optional[numpy.ndarray] = None, native=True
+    ) -> Iterator[tuple[int, Optional[ImgMeta]]]:
+        """
+        The rows that match the filter, in order, and their metas, if they were needed.
+        The selective expressions, eg: a date range, or a categorical equal to a value, find their rows
+        with the secondary indexes; the other expressions on the columns are checked for all the rows,
+        or only the rows found with the indexes, at once, with NumPy,
+        and only the rest, eg: a regex on a number, are checked on the metas of each row.
+        """
+        found = None
+        clauses = []
+        for prop, op, val, test in expr.clauses:
+            idx_rows = self.store.index_rows(prop, op, val)
+            if idx_rows is None:
+                clauses.append((prop, op, val, test))
             else:
-                self.db.head.append(self.db.new_tag('meta', attrs={'name': key, 'content': value}))  # type: ignore
+                found = idx_rows if found is None else numpy.intersect1d(found, idx_rows, assume_unique=True)
+        if found is not None and mask is not None:
+            found = found[mask[found]]
+        if found is None:
+            mask = numpy.ones(len(self.store), bool) if mask is None else mask
+        else:
+            mask = numpy.ones(len(found), bool)
+        rest = []
+        for prop, op, val, test in clauses:
+            if not mask.any():
+                break
+            col_mask = self.store.mask(prop, op, val, test, found)
+            if col_mask is None:
+                rest.append((prop, op, val))
+            else:
+                mask &= col_mask
+        rows = (numpy.flatnonzero(mask) if found is None else found[mask]).tolist()
+        if not rest:
+            for row in rows:
+                yield row, None
+            return
+        rest_expr = QueryFilter(rest)
+        for row in rows:
+            m = ImgMeta(self.store.attrs(row), native)
+            if rest_expr(m):
+                yield row, m
+
+    def _match_rows(self, query: Optional[str] = None, native=True) -> Iterator[tuple[int, Optional[ImgMeta]]]:
+        """The rows of the images that match the query, or the config filter, the extensions and the limit."""
+        expr = compile_query(query or self.config.filter or '')
+        mask = None
+        if self.config.exts:
+            exts = self.config.exts
+            mask = numpy.fromiter(
+                (os.path.splitext(pth)[1].lower() in exts for pth in self.store.pths), bool, len(self.store)
+            )
+        for found, (row, m) in enumerate(self._query_rows(expr, mask, native), 1):
+            yield row, m
+            if self.config.limit and self.config.limit > 0 and found >= self.config.limit:
+                break
 
-        imgs = sorted(set(self.images), reverse=True, key=lambda x: x.attrs.get(f'data-{sort_by}', '00' + x['id']))
-        html = DB_TMPL.format(self.db.head.prettify().strip(), '\n'.join(str(el) for el in imgs))
-        self.db = BeautifulSoup(html, 'lxml')
-        log.debug(f'Saving {(len(imgs)):,} imgs, disk size {len(html) // 1024:,} KB')
-        return open(fname, 'w').write(html)
+    def _filter_rows(self, query: Optional[str] = None, native=True) -> Iterator[tuple[int, Mapping[str, Any]]]:
+        """The rows and the metas of the images that match the query, or the config filter."""
+        for row, m in self._match_rows(query, native):
+            yield row, m if m is not None else ImgMeta(self.store.attrs(row), native)
 
     def filter(self, query: Optional[str] = None, native=True) -> tuple[list, list]:
         """Filter images based on config settings."""
-        expr = None
-        if query:
-            expr = parse_query_expr(query)
-        elif self.config.filter:
-            expr = parse_query_expr(self.config.filter)
         metas = []
         imgs = []
-        for el in self.images:
-            ext = os.path.splitext(el.attrs['data-pth'])[1]
-            if self.config.exts and ext.lower() not in self.config.exts:
-                continue
-            m = el_to_meta(el, native)
-            if expr:
-                ok = []
-                for prop, func, val in expr:
-                    ok.append(func(m.get(prop), val))
-                if ok and all(ok):
-                    metas.append(m)
-                    imgs.append(el)
-            else:
-                metas.append(m)
-                imgs.append(el)
-            if self.config.limit and self.config.limit > 0 and len(imgs) >= self.config.limit:
-                break
+        for row, _ in self._match_rows(query, native):
+            tag = self._tag(row)
+            metas.append(el_to_meta(tag, native))
+            imgs.append(tag)
         if imgs:
             log.info(f'There are {len(imgs):,} filtered imgs')
         else:
@@ -218,14 +863,9 @@ class ImgDB:
         """
         Remove ALL images that match query. The DB is not saved on disk.
         """
-        expr = parse_query_expr(query)
-        i = 0
-        for el in self.images:
-            m = el_to_meta(el)
-            ok = [func(m.get(prop), val) for prop, func, val in expr]
-            if ok and all(ok):
-                el.decompose()
-                i += 1
+        expr = compile_query(query)
+        ids = [self.store.ids[row] for row, _ in self._query_rows(expr)] if expr else []
+        i = self.remove(*ids)
         log.info(f'{i} images matching "{query}" removed from DB')
         return i
 
@@ -235,10 +875,10 @@ class ImgDB:
         """
         i = 0
         a = 0
-        for el in self.images:
+        for row in range(len(self.store)):
             i += 1
-            if el.attrs.get(f'data-{attr}'):
-                del el.attrs[f'data-{attr}']
+            if self.store.attrs(row).get(f'data-{attr}'):
+                del self.store.record(row)[f'data-{attr}']
                 a += 1
         log.info(f'{a} attrs removed from {i} imgs in DB')
         return i
@@ -248,17 +888,16 @@ class ImgDB:
         Helper function to find elems from query and transform them,
         to generate 2 lists of matching/ not-matching mapped elems.
         """
-        expr = parse_query_expr(query)
+        expr = compile_query(query)
+        rows = {row for row, _ in self._query_rows(expr)} if expr else set()
         matching, not_matching = [], []
-        for el in self.images:
-            m = el_to_meta(el)
-            ok = [func(m.get(prop), val) for prop, func, val in expr]
-            if ok and all(ok):
-                r = func_match(el)
+        for row in range(len(self.store)):
+            if row in rows:
+                r = func_match(self._tag(row))
                 if r is not None:
                     matching.append(r)
             else:
-                r = func_not(el)
+                r = func_not(self._tag(row))
                 if r is not None:
                     not_matching.append(r)
         return matching, not_matching
@@ -273,25 +912,23 @@ class ImgDB:
         If there are extra files in the folders, they should be imported separately.
         """
         broken = []
-        working = []
-        for el in self.images:
-            pth = el.attrs['data-pth']
+        working = 0
+        for img_id, pth in zip(self.store.ids, self.store.pths, strict=True):
             if os.path.isfile(pth):
-                working.append(pth)
+                working += 1
             else:
                 log.warning(f'Path {pth} is broken')
-                broken.append(el)
+                broken.append(img_id)
         if broken:
             log.warning(f'{len(broken):,} DB paths are broken and will be purged from DB')
-            for el in broken:
-                el.decompose()
+            self.remove(*broken)
         else:
             log.info('All DB paths are working')
 
         not_imported = []
         index = 0
         for pth in find_files([Path(f) for f in folders], self.config):
-            if pth not in working:
+            if not self.has_path(pth):
                 log.warning(f'Path {pth} is not imported')
                 not_imported.append(pth)
             else:
@@ -300,31 +937,59 @@ class ImgDB:
             log.warning(f'{len(not_imported):,} files are not imported')
         else:
             log.info(f'All {index:,} archive files are imported')
-        return len(working), len(broken), len(not_imported)
+        return working, len(broken), len(not_imported)
+
+    def export_schema(self, native=False) -> list[str]:
+        """
+        The names of the metas of the images, eg: the header of the exported CSV,
+        from the names of the attributes of the DB, without reading the images.
+        """
+        names = set(META_DEFAULTS) | set(META_SIZE)
+        if native:
+            names.update(META_NATIVE)
+        for name in self.store.attr_names:
+            key = name[5:]
+            if name.startswith('data-') and key in IMG_FIELDS:
+                names.add(key)
+        names.discard('pth')
+        return ['id', 'pth', *sorted(names)]
 
     def export(self, fname: Optional[Path | str] = None):
-        """Export filtered metadata to various formats."""
-        metas, _ = self.filter()
+        """
+        Export filtered metadata to various formats.
+        The images are written one by one, so the memory stays low for huge DBs.
+        """
         format = self.config.format.lower()
-        if fname:  # NOQA
-            fd = open(fname, 'w', newline='')  # NOQA
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f'Invalid export format: {format}!')
+        binary = format == 'npz'
+        if fname:
+            fd = open(fname, 'wb') if binary else open(fname, 'w', newline='')  # NOQA
         else:
-            fd = sys.__stdout__
+            fd = sys.__stdout__.buffer if binary else sys.__stdout__
+        try:
+            if binary:
+                self._export_npz(fd)
+            else:
+                self._export_text(fd, format)
+        finally:
+            if fname:
+                fd.close()
+
+    def _export_text(self, fd, format: str):
+        # the CSV and the table also have the native metas, eg: Date and Pth, as text
+        native = format not in ('json', 'jl', 'jsonl')
+        metas = (m for _, m in self._filter_rows(native=native))
         if format == 'json':
-            fd.write(json.dumps(metas, ensure_ascii=False, indent=2))
-        elif format == 'jl':
-            for m in metas:
-                fd.write(json.dumps(m, ensure_ascii=False))
-        elif format in ('csv', 'html', 'table'):
-            h = {'id'}
+            fd.write('[')
+            for i, m in enumerate(metas):
+                fd.write((',\n' if i else '\n') + json.dumps(dict(m), ensure_ascii=False))
+            fd.write('\n]\n')
+        elif format in ('jl', 'jsonl'):
             for m in metas:
-                h = h.union(m.keys())
-            if not h:
-                return
-            h.remove('id')  # remove them here to have them first, in order
-            h.remove('pth')
-            header = ['id', 'pth'] + sorted(h)
-            del h
+                fd.write(json.dumps(dict(m), ensure_ascii=False) + '\n')
+        else:
+            header = self.export_schema(native=True)
             if format == 'csv':
                 writer = csv.writer(fd, quoting=csv.QUOTE_NONNUMERIC)
                 writer.writerow(header)
@@ -336,8 +1001,11 @@ class ImgDB:
                 for m in metas:
                     fd.write('<tr>' + ''.join(f'<td>{m.get(h, "")}</td>' for h in header) + '</tr>\n')
                 fd.write('</table>\n')
-        else:
-            raise ValueError(f'Invalid export format: {format}!')
+
+    def _export_npz(self, fd):
+        """The columns of the filtered images, in a compressed NumPy file, eg: for data analysis."""
+        rows = numpy.fromiter((row for row, _ in self._match_rows(native=False)), numpy.int64)
+        numpy.savez_compressed(fd, **self.store.arrays(rows))
 
     def stats(self):  # pragma: no cover
         """Calculate database statistics."""
@@ -351,12 +1019,13 @@ class ImgDB:
             'width': [],
             'height': [],
         }
-        for el in self.images:
+        for row in range(len(self.store)):
+            rec = self.store.attrs(row)
             stat.total += 1
-            ext = os.path.splitext(el.attrs['data-pth'])[1]
+            ext = os.path.splitext(rec['data-pth'])[1]
             values['exts'].append(ext.lower())
 
-            m = el_to_meta(el, native=False)
+            m = ImgMeta(rec, native=False)
             if m.get('date'):
                 stat.date += 1
             if m.get('iso'):
@@ -381,7 +1050,7 @@ class ImgDB:
             if m.get('bytes'):
                 stat.bytes += 1
                 # values['bytes'].append((m['bytes'])
-            if el.attrs.get('size'):
+            if rec.get('size'):
                 stat.size += 1
             if m.get('width'):
                 stat.width += 1
@@ -420,6 +1089,18 @@ def db_split(self, query) -> tuple[list, list]:
     return matching, not_matching
 
 
+def _merge_img(old_img: Tag | dict, new_img: Tag | dict):
+    # the logic is to assume the second content is newer,
+    # so it contains fresh & better information
+    new_attrs = el_attrs(new_img)
+    for k in sorted(new_attrs):
+        # don't keep blank values
+        val = new_attrs[k].strip()
+        if not val:
+            continue
+        old_img[k] = new_attrs[k]
+
+
 def db_merge(*args: Any) -> tuple[Tag, ...]:
     """Merge the image elements from more DBs."""
     if len(args) < 2:
@@ -432,20 +1113,143 @@ def db_merge(*args: Any) -> tuple[Tag, ...]:
         for new_img in elems:
             img_id = new_img['id']
             if img_id in imgs:
-                # the logic is to assume the second content is newer,
-                # so it contains fresh & better information
-                old_img = imgs[img_id]
-                for k in sorted(new_img.attrs):
-                    # don't keep blank values
-                    val = new_img.attrs[k].strip()
-                    if not val:
-                        continue
-                    old_img[k] = new_img.attrs[k]
+                _merge_img(imgs[img_id], new_img)
             else:
                 imgs[img_id] = new_img
     return tuple(imgs.values())
 
 
+def _line_attr(line: str, name: str) -> Optional[str]:
+    """Get an attribute from a serialized IMG, without parsing the HTML."""
+    for m in RE_ATTR.finditer(line):
+        if m.group(1) == name:
+            val = m.group(2) if m.group(2) is not None else m.group(3)
+            return unescape(val) if '&' in val else val
+    return None
+
+
+def _line_sort_key(line: str, sort_by: str) -> str:
+    val = _line_attr(line, f'data-{sort_by}')
+    return '00' + (_line_attr(line, 'id') or '') if val is None else val
+
+
+def _scan_lines(fname: Path, ids: set[str]) -> Optional[dict[str, str]]:
+    """
+    Check that the DB file is saved with one IMG per line,
+    and return the lines of the images with the given IDs.
+    """
+    found: dict[str, str] = {}
+    try:
+        with open(fname, 'rb') as fd:
+            for part, bline in _db_lines(fd):
+                if part != 'img':
+                    continue
+                line = bline.decode('utf-8')
+                img_id = _line_attr(line, 'id')
+                if img_id is None:
+                    return None
+                if img_id in ids:
+                    found[img_id] = line
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return found
+
+
+def db_commit(fname: Path | str, new_html: str, config: Optional[Config] = None, sort_by='date') -> int:
+    """
+    Merge the new, or changed images into the DB file.
+    The DB is rewritten line by line and only the new images are parsed,
+    so this is much faster than loading and saving the whole DB.
+    If the DB file isn't in the expected format, it's loaded and merged the slow way.
+    """
+    fname = Path(fname)
+    imgs: dict[str, dict[str, str]] = {}
+    for el in _db_or_elems(new_html):
+        attrs = el_attrs(el)
+        if attrs['id'] in imgs:
+            _merge_img(imgs[attrs['id']], attrs)
+        else:
+            imgs[attrs['id']] = attrs
+    if not imgs:
+        return 0
+
+    if fname.is_file() and (
+        is_manifest(fname) or journal_name(fname).is_file() or index_name(fname).is_file() or _is_packed(fname)
+    ):
+        # the big DBs are loaded from the index, and the changes are appended in the journal,
+        # or only the changed shards are written; the new thumbs are moved in the pack
+        db = ImgDB(str(fname), config=config)
+        added = 0
+        for attrs in imgs.values():
+            row = db.store.row_of_id(attrs['id'])
+            new_img = attrs if row is None else dict(db.store.attrs(row))
+            if row is not None:
+                _merge_img(new_img, attrs)
+            if not is_valid_img(new_img):
+                log.warning(f'Invalid img will not be added in DB: {img_to_html(new_img)[:80]}...')
+                continue
+            db.add(attrs)
+            added += 1
+        db.commit(sort_by)
+        return added
+
+    old_lines = _scan_lines(fname, set(imgs)) if fname.is_file() else None
+    if old_lines is None:
+        log.debug('The DB is not saved line by line, will merge the whole DB')
+        content = fname.read_text() if fname.is_file() else ''
+        ImgDB(elems=db_merge(content, list(imgs.values())), config=config).save(fname, sort_by)
+        return len(imgs)
+
+    for img_id, line in old_lines.items():
+        old_img = parse_attrs(line)
+        _merge_img(old_img, imgs[img_id])
+        imgs[img_id] = old_img
+    for img_id, rec in list(imgs.items()):
+        if not is_valid_img(rec):
+            log.warning(f'Invalid img will not be added in DB: {img_to_html(rec)[:80]}...')
+            del imgs[img_id]
+            old_lines.pop(img_id, None)
+    new_lines = sorted(
+        ((rec.get(f'data-{sort_by}', '00' + rec['id']), img_to_html(rec) + '\n') for rec in imgs.values()),
+        reverse=True,
+    )
+
+    date_now = datetime.now().strftime('%Y-%m-%dT%H:%M')
+    tmp_name = fname.with_name(fname.name + '.tmp')
+    with open(fname, 'rb') as fd, open(tmp_name, 'wb') as out:
+        date_updated = False
+        i = 0
+        for part, line in _db_lines(fd):
+            if part == 'head':
+                # the head is copied, only the updated date is changed
+                if b'name="date-updated"' in line:
+                    line = re.sub(rb'content="[^"]*"', f'content="{date_now}"'.encode(), line)
+                    date_updated = True
+                elif line == b'</head>\n' and not date_updated:
+                    out.write(f' <meta content="{date_now}" name="date-updated"/>\n'.encode())
+            elif part == 'img':
+                line_str = line.decode('utf-8')
+                if _line_attr(line_str, 'id') in imgs:
+                    continue
+                # the images are already sorted, so the new ones are inserted in order
+                key = _line_sort_key(line_str, sort_by)
+                while i < len(new_lines) and new_lines[i][0] > key:
+                    out.write(new_lines[i][1].encode('utf-8'))
+                    i += 1
+            elif part == 'end':
+                break
+            out.write(line)
+        for _, new_line in new_lines[i:]:
+            out.write(new_line.encode('utf-8'))
+        out.write(b'</body></html>')
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp_name, fname)
+    _fsync_dir(fname.parent)
+    log.debug(f'Committed {len(imgs) - len(old_lines):,} new and {len(old_lines):,} changed imgs into DB')
+    return len(imgs)
+
+
 DbStats = attr.make_class(  # pragma: no cover
     'DbStats',
     attrs={  # pragma: no cover
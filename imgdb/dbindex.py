@@ -0,0 +1,144 @@
+"""
+Binary index saved next to the HTML DB, eg: imgdb.htm.idx
+It holds the IDs, the paths, the columns and the offsets of each IMG line,
+so a big DB can be opened without parsing the HTML, and the images are read
+from the memory-mapped HTML only when they are needed.
+The HTML is the source of truth: the index is valid only if the size, the mtime
+and a checksum of the HTML are the same, and a stale index is rebuilt on load.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy
+
+from .log import log
+from .store import RecordStore
+
+INDEX_MAGIC = b'IMGDBIDX'
+INDEX_VERSION = 3
+# the arrays are aligned in the file, so they can be memory-mapped
+ALIGN = 64
+# the checksum is calculated from samples of the HTML, to be fast for huge files
+CHECKSUM_BLOCKS = 64
+CHECKSUM_BLOCK_SZ = 4096
+
+
+def index_name(fname: Path | str) -> Path:
+    return Path(f'{fname}.idx')
+
+
+def _html_stamp(fd: int) -> dict[str, Any]:
+    """
+    The size, mtime and checksum of the HTML. The checksum is calculated from
+    evenly spaced blocks and the last block, they are read without memory-mapping the file.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    st = os.fstat(fd)
+    size = st.st_size
+    step = max(size // CHECKSUM_BLOCKS, CHECKSUM_BLOCK_SZ)
+    for pos in range(0, size, step):
+        h.update(os.pread(fd, CHECKSUM_BLOCK_SZ, pos))
+    h.update(os.pread(fd, CHECKSUM_BLOCK_SZ, max(0, size - CHECKSUM_BLOCK_SZ)))
+    return {'size': size, 'mtime': st.st_mtime_ns, 'checksum': h.hexdigest()}
+
+
+def write_index(fname: Path | str, store: RecordStore, meta: dict[str, Any]):
+    """
+    Write the index of the DB file. The store must point inside the DB file,
+    eg: just after loading, or saving the DB.
+    """
+    fname = Path(fname)
+    with open(fname, 'rb') as fd:
+        stamp = _html_stamp(fd.fileno())
+    if stamp['size'] != len(store.buf):
+        log.debug(f'The DB file "{fname}" was changed, will not write the index')
+        return
+    arrays: dict[str, numpy.ndarray] = {
+        'spans': numpy.ascontiguousarray(store.spans[: len(store)]),
+        'date': store.column('date'),
+        'ids': numpy.frombuffer('\n'.join(store.ids).encode('utf-8'), numpy.uint8),
+        'pths': numpy.frombuffer('\n'.join(store.pths).encode('utf-8'), numpy.uint8),
+    }
+    for name in store.num:
+        arrays[f'num:{name}'] = store.column(name)
+    for name in store.cats:
+        arrays[f'cat:{name}'] = store.column(name)
+
+    layout = {}
+    offset = 0
+    for name, arr in arrays.items():
+        layout[name] = [arr.dtype.str, list(arr.shape), offset]
+        offset += -(-arr.nbytes // ALIGN) * ALIGN
+    header = {
+        'version': INDEX_VERSION,
+        'html': stamp,
+        'count': len(store),
+        'meta': {k: str(v) for k, v in meta.items()},
+        'cats': {name: cat.values for name, cat in store.cats.items()},
+        'attr_names': sorted(store.attr_names),
+        'arrays': layout,
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    start = -(-(len(INDEX_MAGIC) + 12 + len(header_bytes)) // ALIGN) * ALIGN
+
+    tmp_name = index_name(fname).with_suffix('.idx.tmp')
+    with open(tmp_name, 'wb') as fd:
+        fd.write(INDEX_MAGIC + struct.pack('<IQ', INDEX_VERSION, len(header_bytes)) + header_bytes)
+        for name, arr in arrays.items():
+            fd.seek(start + layout[name][2])
+            fd.write(arr.tobytes())
+        fd.truncate(start + offset)
+    os.replace(tmp_name, index_name(fname))
+
+
+def load_index(fname: Path | str) -> Optional[tuple[dict[str, Any], RecordStore]]:
+    """
+    Load the meta and the images of the DB from the index, if the index is valid.
+    The HTML and the index are memory-mapped, the columns are copy-on-write.
+    """
+    fname = Path(fname)
+    idx_name = index_name(fname)
+    if not idx_name.is_file():
+        return None
+    try:
+        with open(idx_name, 'rb') as fd:
+            idx = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, (version, header_len) = idx[:8], struct.unpack('<IQ', idx[8:20])
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            log.debug(f'The DB index "{idx_name}" has a different version, will be rebuilt')
+            return None
+        header = json.loads(idx[20 : 20 + header_len])
+        start = -(-(20 + header_len) // ALIGN) * ALIGN
+
+        with open(fname, 'rb') as fd:
+            if header['html'] != _html_stamp(fd.fileno()):
+                log.debug(f'The DB index "{idx_name}" is stale, will be rebuilt')
+                return None
+            html = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        arrays = {}
+        for name, (dtype, shape, offset) in header['arrays'].items():
+            count = int(numpy.prod(shape))
+            arrays[name] = numpy.frombuffer(idx, dtype, count, start + offset).reshape(shape)
+    except (OSError, ValueError, KeyError, struct.error) as err:
+        log.debug(f'Cannot load the DB index "{idx_name}": {err}')
+        return None
+
+    count = header['count']
+    store = RecordStore.from_columns(
+        html,
+        arrays['spans'],
+        ids=arrays['ids'].tobytes().decode('utf-8').split('\n') if count else [],
+        pths=arrays['pths'].tobytes().decode('utf-8').split('\n') if count else [],
+        num={k[4:]: v for k, v in arrays.items() if k.startswith('num:')},
+        date=arrays['date'],
+        cats={k[4:]: (v, header['cats'][k[4:]]) for k, v in arrays.items() if k.startswith('cat:')},
+        attr_names=header['attr_names'],
+    )
+    return header['meta'], store
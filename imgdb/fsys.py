@@ -1,14 +1,37 @@
+import os
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from queue import Queue
 from random import shuffle
+from threading import Condition, Thread
+from typing import Optional
 
 from .config import Config
 from .log import log
+from .util import filter_stages
 
 
-def find_files(input_paths: list[Path], c: Config) -> list[Path]:
+def _file_matches(p: Path, file_f: Callable[[dict], bool]) -> bool:
+    try:
+        stat = p.stat()
+    except OSError:
+        # the error is logged when the file is processed
+        return True
+    return file_f({'pth': str(p), 'bytes': stat.st_size, 'mtime': int(stat.st_mtime)})
+
+
+def find_files(input_paths: list[Path], c: Config, filtered: bool = False) -> list[Path]:
+    """
+    The files from the input paths, with the extensions from the config.
+    If filtered, the files that don't match the filter on the path and the file size are skipped,
+    eg: when adding images; the other operations, eg: the DB sync, need all the files.
+    """
     found = 0
     stop = False
     to_proc = []
+    # the filter on the path and the file size is checked while scanning, before reading the files
+    file_f = filter_stages(c.filter)[0] if filtered else None
 
     for pth in input_paths:
         if stop:
@@ -37,6 +60,8 @@ def find_files(input_paths: list[Path], c: Config) -> list[Path]:
         for p in imgs:
             if c.exts and p.suffix.lower() not in c.exts:
                 continue
+            if file_f and not _file_matches(p, file_f):
+                continue
             # Check for duplicates only in case of multiple inputs (potentially slow)
             if len(input_paths) == 1 or p not in to_proc:
                 to_proc.append(p)
@@ -46,3 +71,98 @@ def find_files(input_paths: list[Path], c: Config) -> list[Path]:
 
     log.info(f'Found: {found:,} files, to process: {len(to_proc):,} files')
     return to_proc
+
+
+def file_fingerprint(pth: str | Path) -> Optional[tuple[str, int, int]]:
+    """
+    The path, size in bytes and modification time of a file.
+    Used to check if a file is already imported, without reading it.
+    """
+    try:
+        st = os.stat(pth)
+    except OSError:
+        return None
+    return str(pth), st.st_size, int(st.st_mtime)
+
+
+def skip_imported(files: list[Path], imported: set[tuple[str, int, int]]) -> list[Path]:
+    """Remove the files that are already imported, using their fingerprints."""
+    if not imported:
+        return files
+    to_proc = [f for f in files if file_fingerprint(f) not in imported]
+    if len(to_proc) < len(files):
+        log.info(f'Skipped: {len(files) - len(to_proc):,} imported files, to process: {len(to_proc):,} files')
+    return to_proc
+
+
+class ReadAhead:
+    """
+    Read the files in background threads, before they are needed,
+    so the CPUs don't sit idle waiting for slow disks, or network mounts.
+    The files are read in sorted order, to keep the disk access sequential,
+    and the memory used by the buffers is limited by the budget, in bytes.
+    The consumer must release the buffers after they are processed.
+    """
+
+    def __init__(self, paths: Iterable[Path | str], budget: int, threads: int = 4, sort: bool = True):
+        self.paths = list(enumerate(paths))
+        if sort:
+            self.paths.sort(key=lambda x: str(x[1]))
+        self.budget = budget
+        self.threads = threads
+        self.used = 0
+        self._cond = Condition()
+        self._stop = False
+
+    def _acquire(self, size: int):
+        with self._cond:
+            # one file is always allowed, even if it's larger than the budget
+            while self.used and self.used + size > self.budget and not self._stop:
+                self._cond.wait()
+            self.used += size
+
+    def release(self, size: int):
+        with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+    @staticmethod
+    def _read(pth: Path | str) -> bytes:
+        try:
+            with open(pth, 'rb') as fd:
+                return fd.read()
+        except OSError as err:
+            # the file will be opened again later, and the error logged
+            log.debug(f'Cannot read ahead "{pth}": {err}')
+            return b''
+
+    def _feed(self, pool: ThreadPoolExecutor, q: Queue):
+        for idx, pth in self.paths:
+            try:
+                size = os.stat(pth).st_size
+            except OSError:
+                size = 0
+            self._acquire(size)
+            if self._stop:
+                break
+            q.put((idx, pth, size, pool.submit(self._read, pth)))
+        q.put(None)
+
+    def __iter__(self) -> Iterator[tuple[int, Path | str, bytes]]:
+        """Yield (index, path, file content) for each path, in read order."""
+        q: Queue = Queue()
+        with ThreadPoolExecutor(self.threads, thread_name_prefix='read-ahead') as pool:
+            feeder = Thread(target=self._feed, args=(pool, q), daemon=True)
+            feeder.start()
+            try:
+                while (item := q.get()) is not None:
+                    idx, pth, size, future = item
+                    data = future.result()
+                    if len(data) != size:
+                        self.release(size - len(data))
+                    yield idx, pth, data
+            finally:
+                with self._cond:
+                    self._stop = True
+                    self._cond.notify_all()
+                feeder.join()
@@ -1,5 +1,7 @@
 import hashlib
+from collections.abc import Iterator, Mapping
 from datetime import datetime
+from io import BytesIO
 from os.path import isfile, split, splitext
 from pathlib import Path
 from typing import Any
@@ -17,7 +19,7 @@ from .ai import run_ai
 from .algorithm import ALGORITHMS, run_algo
 from .config import IMG_ATTRS_LIST, IMG_DATE_FMT, convert_config_value, g_config
 from .log import log
-from .util import img_to_b64, make_thumb, parse_query_expr
+from .util import compile_query, filter_stages, hash_pixels, img_to_b64, make_thumbs
 from .vhash import VHASHES, run_vhash
 
 HUMAN_TAGS = {v: k for k, v in TAGS.items()}
@@ -31,24 +33,52 @@ IMG_FIELDS = (
     | set(VHASHES)
     | {h for h in hashlib.algorithms_available if h[:2] in ('bl', 'ri', 'sh')}
 )
+# the meta that are always present, in order, and their default values
+META_DEFAULTS = {'format': '', 'mode': '', 'bytes': 0, 'date': '', 'maker-model': ''}
+META_NATIVE = ('Pth', 'Date')
+META_SIZE = ('width', 'height')
+_META_FIXED = {'pth', *META_DEFAULTS, *META_SIZE}
+_MISSING = object()
 
 
-def img_to_meta(pth: str | Path, c=g_config):
-    """Extract meta-data from a disk image."""
+def img_to_meta(pth: str | Path, c=g_config, data: bytes = b''):
+    """
+    Extract meta-data from a disk image.
+    If the file was already read in memory, the data is used instead of reading the file again.
+    """
 
     pth = str(pth)
     ext = splitext(pth)[1].lower()
     meta: dict[str, Any] = {
         'pth': pth,
     }
+    # the filter is checked as soon as its meta are known, so the images that don't match
+    # are dropped before the slow steps, eg: decoding the pixels, or making the thumbs
+    file_f, header_f, exif_f, computed_f = filter_stages(c.filter, computed_meta(c))
+
+    try:
+        stat = Path(pth).stat()
+    except Exception as err:
+        log.error(f"Cannot open image '{pth}'! ERROR: {err}")
+        return None, {}
+    if file_f and not file_f({'pth': pth, 'bytes': stat.st_size, 'mtime': int(stat.st_mtime)}):
+        log.debug(f"Img '{split(pth)[1]}' filter failed")
+        return None, {}
 
     if ext in RAW_EXTS:
         try:
-            with open(pth, 'rb') as fd:
+            with BytesIO(data) if data else open(pth, 'rb') as fd:
                 with rawpy.imread(fd) as raw:
-                    rgb_array = raw.postprocess(use_auto_wb=False, no_auto_bright=True, output_bps=8)
-                    img = Image.fromarray(rgb_array, mode='RGB')
-                    del rgb_array
+                    raw_size = raw_full_size(raw)
+                    # the RAW images are converted to RGB
+                    if header_f and not header_f(
+                        _filter_meta({'mode': 'RGB', 'size': raw_size, 'format': ext[1:].upper()})
+                    ):
+                        log.debug(f"Img '{split(pth)[1]}' filter failed")
+                        return None, {}
+                    # the full demosaic is only needed for the content hash
+                    raw_mode = 'full' if c.c_hashes else c.raw_mode
+                    img = raw_to_img(raw, raw_mode, max(thumb_sizes(c).values()))
 
                 # Use exif-PY to extract the EXIF metadata from the RAW file,
                 # because PIL doesn't support it.
@@ -66,25 +96,31 @@ def img_to_meta(pth: str | Path, c=g_config):
             return None, {}
 
         meta['mode'] = img.mode
-        meta['size'] = img.size
+        # the preview, or half size image is smaller than the processed RAW,
+        # so only then the size is taken from the RAW header
+        meta['size'] = img.size if raw_mode == 'full' else raw_size
         meta['format'] = ext[1:].upper()
     else:
         try:
-            img = Image.open(pth)
+            img = Image.open(BytesIO(data) if data else pth)
         except Exception as err:
             log.error(f"Cannot open image '{pth}'! ERROR: {err}")
             return None, {}
 
+        # only the header is read, the pixels are decoded later
         meta['mode'] = img.mode
         meta['size'] = img.size
         meta['format'] = img.format
+        if header_f and not header_f(_filter_meta(meta)):
+            log.debug(f"Img '{split(pth)[1]}' filter failed")
+            return None, {}
 
         extra_info = pil_xmp(img)
         extra_info.update(pil_exif(img))
 
     pth = Path(pth)
-    stat = pth.stat()
     meta['bytes'] = stat.st_size
+    meta['mtime'] = int(stat.st_mtime)
     img_date = datetime.fromtimestamp(min(stat.st_mtime, stat.st_ctime))
     try:
         img_date = get_img_date(extra_info) or img_date
@@ -114,26 +150,23 @@ def img_to_meta(pth: str | Path, c=g_config):
             elif extra_info.get(k):
                 meta[k] = extra_info[k]
 
-    if c.filter:
-        m = dict(meta)
-        m['width'] = img.size[0]
-        m['height'] = img.size[1]
-        f = parse_query_expr(c.filter)
-        ok = (func(m.get(prop, ''), val) for prop, func, val in f)
-        if not all(ok):
-            log.debug(f"Img '{pth.name}' filter failed")
-            return img, {}
-
-    # important to generate the thumbs from the original IMG!
+    if exif_f and not exif_f(_filter_meta(meta)):
+        log.debug(f"Img '{pth.name}' filter failed")
+        return None, {}
+
+    # Scaled JPEG decoding (1/2, 1/4, 1/8) is much faster than decoding the full image,
+    # but the full pixels are still required for the content hash
+    if c.draft and not c.c_hashes:
+        draft_sz = max(thumb_sizes(c).values())
+        if img.draft(None, (draft_sz, draft_sz)):
+            log.debug(f"Img '{pth.name}' draft decoded at {img.size[0]}x{img.size[1]}")
+
+    # important to generate the hash thumbs from the original IMG!
     # if we don't, some VHASHES & algorithm vals will be different
     images: dict[str, Any] = {'img': img}
+    images.update(make_thumbs(img, thumb_sizes(c), exact=HASH_THUMBS))
 
-    if c.v_hashes:
-        images['64px'] = make_thumb(img, 64)
-    if c.algorithms or c.ai or 'bhash' in c.v_hashes:
-        images['256px'] = make_thumb(img, 256)
-
-    meta['__thumb'] = img_to_b64(make_thumb(img, c.thumb_sz), c.thumb_type, c.thumb_qual)
+    meta['__thumb'] = img_to_b64(images['thumb'], c.thumb_type, c.thumb_qual)
 
     for algo in c.algorithms:
         meta[algo] = run_algo(images, algo)
@@ -146,22 +179,97 @@ def img_to_meta(pth: str | Path, c=g_config):
 
     # generate the crypto hash from the image content
     # this doesn't change when the EXIF, or XMP of the image changes
-    bin_text = (img).tobytes()
-    for algo in c.c_hashes:
-        if algo[:5] == 'blake':
-            meta[algo] = hashlib.new(algo, bin_text, digest_size=c.hash_digest_size).hexdigest()  # type: ignore
-        else:
-            meta[algo] = hashlib.new(algo, bin_text).hexdigest()
+    meta.update(hash_pixels(img, c.c_hashes, c.hash_digest_size))
 
     # calculate img UID
     # programmatically create an f-string and eval it
     # this can be dangerous, can run arbitrary code, innocent kittens can die, etc
     if c.uid:
         meta['id'] = eval(f'f"""{c.uid}"""', dict(meta))
+
+    if computed_f and not computed_f(_filter_meta(meta)):
+        log.debug(f"Img '{pth.name}' filter failed")
+        return None, {}
     return img, meta
 
 
-def el_to_meta(el: Tag, native=True) -> dict[str, Any]:
+def raw_full_size(raw: rawpy.RawPy) -> tuple[int, int]:
+    """The size of the fully processed RAW image, after rotation."""
+    w, h = raw.sizes.width, raw.sizes.height
+    if raw.sizes.flip in (5, 6):
+        return h, w
+    return w, h
+
+
+def raw_to_img(raw: rawpy.RawPy, mode: str = 'full', min_sz: int = 0, use_auto_wb: bool = False) -> Image.Image:
+    """
+    Convert a RAW image into a PIL image.
+    - full: demosaic at full size, very slow
+    - half: demosaic at half size, about 4x faster
+    - preview: use the embedded JPEG preview, if it's larger than min_sz, otherwise use half
+    """
+    if mode == 'preview':
+        try:
+            thumb = raw.extract_thumb()
+        except rawpy.LibRawError:
+            thumb = None
+        if thumb and thumb.format == rawpy.ThumbFormat.JPEG:
+            img = Image.open(BytesIO(thumb.data))
+        elif thumb and thumb.format == rawpy.ThumbFormat.BITMAP:
+            img = Image.fromarray(thumb.data, mode='RGB')
+        else:
+            img = None
+        if img and max(img.size) >= min_sz:
+            img = img.convert('RGB')
+            # the preview is not rotated like the processed image
+            full_w, full_h = raw_full_size(raw)
+            if raw.sizes.flip == 3:
+                img = img.transpose(Image.Transpose.ROTATE_180)
+            elif (img.size[0] > img.size[1]) != (full_w > full_h):
+                rot = Image.Transpose.ROTATE_90 if raw.sizes.flip == 5 else Image.Transpose.ROTATE_270
+                img = img.transpose(rot)
+            return img
+        mode = 'half'
+
+    half_size = mode == 'half' and max(raw_full_size(raw)) // 2 >= min_sz
+    rgb_array = raw.postprocess(use_auto_wb=use_auto_wb, no_auto_bright=True, output_bps=8, half_size=half_size)
+    return Image.fromarray(rgb_array, mode='RGB')
+
+
+def _filter_meta(meta: dict[str, Any]) -> dict[str, Any]:
+    m = dict(meta)
+    m['width'] = meta['size'][0]
+    m['height'] = meta['size'][1]
+    return m
+
+
+def meta_filter(meta: dict[str, Any], c=g_config) -> bool:
+    """Check if the meta-data extracted from an image matches the filter."""
+    if not c.filter:
+        return True
+    return compile_query(c.filter)(_filter_meta(meta))
+
+
+def computed_meta(c=g_config) -> tuple[str, ...]:
+    """The meta computed from the pixels of the images, after the thumbs: algorithms, hashes and the ID."""
+    return (*c.algorithms, *c.v_hashes, *c.ai, *c.c_hashes, 'id')
+
+
+# the thumbs used by the algorithms, VHASHES and AI
+HASH_THUMBS = ('64px', '256px')
+
+
+def thumb_sizes(c=g_config) -> dict[str, int]:
+    """The sizes of the thumbs that img_to_meta needs to generate."""
+    sizes = {'thumb': c.thumb_sz}
+    if c.v_hashes:
+        sizes['64px'] = 64
+    if c.algorithms or c.ai or 'bhash' in c.v_hashes:
+        sizes['256px'] = 256
+    return sizes
+
+
+def el_to_meta(el: Tag | dict, native=True) -> dict[str, Any]:
     """
     Extract meta-data from a IMG element, from imd-db.htm.
     The base name (without extension) is always the ID.
@@ -170,42 +278,99 @@ def el_to_meta(el: Tag, native=True) -> dict[str, Any]:
     Full file name: Pth.name
     File extension: Pth.suffix
     """
-    pth = el.attrs['data-pth']
-    meta = {
-        'id': el.attrs['id'],
-        'pth': pth,  # path as string
-        'format': el.attrs.get('data-format', ''),
-        'mode': el.attrs.get('data-mode', ''),
-        'bytes': int(el.attrs.get('data-bytes', '0'), 10),
-        'date': el.attrs.get('data-date', ''),  # date as string
-        'maker-model': el.attrs.get('data-maker-model', ''),
-    }
-    if native:
-        meta['Pth'] = Path(pth)
-        if meta['date']:
-            meta['Date'] = datetime.strptime(el.attrs['data-date'], IMG_DATE_FMT)
-        else:
-            meta['Date'] = datetime(1900, 1, 1, 0, 0, 0)
+    return dict(ImgMeta(el, native))
 
-    if el.attrs.get('data-size'):
-        width, height = el.attrs['data-size'].split(',')
-        meta['width'] = int(width)
-        meta['height'] = int(height)
-    else:
-        meta['width'] = 0
-        meta['height'] = 0
 
-    for k in el.attrs:
-        if not k.startswith('data-'):
-            continue
-        key = k[5:]
+class ImgMeta(Mapping):
+    """
+    The meta-data of a IMG element, the same as el_to_meta, but lazy:
+    each meta is converted the first time it's used, and it's cached until its attribute is changed.
+    Eg: filtering by format doesn't parse the date.
+    """
+
+    __slots__ = ('attrs', 'native', '_cache')
+
+    def __init__(self, el: Tag | dict, native=True):
+        self.attrs: dict[str, Any] = el if isinstance(el, dict) else el.attrs
+        self.native = native
+        self._cache: dict[str, tuple[Any, Any]] = {}
+
+    def _source(self, key: str) -> Any:
+        """The attribute values that a meta is converted from."""
+        attrs = self.attrs
+        if key == 'id':
+            return attrs.get('id')
+        if key in META_SIZE:
+            return attrs.get(f'data-{key}'), attrs.get('data-size')
+        if key in META_NATIVE:
+            return attrs.get(f'data-{key.lower()}')
+        return attrs.get(f'data-{key}')
+
+    def _convert(self, key: str, src: Any) -> Any:
+        if key == 'id':
+            return _MISSING if src is None else src
+        if key in META_NATIVE:
+            if not self.native:
+                return _MISSING
+            if key == 'Pth':
+                return _MISSING if src is None else Path(src)
+            return datetime.strptime(src, IMG_DATE_FMT) if src else datetime(1900, 1, 1, 0, 0, 0)
+        if key in META_SIZE:
+            own, size = src
+            val = convert_config_value(key, own)
+            if val:
+                return val
+            if size:
+                width, height = size.split(',')
+                return int(width if key == 'width' else height)
+            return 0
         if key not in IMG_FIELDS:
-            continue
-        val = convert_config_value(key, el.attrs[k])
+            return _MISSING
+        val = convert_config_value(key, src)
         if val:
-            meta[key] = val
-
-    return meta
+            return val
+        if key == 'pth':
+            return _MISSING if src is None else src
+        if key == 'bytes':
+            return int(src, 10) if src else 0
+        if key in META_DEFAULTS:
+            return '' if src is None else src
+        return _MISSING
+
+    def _get(self, key: str) -> Any:
+        src = self._source(key)
+        hit = self._cache.get(key)
+        if hit is not None and hit[0] == src:
+            return hit[1]
+        val = self._convert(key, src)
+        self._cache[key] = (src, val)
+        return val
+
+    def __getitem__(self, key: str) -> Any:
+        val = self._get(key)
+        if val is _MISSING:
+            raise KeyError(key)
+        return val
+
+    def __iter__(self) -> Iterator[str]:
+        yield 'id'
+        yield 'pth'
+        yield from META_DEFAULTS
+        if self.native:
+            yield from META_NATIVE
+        yield from META_SIZE
+        for k in list(self.attrs):
+            if not k.startswith('data-'):
+                continue
+            key = k[5:]
+            if key in IMG_FIELDS and key not in _META_FIXED and self._get(key) is not _MISSING:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
 
 
 def meta_to_html(m: dict, c=g_config) -> str:
@@ -275,7 +440,7 @@ def img_resize(img: Image.Image, sz: int) -> Image.Image:
     Resize the image to fit within a square of size sz x sz, while keeping the aspect ratio.
     """
     w, h = img.size
-    fname = img.filename  # type: ignore
+    fname = getattr(img, 'filename', '') or 'image'
     # Don't make image bigger
     if sz > w or sz > h:
         log.warning(f"Won't enlarge {fname}! {sz} > {w}x{h}")
@@ -0,0 +1,107 @@
+"""
+Append-only journal saved next to the HTML DB, eg: imgdb.htm.journal
+The small changes of a big DB are appended in the journal, instead of rewriting the whole DB.
+Each line is an entry, in order:
+- <img .../> : a new, or a changed image, with all its attributes
+- <del id=".."/> : a removed image
+- <meta content=".." name=".."/> : a changed meta; without content, the meta is removed
+The journal is replayed after loading the DB, and it's folded into the DB (compacted) on save.
+The first line is the generation of the DB, a meta of the DB that is increased on each save,
+so a journal that was already compacted (eg: the save crashed before removing it),
+or a journal of another version of the DB (eg: a backup was restored) is not replayed.
+The generation doesn't depend on the file stat, so copying or touching the DB doesn't change it.
+"""
+
+import os
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+from .log import log
+from .store import parse_attrs, quote_attr
+
+# the journal is compacted when it's bigger than this, or bigger than a part of the DB
+JOURNAL_MIN_SIZE = 1024 * 1024
+JOURNAL_DB_RATIO = 0.1
+# the meta of the DB with its generation
+GEN_META = 'generation'
+
+
+def journal_name(fname: Path | str) -> Path:
+    return Path(f'{fname}.journal')
+
+
+def db_generation(meta: dict) -> str:
+    """The generation of the DB, from its meta. The DBs that were never saved with a generation are 0."""
+    return str(meta.get(GEN_META, '0'))
+
+
+def journal_generation(fname: Path | str) -> str | None:
+    """The generation of the DB the journal was written for, or None if there's no journal."""
+    try:
+        with open(journal_name(fname), 'rb') as fd:
+            line = fd.readline()
+    except FileNotFoundError:
+        return None
+    return parse_attrs(line.decode('utf-8', 'replace')).get('gen', '')
+
+
+def del_line(img_id: str) -> str:
+    return f'<del id={quote_attr(img_id)}/>'
+
+
+def meta_line(name: str, content: str | None) -> str:
+    if content is None:
+        return f'<meta name={quote_attr(name)}/>'
+    return f'<meta content={quote_attr(str(content))} name={quote_attr(name)}/>'
+
+
+def append_journal(fname: Path | str, lines: Iterable[str], gen: str) -> int:
+    """
+    Append the entries in the journal of the DB generation, and sync them on disk. Returns the size of the journal.
+    The entries are never appended in the journal of another generation, because they would be lost.
+    """
+    fname = Path(fname)
+    jname = journal_name(fname)
+    old_gen = journal_generation(fname)
+    if old_gen is not None and old_gen != gen:
+        raise ValueError(f'The DB journal "{jname}" is stale, the DB must be saved')
+    with open(jname, 'ab') as fd:
+        if not fd.tell():
+            fd.write(f'<journal gen={quote_attr(gen)}/>\n'.encode('utf-8'))
+        for line in lines:
+            fd.write(line.encode('utf-8') + b'\n')
+        fd.flush()
+        os.fsync(fd.fileno())
+        return fd.tell()
+
+
+def read_journal(fname: Path | str, gen: str) -> Iterator[tuple[str, dict[str, str]]]:
+    """
+    The entries of the journal of the DB generation, as (tag, attrs).
+    A stale journal is ignored, and the last line is ignored if it's not complete.
+    """
+    fname = Path(fname)
+    jname = journal_name(fname)
+    try:
+        with open(jname, 'rb') as fd:
+            lines = fd.read().split(b'\n')
+    except FileNotFoundError:
+        return
+    header = parse_attrs(lines[0].decode('utf-8'))
+    if header.get('gen') != gen:
+        log.warning(f'The DB journal "{jname}" is stale and will be ignored')
+        return
+    # the last line is empty, or an entry that was not written completely
+    for line in lines[1:-1]:
+        text = line.decode('utf-8')
+        tag = text[1 : text.find(' ')]
+        yield tag, parse_attrs(text)
+
+
+def needs_compact(fname: Path | str) -> bool:
+    """If the journal is big enough to be folded into the DB."""
+    try:
+        size = journal_name(fname).stat().st_size
+    except FileNotFoundError:
+        return False
+    return size > max(JOURNAL_MIN_SIZE, JOURNAL_DB_RATIO * Path(fname).stat().st_size)
@@ -6,7 +6,6 @@ They are imported in CLI and GUI.
 import os
 import timeit
 from datetime import datetime
-from multiprocessing import Process, Queue, cpu_count
 from os.path import isfile, split, splitext
 from pathlib import Path
 from pprint import pprint
@@ -16,12 +15,14 @@ from jinja2 import Environment, FileSystemLoader
 
 import imgdb.config
 
+from .cache import MetaCache
 from .config import IMG_DATE_FMT, Config
-from .db import DB_HEAD, ImgDB, db_merge, el_to_meta
-from .fsys import find_files
-from .img import img_archive, img_to_meta, meta_to_html
+from .db import DB_HEAD, ImgDB, db_commit
+from .fsys import find_files, skip_imported
+from .img import ImgMeta, img_archive, img_to_meta, meta_filter, meta_to_html
 from .log import log
-from .util import parse_query_expr, slugify
+from .pool import IngestPool
+from .util import compile_query, slugify
 
 
 def info(inputs: list, cfg: Config):  # pragma: no cover
@@ -46,29 +47,12 @@ def info(inputs: list, cfg: Config):  # pragma: no cover
     log.debug(f'[{len(inputs)}] files processed in {(file_stop - file_start):.4f}s')
 
 
-def _add_worker(image_queue: Queue, result_queue: Queue, c: Config):
-    while True:
-        img_path = image_queue.get()
-        # Consume the 'STOP' signal & end the worker
-        if not img_path or img_path == 'STOP':
-            break
-        result: dict[str, Any] = {}
-        try:
-            img, m = img_to_meta(img_path, c)
-            if img and m:
-                result = m
-        except Exception as err:
-            log.error(f'Worker error processing "{img_path}": {err}')
-        finally:
-            result_queue.put(result)
-
-
 def add_op(inputs: list, cfg: Config):
     """Add (import) images."""
     file_start = timeit.default_timer()
     if cfg.dry_run:
         log.info('DRY-RUN. Will simulate running add/import!')
-    files = find_files(inputs, cfg)
+    files = find_files(inputs, cfg, filtered=True)
 
     stream = None
     if (not cfg.dry_run) and cfg.db:
@@ -81,63 +65,54 @@ def add_op(inputs: list, cfg: Config):
         # Must open with append + read
         stream = open(db + '~', 'a+')  # noqa
 
-    image_queue: Queue[Path | str] = Queue()
-    result_queue: Queue[dict[str, Any]] = Queue()
-    workers = []
-
-    for img_path in files:
-        image_queue.put(img_path)
-
-    # Create workers for each CPU core
-    cpus = cpu_count()
-    # Limit workers if AI models are being used to prevent GPU OOM
-    if cfg.ai:
-        # Adjust this number based on user's GPU VRAM
-        cpus = min(cpus, 4)
-
-    for _ in range(cpus):
-        p = Process(target=_add_worker, args=(image_queue, result_queue, cfg))
-        workers.append(p)
-        p.start()
-        # Signal worker to stop by adding 'STOP' into the queue
-        image_queue.put('STOP')
-        # 2x to ensure all workers get the signal
-        image_queue.put('STOP')
-
-    batch = []
-    processed_count = 0
-
-    if isfile(cfg.db) and cfg.skip_imported:  # NOQA: SIM108
-        existing = {el['id'] for el in ImgDB(config=cfg).images}
-    else:
-        existing = set()
-
-    while processed_count < len(files):
-        result = result_queue.get()
-        processed_count += 1
-        batch.append(result)
-
-        # Process batch when it reaches the batch size or when all images are processed
-        if len(batch) == cpus or processed_count == len(files):
-            for m in batch:
-                if not m:
-                    continue
-                if cfg.skip_imported and m['id'] in existing:
-                    log.debug(f'skip imported {m["pth"]}')
-                    continue
-                if cfg.output and cfg.add_func:
-                    img_archive(m, cfg)
-                elif m['id'] in existing:
-                    log.debug(f'update DB: {m["pth"]}')
-                else:
-                    log.debug(f'to DB: {m["pth"]}')
-                if stream:
-                    stream.write(meta_to_html(m, cfg))
-            batch = []
-
-    # Wait for all workers to complete
-    for p in workers:
-        p.join()
+    existing: set[str] = set()
+    if isfile(cfg.db) and cfg.skip_imported:
+        db_obj = ImgDB(config=cfg)
+        existing = {m['id'] for m in db_obj}
+        # skip the imported files before processing them
+        files = skip_imported(files, db_obj.fingerprints())
+        del db_obj
+
+    # the images that didn't change since the last import are not processed again
+    cache = MetaCache(cfg.cache, cfg) if cfg.cache else None
+    cached: list[dict[str, Any]] = []
+    to_process = files
+    if cache:
+        to_process = []
+        for img_path in files:
+            m = cache.get(img_path)
+            if m is None:
+                to_process.append(img_path)
+            elif meta_filter(m, cfg):
+                cached.append(m)
+        log.info(f'Found {len(files) - len(to_process):,} files in cache, to process: {len(to_process):,} files')
+
+    def _add_meta(m: dict[str, Any]):
+        if cfg.skip_imported and m['id'] in existing:
+            log.debug(f'skip imported {m["pth"]}')
+            return
+        if cfg.output and cfg.add_func:
+            if img_archive(m, cfg) and cache and not cfg.dry_run:
+                cache.put(m['pth'], m)
+        elif m['id'] in existing:
+            log.debug(f'update DB: {m["pth"]}')
+        else:
+            log.debug(f'to DB: {m["pth"]}')
+        if stream:
+            stream.write(meta_to_html(m, cfg))
+
+    for m in cached:
+        _add_meta(m)
+    if to_process:
+        for _, m in IngestPool(cfg).imap(to_process):
+            if not m:
+                continue
+            if cache:
+                cache.put(m['pth'], m)
+            _add_meta(m)
+
+    if cache:
+        cache.close()
 
     if stream:
         # consolidate DB!
@@ -145,15 +120,8 @@ def add_op(inputs: list, cfg: Config):
         stream_txt = stream.read()
         stream.close()
         if stream_txt:
-            # the stream must be the second arg,
-            # so it will overwrite the existing DB
-            ImgDB(
-                elems=db_merge(
-                    open(cfg.db, 'r').read(),  # noqa
-                    stream_txt,
-                ),
-                config=cfg,
-            ).save()
+            # only the new and changed images are merged into the DB
+            db_commit(cfg.db, stream_txt, cfg)
         os.remove(stream.name)
         # force write everything
         os.sync()
@@ -177,13 +145,16 @@ def del_op(ids: list, cfg: Config):
     db = ImgDB(config=cfg)
 
     deleted = 0
+    # the images are removed from DB at the end, all at once
+    removed: set[str] = set()
     for uid in ids:
-        el = db.db.find('img', {'id': uid})
-        if el is not None:
-            img_id = el.attrs['id']
-            img_pth = el.attrs['data-pth']
-            if not cfg.dry_run:
-                el.decompose()
+        m = db.get_by_id(uid)
+        if m is None:
+            m = db.get_by_path(uid)
+        if m is not None and m['id'] not in removed:
+            img_id = m['id']
+            img_pth = m['pth']
+            removed.add(img_id)
             try:
                 Path(img_pth).unlink()  # type: ignore
                 log.info(f'Deleted image: {img_id} from "{img_pth}"!')
@@ -195,20 +166,18 @@ def del_op(ids: list, cfg: Config):
 
     imgs = 0
     if cfg.filter:
-        f = parse_query_expr(cfg.filter)
-        for el in db.images:
-            ext = os.path.splitext(el.attrs['data-pth'])[1]
+        f = compile_query(cfg.filter)
+        for row in range(len(db)):
+            attrs = db.store.attrs(row)
+            if attrs['id'] in removed:
+                continue
+            ext = os.path.splitext(attrs['data-pth'])[1]
             if cfg.exts and ext.lower() not in cfg.exts:
                 continue
-            m = el_to_meta(el)
-            ok = []
-            for prop, func, val in f:
-                ok.append(func(m.get(prop), val))
-            if ok and all(ok):
-                img_id = el.attrs['id']
-                img_pth = el.attrs['data-pth']
-                if not cfg.dry_run:
-                    el.decompose()
+            if f and f(ImgMeta(attrs)):
+                img_id = attrs['id']
+                img_pth = attrs['data-pth']
+                removed.add(img_id)
                 try:
                     if not cfg.dry_run:
                         Path(img_pth).unlink()
@@ -222,7 +191,8 @@ def del_op(ids: list, cfg: Config):
                 break
 
     if not cfg.dry_run:
-        db.save()
+        db.remove(*removed)
+        db.commit()
     file_stop = timeit.default_timer()
     log.debug(f'[{deleted}] files deleted in {(file_stop - file_start):.4f}s')
 
@@ -241,6 +211,7 @@ def readd(
     thumb_qual: int = 70,
     thumb_type: str = 'webp',
     db: str = 'imgdb.htm',
+    cache: str = '',
     shuffle: bool = False,
     silent: bool = False,
     verbose: bool = False,
@@ -270,6 +241,7 @@ def readd(
         thumb_qual=thumb_qual,
         thumb_type=thumb_type,
         db=db,
+        cache=cache,
         deep=True,
         force=True,
         shuffle=shuffle,
@@ -294,18 +266,25 @@ def ren_op(
     # delete the default UID, it will be set later as Name
     cfg.uid = ''
 
-    renamed = 0
+    cache = MetaCache(cfg.cache, cfg) if cfg.cache else None
+
+    cached: list[tuple[Path, dict[str, Any]]] = []
+    to_process: list[Path] = []
     for fname in find_files(inputs, cfg):
-        img, m = img_to_meta(fname, cfg)
-        if not (img and m):
-            continue
+        m = cache.get(fname) if cache else None
+        if m is None:
+            to_process.append(fname)
+        elif meta_filter(m, cfg):
+            cached.append((fname, m))
 
+    def _rename(fname: Path, m: dict[str, Any]) -> bool:
         # it's useful to have more native objects available
-        m['Pth'] = Path(m['pth'])
+        names = dict(m)
+        names['Pth'] = Path(m['pth'])
         if m['date']:
-            m['Date'] = datetime.strptime(m['date'], IMG_DATE_FMT)
+            names['Date'] = datetime.strptime(m['date'], IMG_DATE_FMT)
         else:
-            m['Date'] = datetime(1900, 1, 1, 0, 0, 0)
+            names['Date'] = datetime(1900, 1, 1, 0, 0, 0)
 
         folder, old_name_ext = split(fname)
         old_name, ext = splitext(old_name_ext)
@@ -315,23 +294,40 @@ def ren_op(
         if ext == '.jpeg':
             ext = '.jpg'
 
-        new_base_name = eval(f'f"""{name}"""', dict(m))
+        new_base_name = eval(f'f"""{name}"""', names)
         if new_base_name == old_name:
-            continue
+            return False
 
         new_name = new_base_name + ext
         new_file = f'{folder}/{new_name}'
         if isfile(new_file) and not cfg.force:
             log.debug(f'skipping rename of {old_name_ext}, because {new_name} exists')
-            continue
+            return False
 
         try:
             if not cfg.dry_run:
                 os.rename(fname, new_file)
+                if cache:
+                    cache.put(new_file, m)
             log.debug(f'rename: {old_name_ext}  ->  {new_name}')
-            renamed += 1
+            return True
         except Exception as err:
             log.warning(f'Cannot rename {old_name_ext} -> {new_name} ! Err: {err}')
+        return False
+
+    renamed = 0
+    for fname, m in cached:
+        renamed += _rename(fname, m)
+    if to_process:
+        for fname, m in IngestPool(cfg).imap(to_process):
+            if not m:
+                continue
+            if cache:
+                cache.put(fname, m)
+            renamed += _rename(fname, m)
+
+    if cache:
+        cache.close()
 
     file_stop = timeit.default_timer()
     log.debug(f'[{renamed}] files renamed in {(file_stop - file_start):.4f}s')
@@ -354,6 +350,8 @@ def generate_gallery(c: Config):
 
     db = ImgDB(c.db, config=c)
     metas, imgs = db.filter()
+    # the packed thumbs are inlined in the gallery
+    imgs = db.with_thumbs(imgs)
 
     max_pages = len(metas) // c.wrap_at
     log.info(f'Generating {max_pages + 1} galleries from {len(metas):,} pictures...')
@@ -448,6 +446,17 @@ def db_op(op: str, c: Config):  # pragma: no cover
     """
     DB operations.
     """
+    if op in ('cache-clear', 'cache-purge'):
+        if not c.cache:
+            raise ValueError(f'No cache file provided for {op}!')
+        cache = MetaCache(c.cache, c)
+        if op == 'cache-clear':
+            log.info(f'Cleared {cache.clear():,} cached images')
+        else:
+            log.info(f'Purged {cache.purge():,} deleted or changed images from cache')
+        cache.close()
+        return
+
     # setting the global state shouldn't be needed
     imgdb.config.g_config = c
     db = ImgDB(c.db, config=c)
@@ -456,5 +465,16 @@ def db_op(op: str, c: Config):  # pragma: no cover
         db.debug()
     elif op == 'export':
         db.export(c.output)
+    elif op == 'compact':
+        # the journal is folded into the DB
+        db.save()
+    elif op == 'shard':
+        if not c.output:
+            raise ValueError('Need an output manifest name for the sharded DB!')
+        db.to_shards(c.output, c.shard_by or 'year')
+    elif op == 'thumbs-pack':
+        db.pack_thumbs()
+    elif op == 'thumbs-inline':
+        db.unpack_thumbs()
     else:
         raise ValueError(f'Invalid DB operation: {op}')
@@ -0,0 +1,159 @@
+"""
+Process pool used to extract the meta-data from images, in parallel.
+Used by the add, rename and server import operations.
+"""
+
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from multiprocessing import cpu_count
+from pathlib import Path
+from typing import Any
+
+from .config import Config
+from .fsys import ReadAhead
+from .img import img_to_meta
+from .log import log
+
+# Limit workers if AI models are being used to prevent GPU OOM
+# Adjust this number based on user's GPU VRAM
+AI_MAX_WORKERS = 4
+
+# the worker Config, set once per process
+_cfg: Config | None = None
+
+
+def _init_worker(c: Config):
+    global _cfg
+    _cfg = c
+
+
+def _meta_worker(chunk: list[tuple[int, Path | str, bytes]]) -> list[tuple[int, dict[str, Any]]]:
+    results = []
+    for idx, img_path, data in chunk:
+        result: dict[str, Any] = {}
+        try:
+            img, m = img_to_meta(img_path, _cfg, data)
+            if img and m:
+                result = m
+        except Exception as err:
+            log.error(f'Worker error processing "{img_path}": {err}')
+        results.append((idx, result))
+    return results
+
+
+class IngestPool:
+    """
+    Bounded pool of worker processes that run img_to_meta on a list of paths.
+    The paths are sent to the workers in chunks, and only a limited number of chunks
+    are in flight at the same time, so the memory stays low for huge imports.
+    If a worker dies (eg: killed by OOM, or a crash in a decoder), the pool is restarted
+    and the unfinished paths are retried one by one, to isolate the broken file.
+    With read-ahead, the files are read in background threads and sent to the workers in memory.
+    """
+
+    def __init__(self, c: Config, workers: int = 0, chunk_size: int = 4, in_flight: int = 0, ordered: bool = False):
+        self.c = c
+        workers = workers or c.workers or cpu_count()
+        if c.ai:
+            workers = min(workers, AI_MAX_WORKERS)
+        self.workers = workers
+        self.chunk_size = max(1, chunk_size)
+        self.in_flight = in_flight or workers * 2
+        self.ordered = ordered
+        self.read_ahead = c.read_ahead * 1024 * 1024
+        self.restarts = 0
+        self._pool: ProcessPoolExecutor | None = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.c,))
+        return self._pool
+
+    def _restart(self):
+        self.restarts += 1
+        log.warning(f'A worker process died, restarting the pool ({self.restarts})')
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    def imap(self, paths: Iterable[Path | str]) -> Iterator[tuple[Path | str, dict[str, Any]]]:
+        """
+        Yield (path, meta) for each path. The meta is empty if the image
+        cannot be processed, or doesn't match the filter.
+        The results are yielded in the input order if the pool is ordered.
+        """
+        reader = None
+        chunk_size = self.chunk_size
+        if self.read_ahead:
+            # the files are read in sorted order, unless the results must be ordered
+            reader = ReadAhead(paths, self.read_ahead, sort=not self.ordered)
+            items = iter(reader)
+            # one file per task, the buffers are released as soon as they are processed
+            chunk_size = 1
+        else:
+            items = ((idx, pth, b'') for idx, pth in enumerate(paths))
+        names: dict[int, Path | str] = {}
+        suspects: deque[tuple[int, Path | str, bytes]] = deque()
+        running: dict[Future, tuple[list, bool]] = {}
+        done_buffer: dict[int, dict[str, Any]] = {}
+        next_idx = 0
+        exhausted = False
+
+        try:
+            while True:
+                # after a crash, the unfinished paths run one at a time, isolated
+                if suspects:
+                    if not running:
+                        chunk = [suspects.popleft()]
+                        running[self._executor().submit(_meta_worker, chunk)] = (chunk, True)
+                elif not exhausted:
+                    while len(running) < self.in_flight and len(done_buffer) < self.in_flight * chunk_size:
+                        chunk = list(islice(items, chunk_size))
+                        if not chunk:
+                            exhausted = True
+                            break
+                        names.update((idx, pth) for idx, pth, _ in chunk)
+                        f = self._executor().submit(_meta_worker, chunk)
+                        if reader:
+                            size = sum(len(data) for _, _, data in chunk)
+                            f.add_done_callback(lambda _, r=reader, n=size: r.release(n))
+                        running[f] = (chunk, False)
+                if not running:
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                broken = False
+                for f in finished:
+                    chunk, isolated = running.pop(f)
+                    try:
+                        done_buffer.update(f.result())
+                    except BrokenProcessPool:
+                        broken = True
+                        if isolated:
+                            log.error(f'Worker crashed processing "{chunk[0][1]}"')
+                            done_buffer[chunk[0][0]] = {}
+                        else:
+                            suspects.extend(chunk)
+                if broken:
+                    # all the other running chunks are lost
+                    for chunk, _ in running.values():
+                        suspects.extend(chunk)
+                    running.clear()
+                    self._restart()
+
+                if self.ordered:
+                    while next_idx in done_buffer:
+                        yield names.pop(next_idx), done_buffer.pop(next_idx)
+                        next_idx += 1
+                else:
+                    for idx in list(done_buffer):
+                        yield names.pop(idx), done_buffer.pop(idx)
+        finally:
+            if reader:
+                items.close()  # type: ignore
+            if self._pool is not None:
+                self._pool.shutdown(wait=True, cancel_futures=True)
+                self._pool = None
@@ -2,12 +2,11 @@ from __future__ import annotations
 
 import asyncio
 import io
-import math
 import mimetypes
 import os
 import os.path
 from base64 import b64decode
-from multiprocessing import Process, Queue, cpu_count
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Any, Optional
 
@@ -24,12 +23,15 @@ from PIL import Image
 from ..ai import text_embedding_clip
 from ..config import CONFIG_FIELDS, Config, convert_config_value
 from ..db import ImgDB
-from ..fsys import find_files
-from ..img import RAW_EXTS, img_archive, img_resize, meta_to_html
+from ..fsys import find_files, skip_imported
+from ..img import RAW_EXTS, img_archive, img_resize, meta_to_html, raw_to_img
+from ..journal import journal_name
 from ..log import log
-from ..main import _add_worker
+from ..pool import IngestPool
 from ..util import slugify
 
+# the size of the CLIP embeddings
+CLIP_DIM = 512
 RECENT_DBS = Path(os.environ.get('RECENT_DBS', Path.home() / '.imgdb' / 'recent.htm'))
 UPLOAD_DIR = Path(os.environ.get('UPLOAD_DIR', Path.home() / 'Pictures' / 'img-DB'))
 RECENT_DBS.parent.mkdir(parents=True, exist_ok=True)
@@ -181,7 +183,7 @@ def gallery(
         if db_path.is_file():
             print(f'Loading DB from: {db_path}')
             db_obj = ImgDB(str(db_path))
-            images = list(db_obj.images)
+            images = db_obj.with_thumbs(db_obj.images)
             db_meta = db_obj.meta
         else:
             error = f'DB file not found: {db}!'
@@ -232,7 +234,7 @@ async def gallery_settings(
         db_obj.meta[k] = v
         updated += 1
     if updated > 0:
-        db_obj.save()
+        db_obj.commit()
     return {'status': 'ok', 'updated': updated}
 
 
@@ -291,7 +293,10 @@ async def import_images(
         else:
             # a single input path, file or folder
             input_path = Path(input).expanduser()
-            available_files = find_files([input_path], cfg)
+            available_files = find_files([input_path], cfg, filtered=True)
+            if cfg.skip_imported:
+                # skip the imported files before processing them
+                available_files = skip_imported(available_files, db_obj.fingerprints())
             if not available_files:
                 yield 'data: {"available": 0, "imported": 0, "filename": "done"}\n\n'
                 return
@@ -300,67 +305,43 @@ async def import_images(
         yield f'data: {{"available": {length_available}, "imported": 0, "filename": "start"}}\n\n'
 
         imported_count = 0
-        image_queue = Queue()
-        result_queue = Queue()
-        workers = []
-
-        for img_path in available_files:
-            image_queue.put(img_path)
-
-        # Create workers for each CPU core
-        cpus = cpu_count()
-        for _ in range(cpus):
-            p = Process(target=_add_worker, args=(image_queue, result_queue, cfg))
-            workers.append(p)
-            p.start()
-            # Signal worker to stop by adding 'STOP' into the queue
-            image_queue.put('STOP')
-            # 2x to ensure all workers get the signal
-            image_queue.put('STOP')
-
-        images_map = {img['id']: img for img in db_obj.images}
-
-        received_count = 0
+        results = IngestPool(cfg).imap(available_files)
+        # a generator can't be advanced from more threads, so each import has its own thread
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='import')
         loop = asyncio.get_running_loop()
-        while received_count < len(available_files):
-            # Use run_in_executor so the blocking queue.get() doesn't freeze
-            # the asyncio event loop and SSE chunks are flushed to the client
-            # as they are yielded instead of being buffered until the end.
-            meta = await loop.run_in_executor(None, result_queue.get)
-            received_count += 1
-
-            if not meta:
-                continue
-            if cfg.skip_imported and meta['id'] in images_map:
-                continue
-            if cfg.output and cfg.add_func:
-                img_archive(meta, cfg)
-
-            new_img_tag = BeautifulSoup(meta_to_html(meta, cfg), 'lxml').img
-            if not new_img_tag:
-                continue
-
-            existing_tag = images_map.get(meta['id'])
-            if existing_tag:
-                for k, v in new_img_tag.attrs.items():
-                    existing_tag.attrs[k] = v
-            else:
-                if db_obj.db.body:
-                    db_obj.db.body.append(new_img_tag)
-                else:
-                    db_obj.db.append(new_img_tag)
-                images_map[meta['id']] = new_img_tag
-
-            imported_count += 1
-            log.debug(f'Imported {imported_count}/{length_available}, file: {meta["pth"]}')
-            yield f'data: {{"imported_count": {imported_count}, "filename": "{Path(meta["pth"]).name}"}}\n\n'
-
-        # Wait for all workers to complete
-        for p in workers:
-            p.join()
+        try:
+            while True:
+                # Use run_in_executor so the blocking pool doesn't freeze
+                # the asyncio event loop and SSE chunks are flushed to the client
+                # as they are yielded instead of being buffered until the end.
+                result = await loop.run_in_executor(executor, next, results, None)
+                if result is None:
+                    break
+                _, meta = result
+
+                if not meta:
+                    continue
+                if cfg.skip_imported and meta['id'] in db_obj:
+                    continue
+                if cfg.output and cfg.add_func:
+                    img_archive(meta, cfg)
+
+                new_img_tag = BeautifulSoup(meta_to_html(meta, cfg), 'lxml').img
+                if not new_img_tag:
+                    continue
+
+                db_obj.add(new_img_tag)
+
+                imported_count += 1
+                log.debug(f'Imported {imported_count}/{length_available}, file: {meta["pth"]}')
+                yield f'data: {{"imported_count": {imported_count}, "filename": "{Path(meta["pth"]).name}"}}\n\n'
+        finally:
+            # eg: the client disconnected; the workers are stopped in the same thread, after the running step
+            executor.submit(results.close)
+            executor.shutdown(wait=False)
 
         if imported_count > 0:
-            db_obj.save()
+            db_obj.commit()
 
         yield f'data: {{"available": {length_available}, "imported": {imported_count}, "filename": "done"}}\n\n'
 
@@ -384,8 +365,8 @@ def serve_image(
     if img_path.suffix.lower() in RAW_EXTS:
         try:
             with rawpy.imread(path) as raw:
-                rgb_array = raw.postprocess(use_auto_wb=True, no_auto_bright=True, output_bps=8)
-                img = Image.fromarray(rgb_array, mode='RGB')
+                # the embedded preview is enough for resized images
+                img = raw_to_img(raw, 'preview' if sz > 0 else 'full', sz, use_auto_wb=True)
                 if sz > 0:
                     img = img_resize(img, sz)
                 img_io = io.BytesIO()
@@ -441,7 +422,50 @@ def list_files_api(
     }
 
 
-vector_indexes = {}
+# the HNSW index of each DB, with the stamp of the DB files it was built from,
+# and the paths of the images, in the order of the index labels
+vector_indexes: dict[Path, tuple[tuple, Any, list[str]]] = {}
+
+
+def _db_files_stamp(db_path: Path) -> tuple:
+    """The size and mtime of the DB and its journal, to find out if the DB was changed."""
+    stamp = []
+    for pth in (db_path, journal_name(db_path)):
+        try:
+            st = pth.stat()
+            stamp.append((st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def _vector_index(db_path: Path, db_obj: ImgDB) -> tuple[Any, list[str]]:
+    """
+    The HNSW index of the CLIP embeddings of the DB, and the paths of the images, by label.
+    The labels are the positions of the images when the index was built, so the index is rebuilt
+    when the DB is changed, eg: images added, removed, or sorted when the DB is saved.
+    """
+    stamp = _db_files_stamp(db_path)
+    cached = vector_indexes.get(db_path)
+    if cached and cached[0] == stamp:
+        return cached[1], cached[2]
+
+    embeddings = []
+    image_pths = []
+    for row in range(len(db_obj.store)):
+        attrs = db_obj.store.attrs(row)
+        if not attrs.get('data-embedding-clip'):
+            continue
+        image_pths.append(attrs['data-pth'])
+        embeddings.append(numpy.frombuffer(b64decode(attrs['data-embedding-clip']), dtype=numpy.float16))
+
+    # Creating HNSW index
+    index = hnswlib.Index(space='l2', dim=CLIP_DIM)
+    index.init_index(max_elements=max(1, len(embeddings)), ef_construction=100, M=32)
+    if embeddings:
+        index.add_items(numpy.vstack(embeddings), numpy.arange(len(embeddings)))
+    vector_indexes[db_path] = (stamp, index, image_pths)
+    return index, image_pths
 
 
 @app.get('/api/similar')
@@ -460,53 +484,30 @@ def search_similar_images(
     if not q and not img_id:
         raise HTTPException(status_code=400, detail='Either query or img_id must be provided!')
     db_obj = ImgDB(str(db_path))
-
-    clip_dim = 512
-    max_elements = math.ceil(len(db_obj) / 4 * 5)
-
-    if db_path in vector_indexes:
-        index = vector_indexes[db_path]
-    else:
-        # Creating HNSW index
-        index = hnswlib.Index(space='l2', dim=clip_dim)
-        index.init_index(max_elements=max_elements, ef_construction=100, M=32)
-        vector_indexes[db_path] = index
-
-    embeddings = []
-    image_pth = []
-    for elem in db_obj:
-        if 'embedding-clip' not in elem:
-            continue
-        image_pth.append(elem['pth'])
-        vector = numpy.frombuffer(b64decode(elem['embedding-clip']), dtype=numpy.float16)
-        embeddings.append(vector)
-
-    if index.get_current_count() == 0 and embeddings:
-        num_elements = len(embeddings)
-        # Add all embeddings to the index
-        index.add_items(numpy.vstack(embeddings), numpy.arange(num_elements))
+    index, image_pths = _vector_index(db_path, db_obj)
+    if not image_pths:
+        raise HTTPException(status_code=404, detail='There are no images with CLIP embeddings in the DB!')
+    top_k = min(top_k, len(image_pths))
 
     if q:
-        ids, _ = index.knn_query(text_embedding_clip(q), k=top_k)
-    elif img_id:
+        labels, _ = index.knn_query(text_embedding_clip(q), k=top_k)
+    else:
         elem = db_obj.get_by_id(img_id)
         if not elem:
             raise HTTPException(status_code=404, detail=f'Image with ID {img_id} not found!')
         if 'embedding-clip' not in elem:
             raise HTTPException(status_code=404, detail=f'Image with ID {img_id} does not have a CLIP embedding!')
         vector = numpy.frombuffer(b64decode(elem['embedding-clip']), dtype=numpy.float16)
-        ids, _ = index.knn_query(vector, k=top_k)
-    for i in ids[0]:
-        print(i, image_pth[i])
+        labels, _ = index.knn_query(vector, k=top_k)
+    image_pth = [image_pths[i] for i in labels[0]]
 
     width = 150 * 5
     height = 150 * 4
     concatenated_image = Image.new('RGB', (width, height))
 
     result_images = []
-    for idx in ids[0]:
+    for filename in image_pth:
         try:
-            filename = image_pth[idx]
             img = Image.open(filename)
             img = img.resize((150, 150))
             result_images.append(img)
@@ -0,0 +1,69 @@
+"""
+Sharded DB: the images are split in more HTML DB files (shards), per year, or per ID prefix,
+and a small JSON manifest holds the list of shards and the meta of the DB.
+The manifest is used as the DB name, eg: --db imgdb.json
+Each shard is a normal DB file, that can also be used standalone, eg: imgdb-2020.htm
+The shards are loaded in parallel, and only the changed shards are written on save.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+import numpy
+
+from .store import DATE_NA, RecordStore
+
+MANIFEST_VERSION = 1
+SHARD_BY = ('year', 'id')
+NO_DATE = 'nodate'
+
+
+def is_manifest(fname: Path | str) -> bool:
+    """If the DB file is the manifest of a sharded DB. The HTML DBs start with a doctype."""
+    try:
+        with open(fname, 'rb') as fd:
+            return fd.read(64).lstrip().startswith(b'{')
+    except OSError:
+        return False
+
+
+def read_manifest(fname: Path | str) -> dict[str, Any]:
+    with open(fname, encoding='utf-8') as fd:
+        manifest = json.load(fd)
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('shard_by') not in SHARD_BY:
+        raise ValueError(f'Invalid DB manifest: {fname}')
+    return manifest
+
+
+def write_manifest(fname: Path | str, manifest: dict[str, Any]):
+    fname = Path(fname)
+    tmp_name = fname.with_name(fname.name + '.tmp')
+    with open(tmp_name, 'w', encoding='utf-8') as fd:
+        json.dump(manifest, fd, indent=2, ensure_ascii=False)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(tmp_name, fname)
+
+
+def new_manifest(shard_by: str, id_len: int = 1) -> dict[str, Any]:
+    if shard_by not in SHARD_BY:
+        raise ValueError(f'Invalid shard type: {shard_by}, must be one of: {SHARD_BY}')
+    return {'version': MANIFEST_VERSION, 'shard_by': shard_by, 'id_len': max(1, id_len), 'meta': {}, 'shards': []}
+
+
+def shard_file(fname: Path | str, key: str) -> Path:
+    """The shard file, next to the manifest, eg: imgdb.json -> imgdb-2020.htm"""
+    fname = Path(fname)
+    return fname.with_name(f'{fname.stem}-{key}.htm')
+
+
+def shard_keys(store: RecordStore, manifest: dict[str, Any]) -> list[str]:
+    """The shard of each image of the DB."""
+    if manifest['shard_by'] == 'year':
+        date = store.column('date')
+        years = (date.astype('datetime64[s]').astype('datetime64[Y]').astype(numpy.int64) + 1970).tolist()
+        return [NO_DATE if na else str(y) for y, na in zip(years, (date == DATE_NA).tolist(), strict=True)]
+    id_len = manifest['id_len']
+    return [img_id[:id_len] for img_id in store.ids]
@@ -0,0 +1,750 @@
+"""
+Compact, columnar store for the images of the DB.
+The images are kept as their serialized IMG lines, in one bytes buffer,
+and the core fields are parsed into NumPy columns, so an image costs
+tens of bytes of Python objects, instead of kilobytes.
+The attribute dicts are created only when they are needed.
+"""
+
+import operator
+import re
+import sys
+from array import array
+from collections.abc import Callable, Iterable, Iterator
+from html import unescape
+from io import BytesIO
+from typing import Any, Optional
+
+import numpy
+from bs4.element import Tag
+
+from .log import log
+
+# the numeric columns, the missing values are NaN
+NUM_COLUMNS = ('bytes', 'width', 'height', 'mtime', 'iso', 'illumination', 'saturation', 'contrast')
+# the interned string columns, the missing values are -1
+CAT_COLUMNS = ('format', 'mode', 'maker-model', 'lens')
+# the categoricals that are empty texts when missing, in the metas; the other are missing (None)
+EMPTY_CATS = ('format', 'mode', 'maker-model')
+# the date column is the number of seconds since the epoch, the missing values are DATE_NA
+DATE_NA = numpy.iinfo(numpy.int64).min
+# the columns are parsed in chunks of images
+LOAD_CHUNK = 8192
+# the numbers that are 0 when missing, in the meta-data; the other numbers are missing when 0
+ZERO_COLUMNS = ('bytes', 'width', 'height')
+# the filter expressions that can be checked on the number and date columns
+COLUMN_OPS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+# a date, or the beginning of a date, eg: 2020, 2020-12, 2020-12-25
+RE_DATE_PREFIX = re.compile(r'\d{4}(-\d{2}){0,2}$')
+# the secondary indexes are used for the filters that match less than this part of the images,
+# for the other filters it's faster to check the whole column
+INDEX_MAX_RATIO = 0.2
+
+# an attribute from a serialized IMG, the values are double, or single quoted
+RE_ATTR = re.compile(r"""([\w:.-]+)=(?:"([^"]*)"|'([^']*)')""")
+
+
+def is_valid_img(elem: Any) -> bool:
+    attrs = elem if isinstance(elem, dict) else elem.attrs
+    return (
+        elem
+        and len(attrs.get('id', '')) > 3
+        and len(attrs.get('data-pth', '')) > 3
+        and attrs.get('data-bytes')
+        and attrs.get('data-mode')
+        and attrs.get('data-format')
+    )
+
+
+def el_attrs(el: Tag | dict) -> dict[str, str]:
+    """The attributes of an IMG element, as strings."""
+    attrs = el if isinstance(el, dict) else el.attrs
+    return {k: ' '.join(v) if isinstance(v, list) else v for k, v in attrs.items()}
+
+
+def parse_attrs(line: str) -> dict[str, str]:
+    """Parse the attributes of a serialized IMG, much faster than an HTML parser."""
+    start = line.find(' ', line.find('<')) + 1
+    end = line.rfind('"/>')
+    if start < end and "='" not in line and '  ' not in line:
+        # the usual case, as written by save, all the values are double quoted,
+        # and splitting is a few times faster than the regex
+        try:
+            attrs = dict(part.split('="', 1) for part in line[start:end].split('" '))
+        except ValueError:
+            attrs = {}
+        if attrs:
+            if '&' in line:
+                for k, v in attrs.items():
+                    if '&' in v:
+                        attrs[k] = unescape(v)
+            return attrs
+    attrs = {}
+    for name, dq_val, sq_val in RE_ATTR.findall(line):
+        val = dq_val or sq_val
+        attrs[name] = unescape(val) if '&' in val else val
+    return attrs
+
+
+def quote_attr(val: str) -> str:
+    # the same as the BeautifulSoup minimal formatter
+    val = val.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+    if '"' not in val:
+        return f'"{val}"'
+    if "'" not in val:
+        return f"'{val}'"
+    return '"' + val.replace('"', '&quot;') + '"'
+
+
+def img_to_html(attrs: dict[str, Any]) -> str:
+    """Serialize an IMG element, the same as str(Tag), but without creating the Tag."""
+    return '<img ' + ' '.join(f'{k}={quote_attr(str(v))}' for k, v in sorted(attrs.items())) + '/>'
+
+
+def _num(val: Optional[str]) -> float:
+    if not val:
+        return numpy.nan
+    try:
+        return float(val)
+    except ValueError:
+        return numpy.nan
+
+
+def _nums(vals: list[str]) -> numpy.ndarray:
+    """Convert the values to numbers, the missing and invalid values are NaN."""
+    arr = numpy.array(vals, dtype=str)
+    try:
+        return numpy.where(arr == '', 'nan', arr).astype(numpy.float64)
+    except ValueError:
+        return numpy.array([_num(v) for v in vals], numpy.float64)
+
+
+def _size(val: Optional[str]) -> tuple[float, float]:
+    if not val or ',' not in val:
+        return numpy.nan, numpy.nan
+    width, height = val.split(',', 1)
+    return _num(width), _num(height)
+
+
+def _epoch(val: Optional[str]) -> int:
+    """Convert a date to seconds since the epoch, the missing and invalid dates are DATE_NA."""
+    if not val:
+        return DATE_NA
+    try:
+        return int(numpy.datetime64(val, 's').astype(numpy.int64))
+    except ValueError:
+        return DATE_NA
+
+
+def _epochs(dates: list[str]) -> numpy.ndarray:
+    try:
+        return numpy.array(dates, dtype='datetime64[s]').astype(numpy.int64)
+    except ValueError:
+        return numpy.array([_epoch(d) for d in dates], numpy.int64)
+
+
+def _num_values(attrs: dict[str, str]) -> Iterator[tuple[str, float]]:
+    width, height = _size(attrs.get('data-size'))
+    for name in NUM_COLUMNS:
+        if name == 'width':
+            yield name, width
+        elif name == 'height':
+            yield name, height
+        else:
+            yield name, _num(attrs.get(f'data-{name}'))
+
+
+def _num_columns(recs: list[dict[str, str]]) -> dict[str, numpy.ndarray]:
+    """The numeric columns of many images, much faster than _num_values for each image."""
+    if not recs:
+        return {name: numpy.empty(0, numpy.float64) for name in NUM_COLUMNS}
+    sizes = numpy.char.partition(numpy.array([r.get('data-size', '') for r in recs], dtype=str), ',')
+    cols = {}
+    for name in NUM_COLUMNS:
+        if name == 'width':
+            cols[name] = _nums(sizes[:, 0].tolist())
+        elif name == 'height':
+            cols[name] = _nums(sizes[:, 2].tolist())
+        else:
+            key = f'data-{name}'
+            cols[name] = _nums([r.get(key, '') for r in recs])
+    return cols
+
+
+class ImgRecord(dict):
+    """
+    The attributes of a DB image, as a dict.
+    The changes are reported to the store, to keep the columns in sync.
+    The Tag is the BeautifulSoup element sharing these attributes, if it was created.
+    The saved line is the last version persisted outside the buffer, eg: in the journal,
+    and the record is dirty if it was changed after it was persisted.
+    """
+
+    __slots__ = ('_store', '_row', 'tag', 'saved', 'dirty')
+
+    def __init__(self, attrs: dict[str, str], store: Optional['RecordStore'] = None, row: int = -1):
+        super().__init__(attrs)
+        self._store = store
+        self._row = row
+        self.tag: Optional[Tag] = None
+        self.saved: Optional[bytes] = None
+        self.dirty = False
+
+    def _changed(self, key: Optional[str] = None):
+        self.dirty = True
+        if self._store is not None:
+            self._store._changed(self._row, key)
+
+    def __setitem__(self, key: str, val: str):
+        super().__setitem__(key, val)
+        self._changed(key)
+
+    def __delitem__(self, key: str):
+        super().__delitem__(key)
+        self._changed(key)
+
+    def pop(self, key: str, *default: Any) -> Any:
+        val = super().pop(key, *default)
+        self._changed(key)
+        return val
+
+    def update(self, *args: Any, **kw: Any):
+        super().update(*args, **kw)
+        self._changed()
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        val = super().setdefault(key, default)
+        self._changed(key)
+        return val
+
+
+class Categorical:
+    """A column of interned strings, stored as int codes."""
+
+    def __init__(self, size: int = 0):
+        self.codes = numpy.full(size, -1, numpy.int32)
+        self.values: list[str] = []
+        self._index: dict[str, int] = {}
+
+    def code(self, val: Optional[str]) -> int:
+        if not val:
+            return -1
+        code = self._index.get(val)
+        if code is None:
+            code = self._index[val] = len(self.values)
+            self.values.append(sys.intern(val))
+        return code
+
+    def value(self, code: int) -> str:
+        return self.values[code] if code >= 0 else ''
+
+    def matches(self, test: Callable[[Any], bool], missing: Optional[str] = '') -> numpy.ndarray:
+        """
+        Check each value once, the result is indexed by the codes.
+        The missing value is the last, so the code -1 works.
+        """
+        return numpy.array([test(v) for v in self.values] + [test(missing)], bool)
+
+
+class RecordStore:
+    """
+    The images of the DB, in order, as the serialized IMG lines in a bytes buffer,
+    and the core fields as columns: ids, paths, NumPy numbers, dates and categoricals.
+    The attribute dicts (ImgRecord) are created when they are needed, and after that
+    they are the source of truth for that row, and are serialized again on save.
+    """
+
+    def __init__(self, buf: bytes = b'', spans: Iterable[tuple[int, int]] = ()):
+        self.buf = buf
+        # the rows can also point in more buffers, eg: the shards of the DB
+        self.bufs: list[Any] = []
+        self.src: Optional[numpy.ndarray] = None
+        self.ids: list[str] = []
+        self.pths: list[str] = []
+        self._recs: dict[int, ImgRecord] = {}
+        self.cats = {name: Categorical() for name in CAT_COLUMNS}
+        # the names of all the attributes of the images, eg: the header of an export;
+        # the names of the removed attributes are kept
+        self.attr_names: set[str] = set()
+        # the hash indexes of the IDs and paths are created on the first lookup
+        self._by_id: Optional[dict[str, int]] = None
+        self._by_pth: Optional[dict[str, int]] = None
+        # the secondary indexes, of the rows sorted by date and by the categoricals,
+        # are created on the first filter, and dropped when their column is changed
+        self._by_date: Optional[tuple[numpy.ndarray, numpy.ndarray]] = None
+        self._by_cat: dict[str, tuple[numpy.ndarray, numpy.ndarray]] = {}
+
+        starts, ends = array('q'), array('q')
+        columns: list[dict[str, numpy.ndarray]] = []
+        chunk: list[dict[str, str]] = []
+        for start, end in spans:
+            line = buf[start:end].decode('utf-8')
+            attrs = parse_attrs(line)
+            if not is_valid_img(attrs):
+                log.warning(f'Invalid img found in DB will be removed: {line[:80]}...')
+                continue
+            starts.append(start)
+            ends.append(end)
+            chunk.append(attrs)
+            # the columns are converted in chunks, to keep the memory low
+            if len(chunk) >= LOAD_CHUNK:
+                columns.append(self._columns(chunk))
+                chunk = []
+        if chunk or not columns:
+            columns.append(self._columns(chunk))
+
+        self._size = len(self.ids)
+        self.spans = numpy.column_stack([numpy.array(starts, numpy.int64), numpy.array(ends, numpy.int64)])
+        self.num = {name: numpy.concatenate([c[name] for c in columns]) for name in NUM_COLUMNS}
+        self.date = numpy.concatenate([c['date'] for c in columns])
+        for name, cat in self.cats.items():
+            cat.codes = numpy.concatenate([c[name] for c in columns])
+
+    def _columns(self, recs: list[dict[str, str]]) -> dict[str, numpy.ndarray]:
+        self.ids.extend(r['id'] for r in recs)
+        self.pths.extend(r['data-pth'] for r in recs)
+        for r in recs:
+            self.attr_names.update(r)
+        cols = _num_columns(recs)
+        cols['date'] = _epochs([r.get('data-date', '') for r in recs])
+        for name, cat in self.cats.items():
+            key = f'data-{name}'
+            cols[name] = numpy.array([cat.code(r.get(key)) for r in recs], numpy.int32)
+        return cols
+
+    @classmethod
+    def from_columns(
+        cls,
+        buf: Any,
+        spans: numpy.ndarray,
+        ids: list[str],
+        pths: list[str],
+        num: dict[str, numpy.ndarray],
+        date: numpy.ndarray,
+        cats: dict[str, tuple[numpy.ndarray, list[str]]],
+        attr_names: Iterable[str] = (),
+    ) -> 'RecordStore':
+        """Create the store from columns that were already parsed, eg: from the DB index."""
+        store = cls()
+        store.attr_names.update(attr_names)
+        store.buf = buf
+        store.spans = spans
+        store.ids = ids
+        store.pths = pths
+        store.num = {name: num[name] for name in NUM_COLUMNS}
+        store.date = date
+        for name, (codes, values) in cats.items():
+            cat = store.cats[name]
+            cat.codes = codes
+            for val in values:
+                cat.code(val)
+        store._size = len(ids)
+        return store
+
+    @classmethod
+    def from_lines(cls, lines: Iterable[str]) -> 'RecordStore':
+        """Create the store from serialized IMG lines."""
+        buf = BytesIO()
+        spans = []
+        for line in lines:
+            start = buf.tell()
+            buf.write(line.encode('utf-8'))
+            spans.append((start, buf.tell()))
+            buf.write(b'\n')
+        return cls(buf.getvalue(), spans)
+
+    @classmethod
+    def from_attrs(cls, recs: Iterable[dict[str, Any]]) -> 'RecordStore':
+        return cls.from_lines(img_to_html(rec) for rec in recs)
+
+    @classmethod
+    def concat(cls, stores: list['RecordStore']) -> 'RecordStore':
+        """
+        Join the stores, in order. The rows point in the buffers of the stores,
+        the records that were created are moved in the new store.
+        """
+        store = cls()
+        store.bufs = [s.buf for s in stores]
+        store.src = numpy.concatenate(
+            [numpy.zeros(0, numpy.int32)] + [numpy.full(len(s), i, numpy.int32) for i, s in enumerate(stores)]
+        )
+        store.spans = numpy.concatenate([store.spans] + [s.spans[: len(s)] for s in stores])
+        store.num = {
+            name: numpy.concatenate([store.num[name]] + [s.num[name][: len(s)] for s in stores]) for name in NUM_COLUMNS
+        }
+        store.date = numpy.concatenate([store.date] + [s.column('date') for s in stores])
+        for name, cat in store.cats.items():
+            codes = [cat.codes]
+            for s in stores:
+                old = s.cats[name]
+                recode = numpy.array([cat.code(val) for val in old.values] + [-1], numpy.int32)
+                codes.append(recode[s.column(name)])
+            cat.codes = numpy.concatenate(codes)
+        offset = 0
+        for s in stores:
+            store.attr_names |= s.attr_names
+            store.ids.extend(s.ids)
+            store.pths.extend(s.pths)
+            for row, rec in s._recs.items():
+                rec._store = store
+                rec._row = row + offset
+                store._recs[rec._row] = rec
+            offset += len(s)
+        store._size = offset
+        return store
+
+    def subset(self, rows: numpy.ndarray, buf: Any) -> 'RecordStore':
+        """A copy of some rows, that point in the given buffer. The records are not copied."""
+        return RecordStore.from_columns(
+            buf,
+            self.spans[rows],
+            ids=[self.ids[i] for i in rows.tolist()],
+            pths=[self.pths[i] for i in rows.tolist()],
+            num={name: col[rows] for name, col in self.num.items()},
+            date=self.date[rows],
+            cats={name: (cat.codes[rows], cat.values) for name, cat in self.cats.items()},
+            attr_names=self.attr_names,
+        )
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _grow(self, size: int):
+        cap = len(self.spans)
+        if size <= cap:
+            return
+        cap = max(size, cap * 2, 64)
+        extra = cap - len(self.spans)
+        self.spans = numpy.concatenate([self.spans, numpy.full((extra, 2), -1, numpy.int64)])
+        if self.src is not None:
+            self.src = numpy.concatenate([self.src, numpy.full(extra, -1, numpy.int32)])
+        for name, col in self.num.items():
+            self.num[name] = numpy.concatenate([col, numpy.full(extra, numpy.nan)])
+        self.date = numpy.concatenate([self.date, numpy.full(extra, DATE_NA, numpy.int64)])
+        for cat in self.cats.values():
+            cat.codes = numpy.concatenate([cat.codes, numpy.full(extra, -1, numpy.int32)])
+
+    def column(self, name: str) -> numpy.ndarray:
+        """A column as a NumPy array: a number, the date, or the codes of a categorical."""
+        if name == 'date':
+            return self.date[: self._size]
+        if name in self.cats:
+            return self.cats[name].codes[: self._size]
+        return self.num[name][: self._size]
+
+    def arrays(self, rows: numpy.ndarray) -> dict[str, numpy.ndarray]:
+        """
+        The columns of some rows, as plain NumPy arrays: the IDs, paths and categoricals as texts,
+        the numbers as floats (the missing numbers are NaN) and the dates as datetime64 (the missing dates are NaT).
+        """
+        ids = rows.tolist()
+        cols = {
+            'id': numpy.array([self.ids[row] for row in ids], str),
+            'pth': numpy.array([self.pths[row] for row in ids], str),
+            # DATE_NA is the same number as NaT
+            'date': self.column('date')[rows].astype('datetime64[s]'),
+        }
+        for name in NUM_COLUMNS:
+            cols[name] = self.column(name)[rows]
+        for name, cat in self.cats.items():
+            # the missing value is the last, so the code -1 works
+            cols[name] = numpy.array([*cat.values, ''], str)[self.column(name)[rows]]
+        return cols
+
+    def value(self, row: int, name: str) -> Any:
+        """The value of a column, for a row."""
+        if name == 'id':
+            return self.ids[row]
+        if name == 'pth':
+            return self.pths[row]
+        if name in self.cats:
+            cat = self.cats[name]
+            return cat.value(cat.codes[row])
+        return self.column(name)[row]
+
+    def mask(
+        self, prop: str, op: str, val: Any, test: Callable[[Any], bool], rows: Optional[numpy.ndarray] = None
+    ) -> Optional[numpy.ndarray]:
+        """
+        Check a filter expression for all the rows, or only the given rows, at once, on the columns,
+        with the same result as checking the meta-data of each row. The test is the check of one meta value.
+        Returns None if the expression can't be checked on the columns, eg: a regex on a number.
+        """
+        if prop == 'pth':
+            pths = self.pths if rows is None else [self.pths[row] for row in rows.tolist()]
+            return numpy.fromiter(map(test, pths), bool, len(pths))
+        if prop in self.cats:
+            codes = self.column(prop) if rows is None else self.column(prop)[rows]
+            return self.cats[prop].matches(test, '' if prop in EMPTY_CATS else None)[codes]
+        cmp = COLUMN_OPS.get(op)
+        if cmp is None or isinstance(val, bool):
+            return None
+        if prop in self.num and isinstance(val, (int, float)):
+            col = self.column(prop) if rows is None else self.column(prop)[rows]
+            col = numpy.nan_to_num(col, nan=0.0) if prop in ZERO_COLUMNS else numpy.where(col == 0, numpy.nan, col)
+            # the missing numbers (NaN) don't match the comparisons
+            return cmp(col, val)
+        if prop == 'date' and isinstance(val, str) and RE_DATE_PREFIX.match(val):
+            start = _epoch(val)
+            if start == DATE_NA:
+                return None
+            # the dates are compared as texts, so a date is greater than its beginning, eg: 2020-12-25 > 2020,
+            # and the missing dates are empty texts, smaller than any date
+            col = self.column('date') if rows is None else self.column('date')[rows]
+            if op in ('>', '>='):
+                return col >= start
+            if op in ('<', '<='):
+                return col < start
+            return numpy.full(len(col), op == '!=')
+        return None
+
+    def index_rows(self, prop: str, op: str, val: Any) -> Optional[numpy.ndarray]:
+        """
+        The rows that match a filter expression, in order, found with the secondary indexes:
+        a date range, or a categorical equal to a value.
+        Returns None if there's no index for the expression, or if it matches too many rows.
+        """
+        max_rows = INDEX_MAX_RATIO * self._size
+        if prop in self.cats and op in ('=', '==') and isinstance(val, str):
+            cat = self.cats[prop]
+            code = -1 if not val else cat._index.get(val)
+            if code is None:
+                return numpy.zeros(0, numpy.int64)
+            if prop not in self._by_cat:
+                codes = self.column(prop)
+                order = numpy.argsort(codes, kind='stable')
+                # the start of each code, in the sorted rows, from -1
+                starts = numpy.searchsorted(codes[order], numpy.arange(-1, len(cat.values) + 1))
+                self._by_cat[prop] = (order, starts)
+            order, starts = self._by_cat[prop]
+            if code + 2 >= len(starts) or starts[code + 2] - starts[code + 1] > max_rows:
+                return None
+            # the sort is stable, so the rows with the same code are in order
+            return order[starts[code + 1] : starts[code + 2]]
+        if prop == 'date' and op in ('<', '<=', '>', '>=') and isinstance(val, str) and RE_DATE_PREFIX.match(val):
+            start = _epoch(val)
+            if start == DATE_NA:
+                return None
+            if self._by_date is None:
+                date = self.column('date')
+                order = numpy.argsort(date, kind='stable')
+                self._by_date = (order, date[order])
+            order, dates = self._by_date
+            # the same as the column mask: greater is greater or equal, and the missing dates are smaller
+            pos = int(numpy.searchsorted(dates, start, 'left'))
+            found = order[pos:] if op in ('>', '>=') else order[:pos]
+            if len(found) > max_rows:
+                return None
+            return numpy.sort(found)
+        return None
+
+    def _drop_indexes(self, name: Optional[str] = None):
+        """Drop the secondary index of a column, or all of them."""
+        if name is None or name == 'date':
+            self._by_date = None
+        if name is None:
+            self._by_cat = {}
+        else:
+            self._by_cat.pop(name, None)
+
+    @staticmethod
+    def _make_index(keys: list[str]) -> dict[str, int]:
+        # for duplicated keys, the first row wins
+        return dict(zip(reversed(keys), range(len(keys) - 1, -1, -1), strict=True))
+
+    @staticmethod
+    def _reindex(index: Optional[dict[str, int]], keys: list[str], row: int, val: str):
+        old = keys[row]
+        keys[row] = val
+        if index is None or old == val:
+            return
+        if index.get(old) == row:
+            del index[old]
+            if old in keys:
+                index[old] = keys.index(old)
+        if val and index.get(val, row) >= row:
+            index[val] = row
+
+    def _id_index(self) -> dict[str, int]:
+        if self._by_id is None:
+            self._by_id = self._make_index(self.ids)
+        return self._by_id
+
+    def row_of_id(self, img_id: str) -> Optional[int]:
+        """The row of an image ID, or None."""
+        return self._id_index().get(img_id)
+
+    def row_of_pth(self, pth: str) -> Optional[int]:
+        """The row of an image path, or None."""
+        if self._by_pth is None:
+            self._by_pth = self._make_index(self.pths)
+        return self._by_pth.get(str(pth))
+
+    def has_duplicates(self) -> bool:
+        """If some IDs are in more than one row."""
+        return len(self._id_index()) < self._size
+
+    def _set_columns(self, row: int, attrs: dict[str, str], key: Optional[str] = None):
+        if key is None:
+            self.attr_names.update(attrs)
+        elif key in attrs:
+            self.attr_names.add(key)
+        if key is None or key == 'id':
+            self._reindex(self._by_id, self.ids, row, attrs.get('id', ''))
+        if key is None or key == 'data-pth':
+            self._reindex(self._by_pth, self.pths, row, attrs.get('data-pth', ''))
+        if key is None or key == 'data-date':
+            date = _epoch(attrs.get('data-date'))
+            if self.date[row] != date:
+                self.date[row] = date
+                self._drop_indexes('date')
+        if key is None or key.startswith('data-'):
+            for name, val in _num_values(attrs):
+                self.num[name][row] = val
+            for name, cat in self.cats.items():
+                code = cat.code(attrs.get(f'data-{name}'))
+                if cat.codes[row] != code:
+                    cat.codes[row] = code
+                    self._drop_indexes(name)
+
+    def _changed(self, row: int, key: Optional[str]):
+        self._set_columns(row, self._recs[row], key)
+
+    def _raw(self, row: int) -> bytes:
+        start, end = self.spans[row]
+        if self.src is None:
+            return self.buf[start:end]
+        return self.bufs[self.src[row]][start:end]
+
+    def line(self, row: int) -> str:
+        """The serialized IMG of a row."""
+        rec = self._recs.get(row)
+        if rec is not None:
+            return img_to_html(rec)
+        return self._raw(row).decode('utf-8')
+
+    def line_bytes(self, row: int) -> bytes:
+        """The serialized IMG of a row, as UTF-8. The rows without a record are copied from the buffer as they are."""
+        rec = self._recs.get(row)
+        if rec is not None:
+            return img_to_html(rec).encode('utf-8')
+        return self._raw(row)
+
+    def source_line(self, row: int) -> Optional[bytes]:
+        """The IMG line of a row, as it was loaded or persisted, or None for the new rows."""
+        rec = self._recs.get(row)
+        if rec is not None and rec.saved is not None:
+            return rec.saved
+        if self.spans[row][0] < 0:
+            return None
+        return self._raw(row)
+
+    def attrs(self, row: int) -> dict[str, str]:
+        """
+        The attributes of a row, read-only.
+        If the row doesn't have a record, the attributes are parsed from the buffer every time.
+        """
+        rec = self._recs.get(row)
+        if rec is not None:
+            return rec
+        return parse_attrs(self._raw(row).decode('utf-8'))
+
+    def record(self, row: int) -> ImgRecord:
+        """The attributes of a row, that can be changed."""
+        rec = self._recs.get(row)
+        if rec is None:
+            rec = self._recs[row] = ImgRecord(parse_attrs(self._raw(row).decode('utf-8')), self, row)
+        return rec
+
+    def dirty_records(self) -> list[tuple[int, ImgRecord]]:
+        """The rows that were changed, or added, since they were persisted."""
+        return [(row, rec) for row, rec in self._recs.items() if rec.dirty]
+
+    def replace(self, row: int, attrs: dict[str, str]) -> ImgRecord:
+        """Replace all the attributes of a row."""
+        rec = self.record(row)
+        dict.clear(rec)
+        dict.update(rec, attrs)
+        rec._changed()
+        return rec
+
+    def append(self, attrs: dict[str, str]) -> ImgRecord:
+        row = self._size
+        self._grow(row + 1)
+        self._size += 1
+        self.ids.append('')
+        self.pths.append('')
+        self._drop_indexes()
+        rec = self._recs[row] = ImgRecord(attrs, self, row)
+        rec.dirty = True
+        self._set_columns(row, rec)
+        return rec
+
+    def rebase(self, buf: Any, spans: numpy.ndarray):
+        """
+        Point the rows to another buffer, with the same images, in the same order, eg: after saving the DB.
+        The records that were created stay the same.
+        """
+        self.buf = buf
+        self.spans = numpy.asarray(spans, numpy.int64).reshape(-1, 2)
+        self.bufs, self.src = [], None
+        for rec in self._recs.values():
+            rec.saved = None
+            rec.dirty = False
+
+    def rebase_rows(self, rows: numpy.ndarray, buf: Any, spans: numpy.ndarray) -> int:
+        """
+        Point some rows to a new buffer, eg: after saving a shard of the DB.
+        Returns the position of the new buffer; the buffers that are not used anymore are released.
+        """
+        if self.src is None:
+            self.bufs = [self.buf]
+            self.src = numpy.zeros(len(self.spans), numpy.int32)
+        index = len(self.bufs)
+        self.bufs.append(buf)
+        self.src[rows] = index
+        self.spans[rows] = spans
+        src = self.src[: self._size]
+        used = numpy.bincount(src[src >= 0], minlength=index + 1)
+        for i in numpy.flatnonzero(used[:index] == 0).tolist():
+            self.bufs[i] = b''
+        for row in rows.tolist():
+            rec = self._recs.get(row)
+            if rec is not None:
+                rec.saved = None
+                rec.dirty = False
+        return index
+
+    def take(self, rows: Iterable[int]):
+        """Keep only the given rows, in the given order."""
+        rows = numpy.fromiter(rows, numpy.int64)
+        self.spans = self.spans[rows]
+        if self.src is not None:
+            self.src = self.src[rows]
+        for name, col in self.num.items():
+            self.num[name] = col[rows]
+        self.date = self.date[rows]
+        for cat in self.cats.values():
+            cat.codes = cat.codes[rows]
+        self.ids = [self.ids[i] for i in rows]
+        self.pths = [self.pths[i] for i in rows]
+        self._by_id = self._by_pth = None
+        self._drop_indexes()
+        recs = {}
+        for new_row, old_row in enumerate(rows.tolist()):
+            rec = self._recs.get(old_row)
+            if rec is not None:
+                rec._row = new_row
+                recs[new_row] = rec
+        for old_row in self._recs.keys() - set(rows.tolist()):
+            self._recs[old_row]._store = None
+        self._recs = recs
+        self._size = len(rows)
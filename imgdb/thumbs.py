@@ -0,0 +1,123 @@
+"""
+Pack file for the thumbs of the DB, eg: imgdb.htm.1.thumbs
+The thumbs are most of the bytes of the DB, so in the packed mode they are moved out of
+the IMG elements, into a separate file, as raw image bytes, and each IMG keeps only
+a reference to its thumb, eg: data-thumb="webp,1024,2345" (type, offset, length).
+The metadata-only operations (filter, links, export, del) don't read the thumbs at all,
+and the pack is opened only when the thumbs are needed, eg: to generate a gallery,
+where the thumbs are inlined back in the IMG elements.
+The pack is append-only: the thumbs of the removed images are dropped when the pack is rebuilt.
+"""
+
+import mmap
+import os
+import re
+from base64 import b64decode, b64encode
+from pathlib import Path
+from typing import Optional
+
+# the IMG attribute with the reference of the thumb in the pack
+THUMB_ATTR = 'data-thumb'
+# the meta of the DB with the name of the pack file, next to the DB
+PACK_META = 'thumbs-pack'
+# the pack is written in chunks, when it's rebuilt
+PACK_CHUNK = 16 * 1024 * 1024
+
+RE_DATA_SRC = re.compile(r'data:image/([\w.+-]+);base64,')
+
+
+def pack_name(fname: Path | str, old_name: str = '') -> str:
+    """
+    The name of a new pack for the DB. The name of the old pack is not reused,
+    so the DB is never pointing to a pack that was not completely written.
+    """
+    m = re.search(r'\.(\d+)\.thumbs$', old_name)
+    gen = int(m.group(1)) + 1 if m else 1
+    return f'{Path(fname).name}.{gen}.thumbs'
+
+
+def _parse_ref(ref: str) -> tuple[str, int, int]:
+    kind, offset, length = ref.rsplit(',', 2)
+    return kind, int(offset), int(length)
+
+
+class ThumbPack:
+    """
+    The thumbs of a DB, in a pack file. The new thumbs are kept in memory until flush.
+    The pack is read memory-mapped, or with seek and read.
+    """
+
+    def __init__(self, fname: Path | str, use_mmap=True):
+        self.fname = Path(fname)
+        self.use_mmap = use_mmap
+        self._fd = None
+        self._data: Optional[mmap.mmap] = None
+        self._pending = bytearray()
+        self._size: Optional[int] = None
+
+    def _disk_size(self) -> int:
+        if self._size is None:
+            try:
+                self._size = self.fname.stat().st_size
+            except FileNotFoundError:
+                self._size = 0
+        return self._size
+
+    def add(self, src: str) -> Optional[str]:
+        """Add a thumb from a data URI, returns its reference, or None if the src is not a data URI."""
+        m = RE_DATA_SRC.match(src)
+        if not m:
+            return None
+        data = b64decode(src[m.end() :])
+        offset = self._disk_size() + len(self._pending)
+        self._pending += data
+        return f'{m.group(1)},{offset},{len(data)}'
+
+    def read(self, ref: str) -> tuple[str, bytes]:
+        """The type and the bytes of a thumb."""
+        kind, offset, length = _parse_ref(ref)
+        size = self._disk_size()
+        if offset >= size:
+            data = bytes(self._pending[offset - size : offset - size + length])
+        else:
+            if self._fd is None:
+                self._fd = open(self.fname, 'rb')  # NOQA
+                if self.use_mmap:
+                    self._data = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._data is not None:
+                data = self._data[offset : offset + length]
+            else:
+                self._fd.seek(offset)
+                data = self._fd.read(length)
+        if len(data) != length:
+            raise ValueError(f'Invalid thumb "{ref}" in pack: {self.fname}')
+        return kind, data
+
+    def src(self, ref: str) -> str:
+        """The thumb as a data URI, to inline it in an IMG."""
+        kind, data = self.read(ref)
+        return f'data:image/{kind};base64,' + b64encode(data).decode('ascii')
+
+    def flush(self):
+        """Append the new thumbs in the pack, and sync them on disk."""
+        if not self._pending:
+            return
+        with open(self.fname, 'ab') as fd:
+            fd.write(self._pending)
+            fd.flush()
+            os.fsync(fd.fileno())
+        self._pending = bytearray()
+        # the file is mapped again on the next read
+        self.close()
+
+    def close(self):
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+        self._size = None
+
+    def pending_size(self) -> int:
+        return len(self._pending)
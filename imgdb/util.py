@@ -1,8 +1,13 @@
+import hashlib
+import math
 import operator
 import re
 import unicodedata
 from base64 import b64encode
+from collections.abc import Callable, Mapping
+from concurrent.futures import ThreadPoolExecutor
 from difflib import SequenceMatcher, ndiff
+from functools import lru_cache
 from io import BytesIO
 from typing import Any, no_type_check
 
@@ -32,12 +37,90 @@ def img_to_b64(img: Image.Image, img_type, img_qual) -> str:
     return b64encode(fd.getvalue()).decode('ascii')
 
 
+# the size of the image strips used for hashing, in bytes
+HASH_STRIP_SZ = 4 * 1024 * 1024
+
+
+def hash_pixels(img: Image.Image, algos: list[str], digest_size=24, strip_sz=HASH_STRIP_SZ) -> dict[str, str]:
+    """
+    Content hash of the image pixels, the same as hashing img.tobytes(),
+    but the pixels are fed strip by strip, so there's no full copy of the image.
+    Multiple hashes are calculated at the same time, in threads (hashlib releases the GIL).
+    """
+    hashers = {}
+    for algo in algos:
+        if algo[:5] == 'blake':
+            hashers[algo] = hashlib.new(algo, digest_size=digest_size)  # type: ignore
+        else:
+            hashers[algo] = hashlib.new(algo)
+    if not hashers:
+        return {}
+
+    w, h = img.size
+    rows = max(1, strip_sz // max(1, w * len(img.getbands())))
+    strips = (img.crop((0, y, w, min(y + rows, h))).tobytes() for y in range(0, h, rows))
+    if len(hashers) == 1:
+        hasher = next(iter(hashers.values()))
+        for strip in strips:
+            hasher.update(strip)
+    else:
+        with ThreadPoolExecutor(max_workers=len(hashers)) as pool:
+            futures: list = []
+            for strip in strips:
+                # the next strip is cropped while the previous one is hashed
+                for f in futures:
+                    f.result()
+                futures = [pool.submit(hasher.update, strip) for hasher in hashers.values()]
+            for f in futures:
+                f.result()
+
+    return {algo: hasher.hexdigest() for algo, hasher in hashers.items()}
+
+
 def make_thumb(img: Image.Image, thumb_sz=64) -> Image.Image:
-    thumb = img.copy()
-    if getattr(thumb, '_getexif', None):
-        thumb = exif_transpose(thumb)  # type: ignore
-    thumb.thumbnail((thumb_sz, thumb_sz))
-    return thumb
+    return make_thumbs(img, {'thumb': thumb_sz})['thumb']
+
+
+def make_thumbs(img: Image.Image, sizes: dict[str, int], exact: tuple[str, ...] = ()) -> dict[str, Image.Image]:
+    """
+    Generate thumbs from a dict of names and sizes, without copying the original image.
+    The exact thumbs, eg: the inputs of the VHASHES, are resized from the original image,
+    the same as the older versions, so their values don't change.
+    The other thumbs are resized from the smallest larger thumb, and the EXIF orientation is applied.
+    """
+    thumbs: dict[str, Image.Image] = {}
+    levels: list[Image.Image] = []
+    for key, sz in sorted(sizes.items(), key=lambda kv: kv[1], reverse=True):
+        if key in exact:
+            thumb = _resize_thumb(img, sz)
+            levels.append(thumb)
+            thumbs[key] = thumb
+            continue
+        src = min((t for t in levels if max(t.size) >= sz), key=lambda t: max(t.size), default=img)
+        thumb = _resize_thumb(src, sz) if src is img or max(src.size) > sz else src
+        levels.append(thumb)
+        if getattr(img, '_getexif', None):
+            thumb = exif_transpose(thumb)
+        thumbs[key] = thumb
+    return thumbs
+
+
+def _resize_thumb(img: Image.Image, sz: int) -> Image.Image:
+    """Same as Image.thumbnail((sz, sz)), but returns a new image."""
+    w, h = img.size
+    if sz >= w and sz >= h:
+        return img.copy()
+    aspect = w / h
+    # the same rounding as Image.thumbnail
+    if aspect <= 1:
+        x = max(min(math.floor(sz * aspect), math.ceil(sz * aspect), key=lambda n: abs(aspect - n / sz)), 1)
+        size = (x, sz)
+    else:
+        y = max(
+            min(math.floor(sz / aspect), math.ceil(sz / aspect), key=lambda n: 0 if n == 0 else abs(aspect - sz / n)), 1
+        )
+        size = (sz, y)
+    return img.resize(size, Image.Resampling.BICUBIC, reducing_gap=2.0)
 
 
 @no_type_check
@@ -92,8 +175,30 @@ def slugify(string: str) -> str:
     return re.sub(r'[-\s]+', '-', re.sub(r'[^\w\s-]', '', unicodedata.normalize('NFKD', string)).strip().lower())
 
 
-def parse_query_expr(expr) -> list[list[Any]]:
-    """Parse query expressions coming from --filter args."""
+# the expressions of the filter language
+QUERY_OPS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '~': lambda val, pat: bool(re.search(pat, val)),
+    '~~': lambda val, pat: bool(re.search(pat, val, re.I)),
+    '!~': lambda val, pat: not re.search(pat, val),
+    '!~~': lambda val, pat: not re.search(pat, val, re.I),
+}
+# the relative cost of the expressions, the cheap ones are checked first
+# the meta of the images known at the first steps of the import: while scanning the folders,
+# and after reading the image header, before the pixels are decoded
+FILE_META = ('pth', 'bytes', 'mtime')
+HEADER_META = ('format', 'mode', 'width', 'height')
+QUERY_COST = {'=': 0, '==': 0, '!=': 0, '<': 1, '<=': 1, '>': 1, '>=': 1, '~': 2, '!~': 2, '~~': 3, '!~~': 3}
+
+
+def _split_query(expr) -> list[tuple[str, str, Any]]:
+    """Split query expressions coming from --filter args, into (property, expression, value)."""
     if isinstance(expr, str):
         items = [s for s in re.split('[,; ]', expr) if s.strip()]
     elif isinstance(expr, (list, tuple)):
@@ -108,43 +213,119 @@ def parse_query_expr(expr) -> list[list[Any]]:
 
     from .config import CONFIG_FIELDS, convert_config_value
 
-    EXP = {
-        '<': operator.lt,
-        '<=': operator.le,
-        '>': operator.gt,
-        '>=': operator.ge,
-        '=': operator.eq,
-        '==': operator.eq,
-        '!=': operator.ne,
-        '~': lambda val, pat: bool(re.search(pat, val)),
-        '~~': lambda val, pat: bool(re.search(pat, val, re.I)),
-        '!~': lambda val, pat: not re.search(pat, val),
-        '!~~': lambda val, pat: not re.search(pat, val, re.I),
-    }
-    i = 0
-    aev: list[Any] = []
-    result: list[list[Any]] = []
-    for word in items:
+    result = []
+    for i in range(0, len(items), 3):
         # is it a meta?
-        if not i:
-            word = slugify(word)
-            if word not in CONFIG_FIELDS:
-                raise Exception(f'Invalid property name: "{word}"')
-            aev.append(word)
+        prop = slugify(items[i])
+        if prop not in CONFIG_FIELDS:
+            raise Exception(f'Invalid property name: "{prop}"')
         # is it an expression?
-        elif i == 1:
-            if word not in EXP:
-                raise Exception(f'Invalid expression name: "{word}"')
-            aev.append(EXP[word])
-        # it must be a value
-        else:
-            # convert value to the correct type
-            aev.append(convert_config_value(aev[0], word))
-        if i > 1:
-            i = 0
-            result.append(aev)
-            aev = []
-        else:
-            i += 1
-
+        op = items[i + 1]
+        if op not in QUERY_OPS:
+            raise Exception(f'Invalid expression name: "{op}"')
+        # it must be a value; convert value to the correct type
+        val = items[i + 2]
+        result.append((prop, op, '' if val in ('""', "''") else convert_config_value(prop, val)))
     return result
+
+
+def parse_query_expr(expr) -> list[list[Any]]:
+    """Parse query expressions coming from --filter args."""
+    return [[prop, QUERY_OPS[op], val] for prop, op, val in _split_query(expr)]
+
+
+def _compile_test(op: str, val: Any) -> Callable[[Any], bool]:
+    """Compile an expression into a check of a meta value; the missing values are None."""
+    if op in ('~', '~~', '!~', '!~~'):
+        search = re.compile(str(val), re.I if op.endswith('~~') else 0).search
+        negate = op.startswith('!')
+
+        def test_re(v: Any) -> bool:
+            if v is None:
+                v = ''
+            elif not isinstance(v, str):
+                v = str(v)
+            return (search(v) is None) is negate
+
+        return test_re
+
+    if op in ('=', '==', '!='):
+        equal = op != '!='
+
+        def test_eq(v: Any) -> bool:
+            return ((v if v is not None else '') == val) is equal
+
+        return test_eq
+
+    func = QUERY_OPS[op]
+
+    def test(v: Any) -> bool:
+        try:
+            return func(v, val)
+        except TypeError:
+            # eg: comparing a missing number, or a text with a number
+            return False
+
+    return test
+
+
+class QueryFilter:
+    """
+    The query expressions, compiled into a single predicate on the image meta-data:
+    the values are converted and the regexes are compiled once, the cheap expressions
+    are checked first, and the check stops at the first expression that doesn't match.
+    The missing meta are empty texts.
+    """
+
+    def __init__(self, exprs: list[tuple[str, str, Any]]):
+        self.props = [prop for prop, _, _ in exprs]
+        # a stable sort, the expressions with the same cost are checked in order
+        exprs = sorted(exprs, key=lambda e: QUERY_COST[e[1]])
+        # the expressions, as (property, expression, value, check of the value)
+        self.clauses = [(prop, op, val, _compile_test(op, val)) for prop, op, val in exprs]
+        self._checks = [(prop, test) for prop, _, _, test in self.clauses]
+
+    def __bool__(self) -> bool:
+        return bool(self._checks)
+
+    def split(self, props: tuple[str, ...]) -> tuple['QueryFilter', 'QueryFilter']:
+        """Split the expressions on some properties, from the rest of the expressions."""
+        exprs = [(prop, op, val) for prop, op, val, _ in self.clauses]
+        return (
+            QueryFilter([e for e in exprs if e[0] in props]),
+            QueryFilter([e for e in exprs if e[0] not in props]),
+        )
+
+    def __call__(self, m: Mapping[str, Any]) -> bool:
+        # faster than all() with a generator
+        for prop, test in self._checks:  # NOQA: SIM110
+            if not test(m.get(prop)):
+                return False
+        return True
+
+
+@lru_cache(maxsize=64)
+def _compile_text(expr: str) -> QueryFilter:
+    return QueryFilter(_split_query(expr))
+
+
+def compile_query(expr) -> QueryFilter:
+    """Compile the query expressions coming from --filter args. The text expressions are compiled only once."""
+    if isinstance(expr, str):
+        return _compile_text(expr)
+    return QueryFilter(_split_query(expr))
+
+
+@lru_cache(maxsize=16)
+def filter_stages(
+    expr: str, computed: tuple[str, ...] = ()
+) -> tuple[QueryFilter, QueryFilter, QueryFilter, QueryFilter]:
+    """
+    Split the filter by the step of the import where the meta of the images are known:
+    the file (while scanning the folders), the image header (before the pixels are decoded),
+    the EXIF & XMP (before the thumbs and the hashes) and the computed meta, eg: algorithms, hashes.
+    """
+    file_f, rest = compile_query(expr).split(FILE_META)
+    header_f, rest = rest.split(HEADER_META)
+    computed_f, exif_f = rest.split(computed)
+    return file_f, header_f, exif_f, computed_f
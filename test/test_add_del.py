@@ -1,3 +1,5 @@
+import os
+import shutil
 from os import listdir
 from pathlib import Path
 
@@ -18,6 +20,43 @@ def test_add(temp_dir):
     assert len(db) == 1
 
 
+def test_skip_imported(temp_dir, caplog):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname))
+    db = ImgDB(dbname)
+    assert len(db.fingerprints()) == len(IMGS)
+    pth = Path('test/pics/Aldrin_Apollo_11.jpg')
+    assert (str(pth), pth.stat().st_size, int(pth.stat().st_mtime)) in db.fingerprints()
+    # the imported files are skipped before they are processed
+    add_op(['test/pics'], Config(db=dbname, skip_imported=True))
+    assert f'Skipped: {len(IMGS)} imported files, to process: 0 files' in caplog.text
+    assert len(ImgDB(dbname)) == len(IMGS)
+
+
+def test_skip_archived(temp_dir, caplog):
+    archive = Path(temp_dir) / 'archive'
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname, output=archive, operation='copy'))
+    assert all(el['data-pth'].startswith(str(archive)) for el in ImgDB(dbname).images)
+    # the archived files keep their mtime, so they are skipped before they are processed
+    add_op([archive], Config(db=dbname, deep=True, skip_imported=True))
+    assert f'Skipped: {len(IMGS)} imported files, to process: 0 files' in caplog.text
+    # the source files have other paths, they are skipped after they are processed
+    caplog.clear()
+    add_op(['test/pics'], Config(db=dbname, output=archive, operation='copy', skip_imported=True))
+    assert 'Skipped:' not in caplog.text
+    assert len(ImgDB(dbname)) == len(IMGS)
+    # a changed file is not skipped
+    pth = f'{temp_dir}/pic.jpg'
+    shutil.copy('test/pics/Aldrin_Apollo_11.jpg', pth)
+    add_op([pth], Config(db=dbname, skip_imported=True))
+    st = os.stat(pth)
+    os.utime(pth, (st.st_atime, st.st_mtime + 10))
+    caplog.clear()
+    add_op([pth], Config(db=dbname, skip_imported=True))
+    assert 'Skipped:' not in caplog.text
+
+
 def test_add_deep(temp_dir):
     dbname = f'{temp_dir}/test-db.htm'
     # test deep option + duplicates
@@ -0,0 +1,46 @@
+from os import listdir
+
+from imgdb.cache import MetaCache
+from imgdb.config import Config
+from imgdb.db import ImgDB
+from imgdb.main import add_op
+
+IMGS = listdir('test/pics')
+
+
+def test_meta_cache(temp_dir):
+    dbname = f'{temp_dir}/test-db.htm'
+    cache_name = f'{temp_dir}/test.cache'
+    add_op(['test/pics'], Config(db=dbname, cache=cache_name))
+    db1 = ImgDB(dbname)
+    assert len(db1) == len(IMGS)
+
+    cache = MetaCache(cache_name, Config())
+    assert cache.count() == len(IMGS)
+    pth = 'test/pics/Aldrin_Apollo_11.jpg'
+    m = cache.get(pth)
+    assert m and m['pth'] == pth
+    assert m['id'] == db1.get_by_id(m['id'])['id']
+    # a different config doesn't use the same cache
+    assert MetaCache(cache_name, Config(thumb_sz=64)).get(pth) is None
+
+    # re-import from the cache, into a new DB
+    dbname2 = f'{temp_dir}/test-db2.htm'
+    add_op(['test/pics'], Config(db=dbname2, cache=cache_name, filter='format = PNG'))
+    db2 = ImgDB(dbname2)
+    assert len(db2) == 1
+    add_op(['test/pics'], Config(db=dbname2, cache=cache_name))
+    db2 = ImgDB(dbname2)
+    assert len(db2) == len(IMGS)
+    for m in db1:
+        assert db2.get_by_id(m['id']) == m
+
+    # a changed file is not in the cache anymore
+    assert cache.purge() == 0
+    cache.db.execute('UPDATE metas SET mtime = 1 WHERE pth = ?', (pth,))
+    assert cache.get(pth) is None
+    assert cache.purge() == 1
+
+    assert cache.clear() == len(IMGS) - 1
+    assert cache.count() == 0
+    cache.close()
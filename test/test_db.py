@@ -1,8 +1,15 @@
+import json
 from os import listdir
 
+import numpy
+import pytest
+from bs4 import BeautifulSoup
+
 from imgdb.config import Config, g_config
-from imgdb.db import ImgDB, _is_valid_img, db_merge, db_split
+from imgdb.db import ImgDB, _is_valid_img, _save_order, db_commit, db_merge, db_split
+from imgdb.img import ImgMeta
 from imgdb.main import add_op, db_op
+from imgdb.util import compile_query
 
 IMGS = listdir('test/pics')
 
@@ -41,6 +48,95 @@ def test_db_split_merge(temp_dir):
     assert len(imgs) == len(IMGS)
 
 
+def test_db_commit(temp_dir):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname, c_hashes='blake2b'))
+    db = ImgDB(dbname)
+    el = db.images[1]
+    new = '<img id="x1234" data-pth="test/pics/new.png" data-bytes="1" data-mode="RGB" data-format="PNG" src="">'
+    new += f'<img id="{el["id"]}" data-pth="{el["data-pth"]}" data-date="2000-01-01 00:00:00" data-iso="100">'
+    assert db_commit(dbname, new) == 2
+    # the result is the same as the full merge & save
+    db_merge_name = f'{temp_dir}/test-merge.htm'
+    ImgDB(elems=db_merge(db.images, new), config=Config(db=db_merge_name)).save()
+    lines = [ln for ln in open(dbname) if ln.startswith('<img')]  # NOQA
+    assert lines == [ln for ln in open(db_merge_name) if ln.startswith('<img')]  # NOQA
+    db2 = ImgDB(dbname)
+    assert len(db2) == len(IMGS) + 1
+    m = db2.get_by_id(el['id'])
+    assert m['iso'] == 100
+    assert m['blake2b'] == el['data-blake2b']
+    # the images are sorted by date, the images without date are the last
+    assert [e['id'] for e in db2.images[-2:]] == [el['id'], 'x1234']
+    # the changed images are merged
+    assert (
+        db_commit(
+            dbname, '<img id="x1234" data-pth="test/pics/new.png" data-bytes="2" data-mode="RGB" data-format="PNG">'
+        )
+        == 1
+    )
+    assert ImgDB(dbname).get_by_id('x1234')['bytes'] == 2
+    assert len(ImgDB(dbname)) == len(IMGS) + 1
+
+
+def test_db_load_lines(temp_dir):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname, c_hashes='blake2b', v_hashes='dhash'))
+    db = ImgDB(dbname)
+    # the same images as BeautifulSoup
+    soup = BeautifulSoup(open(dbname).read(), 'lxml')  # NOQA
+    assert [el.attrs for el in soup.find_all('img')] == [el.attrs for el in db.images]
+    assert db.meta == {el['name']: el['content'] for el in soup.find_all('meta', attrs={'name': True})}
+    # the tags are created on demand, and share the attributes with the DB
+    el = db.images[0]
+    assert el is db.images[0]
+    el['data-iso'] = '200'
+    assert db.get_by_id(el['id'])['iso'] == 200
+    # add & remove
+    tag = db.add({'id': el['id'], 'data-pth': el['data-pth'], 'data-iso': '400', 'data-lens': ' '})
+    assert tag is el
+    assert el['data-iso'] == '400'
+    assert 'data-lens' not in el
+    assert db.remove(el['id'], 'x1234') == 1
+    assert el['id'] not in db
+    assert len(db) == len(IMGS) - 1
+    # a DB saved on one line is loaded with BeautifulSoup, with the same result
+    db_one_line = f'{temp_dir}/test-one-line.htm'
+    with open(db_one_line, 'w') as fd:
+        fd.write(open(dbname).read().replace('\n', ' '))  # NOQA
+    assert [el.attrs for el in ImgDB(db_one_line).images] == [el.attrs for el in soup.find_all('img')]
+
+
+def test_db_save(temp_dir):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname))
+    # the lines that are not changed are saved as they are
+    content = open(dbname).read()  # NOQA
+    lines = [line for line in content.split('\n') if line.startswith('<img ')]
+    reordered = lines[0].replace('<img ', '<img  data-x="1" ', 1)
+    with open(dbname, 'w') as fd:
+        fd.write(content.replace(lines[0], reordered))
+    db = ImgDB(dbname)
+    assert _save_order(db.store, 'date') is None
+    db.save()
+    assert reordered in open(dbname).read()  # NOQA
+    assert listdir(temp_dir) == ['test-db.htm']
+    # the changed images are sorted again
+    el = db.images[-1]
+    el['data-date'] = '2099-01-01 00:00:00'
+    assert _save_order(db.store, 'date').tolist()[0] == len(db) - 1
+    db.save()
+    assert db.images[0] is el
+    assert db.store.line(0) == str(el)
+    assert [el.attrs for el in ImgDB(dbname).images] == [el.attrs for el in db.images]
+    # the duplicates are removed
+    db.store.append(dict(el.attrs))
+    db.store.append({**el.attrs, 'data-bytes': '1'})
+    assert _save_order(db.store, 'date').tolist() == [0, len(db) - 1, *range(1, len(db) - 2)]
+    db.save()
+    assert len(ImgDB(dbname)) == len(IMGS) + 1
+
+
 def test_db_empty_filter(temp_dir):
     dbname = f'{temp_dir}/test-db.htm'
     add_op(['test/pics'], Config(db=dbname))
@@ -48,6 +144,11 @@ def test_db_empty_filter(temp_dir):
     metas, imgs = db.filter()
     assert len(metas) == len(IMGS)
     assert len(imgs) == len(IMGS)
+    assert all(type(m) is dict for m in metas)
+    # the deprecated soup has the same images
+    with pytest.deprecated_call():
+        soup = db.db
+    assert [el.attrs['id'] for el in soup.find_all('img')] == [el.attrs['id'] for el in imgs]
 
 
 def test_db_filters(temp_dir):
@@ -81,6 +182,31 @@ def test_db_filters(temp_dir):
     assert len(imgs) == 0
 
 
+def test_db_filter_columns(temp_dir):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname, algorithms='illumination', metadata='iso'))
+    db = ImgDB(dbname)
+    base = {'data-bytes': '5', 'data-mode': 'RGB', 'data-format': 'PNG'}
+    db.add({'id': 'x1234', 'data-pth': 'test/x.png', 'data-iso': '0', 'data-size': '0,0', **base})
+    db.add({'id': 'y1234', 'data-pth': 'test/y.png', 'data-date': '2021-12-25 00:00:00', **base})
+    # the expressions checked on the columns match the same images as on the metas of each row
+    for query in (
+        'width > 600 ; bytes > 1000 ; date >= 2000',
+        'date > 2021 ; date < 2021-12-26',
+        'date != 2021 ; date = 2021',
+        'iso = 0 ; iso != 100',
+        'iso < 200',
+        'illumination > 1 ; illumination < 99',
+        'format = PNG ; mode != RGB',
+        'maker-model = "" ; format ~~ png',
+        'pth ~ [A-M] ; height <= 1024',
+        'bytes ~ 5 ; date ~ -12-25',
+    ):
+        expr = compile_query(query)
+        rows = [row for row in range(len(db)) if expr(ImgMeta(db.store.attrs(row)))]
+        assert [row for row, _ in db._query_rows(expr)] == rows, query
+
+
 def test_db_rem(temp_dir):
     dbname = f'{temp_dir}/test-db.htm'
     add_op(['test/pics'], Config(db=dbname, algorithms='illumination', v_hashes='ahash,dhash', verbose=True))
@@ -106,6 +232,56 @@ def test_db_rem(temp_dir):
     assert any(x.get('dhash') for x in metas) is False
 
 
+def test_db_lookups(temp_dir):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname))
+    db = ImgDB(dbname)
+    img = db.images[1]
+    img_id, pth = img['id'], img['data-pth']
+    assert img_id in db
+    assert db.get_by_id(img_id)['pth'] == pth
+    assert db.get_by_path(pth)['id'] == img_id
+    assert db.get_el_by_id(img_id) is img
+    assert db.get_by_id('x') is None
+    # the lookups follow the changes of the images
+    img['id'] = 'x1234'
+    img['data-pth'] = 'x/x1234.jpg'
+    assert img_id not in db
+    assert not db.has_path(pth)
+    assert db.get_by_path('x/x1234.jpg')['id'] == 'x1234'
+    db.add({'id': 'y1234', 'data-pth': 'y/y1234.jpg', 'data-bytes': '1'})
+    assert db.get_by_path('y/y1234.jpg')['id'] == 'y1234'
+    db.remove('x1234')
+    assert 'x1234' not in db
+    assert 'y1234' in db
+    assert db.get_by_id(db.images[1]['id'])['pth'] == db.images[1]['data-pth']
+
+
+def test_db_images(temp_dir):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname))
+    db = ImgDB(dbname)
+    imgs = db.images
+    assert imgs is db.images
+    # the images are kept in order by add and remove
+    new = db.add(
+        {'id': 'x1234', 'data-pth': 'x/x1234.jpg', 'data-bytes': '1', 'data-format': 'JPEG', 'data-mode': 'RGB'}
+    )
+    assert db.images == imgs + [new]
+    assert db.remove(imgs[0]['id'], 'x') == 1
+    assert db.images == imgs[1:] + [new]
+    assert len(db) == len(imgs)
+    db.add({**imgs[1].attrs, 'data-bytes': '1'})
+    assert len(db) == len(imgs)
+    # a remove and an add that keep the same count
+    assert db.remove(new['id']) == 1
+    other = db.add({**new.attrs, 'id': 'y1234', 'data-pth': 'x/y1234.jpg'})
+    assert db.images == imgs[1:] + [other]
+    db.save()
+    assert len(db.images) == len(imgs)
+    assert [el['id'] for el in db.images] == [el['id'] for el in ImgDB(dbname).images]
+
+
 def test_db_export(temp_dir):
     db_path = f'{temp_dir}/test-db.htm'
     add_op(['test/pics'], Config(db=db_path))
@@ -113,7 +289,7 @@ def test_db_export(temp_dir):
     out = f'{temp_dir}/test-db.csv'
     db_op('export', Config(db=db_path, output=out, format='csv'))
     with open(out) as fd:
-        assert fd.readline().startswith('"id","pth"')
+        assert fd.readline().startswith('"id","pth","Date","Pth",')
         assert len(fd.readlines()) == len(IMGS)
 
     out = f'{temp_dir}/test-table.htm'
@@ -122,6 +298,29 @@ def test_db_export(temp_dir):
         assert fd.readline().startswith('<table style=')
         assert len(fd.readlines()) == len(IMGS) + 2
 
+    # the header of the CSV is the same as the metas
+    db = ImgDB(db_path)
+    db.store.record(0)['data-iso'] = '200'
+    assert db.export_schema() == ['id', 'pth', *sorted(set(ImgMeta(db.store.attrs(0), native=False)) - {'id', 'pth'})]
+
+    out = f'{temp_dir}/test-db.jl'
+    db_op('export', Config(db=db_path, output=out, format='jl'))
+    with open(out) as fd:
+        metas = [json.loads(line) for line in fd]
+    out = f'{temp_dir}/test-db.json'
+    db_op('export', Config(db=db_path, output=out, format='json'))
+    with open(out) as fd:
+        assert json.load(fd) == metas
+    assert len(metas) == len(IMGS)
+
+    out = f'{temp_dir}/test-db.npz'
+    db_op('export', Config(db=db_path, output=out, format='npz', filter='format = JPEG'))
+    with numpy.load(out) as cols:
+        jpegs = [m for m in metas if m['format'] == 'JPEG']
+        assert cols['id'].tolist() == [m['id'] for m in jpegs]
+        assert cols['bytes'].tolist() == [m['bytes'] for m in jpegs]
+        assert cols['date'].astype(str).tolist() == [m['date'].replace(' ', 'T') for m in jpegs]
+
     db = ImgDB(db_path)
     stat = str(db.stats())
     assert 'bytes' in stat
@@ -173,3 +372,12 @@ def test_broken_DBs(temp_dir):
     db.save(db_path)
     db = ImgDB(db_path)
     assert len(db) == 1
+
+
+def test_db_sync_filter(temp_dir):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname, filter='format = PNG'))
+    assert len(ImgDB(dbname)) == 1
+    # the sync reports all the files that are not imported, the filter doesn't apply
+    db = ImgDB(dbname, config=Config(db=dbname, filter='bytes > 999999999'))
+    assert db.sync_folders(['test/pics']) == (1, 0, len(IMGS) - 1)
@@ -0,0 +1,70 @@
+import mmap
+
+import numpy
+
+import imgdb.db
+from imgdb.config import Config
+from imgdb.db import ImgDB
+from imgdb.dbindex import index_name, load_index
+from imgdb.main import add_op
+
+NEW_IMG = '<img id="x1234" data-pth="test/pics/new.png" data-bytes="1" data-mode="RGB" data-format="PNG">'
+
+
+def _same_store(db1: ImgDB, db2: ImgDB):
+    s1, s2 = db1.store, db2.store
+    assert s1.ids == s2.ids
+    assert s1.pths == s2.pths
+    for name in (*s1.num, 'date', *s1.cats):
+        assert numpy.array_equal(s1.column(name), s2.column(name), equal_nan=True)
+    assert [s1.attrs(i) for i in range(len(s1))] == [s2.attrs(i) for i in range(len(s2))]
+    assert s1.attr_names == s2.attr_names
+    assert db1.meta == db2.meta
+
+
+def test_db_index(temp_dir, monkeypatch):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname, v_hashes='dhash'))
+    # the DB is too small to have an index
+    db1 = ImgDB(dbname)
+    assert not index_name(dbname).is_file()
+
+    monkeypatch.setattr(imgdb.db, 'INDEX_MIN_IMAGES', 0)
+    db1 = ImgDB(dbname)
+    assert index_name(dbname).is_file()
+    db2 = ImgDB(dbname)
+    assert isinstance(db2.store.buf, mmap.mmap)
+    _same_store(db1, db2)
+
+    # the DB was changed outside img-DB, the index is stale and it's rebuilt
+    with open(dbname) as fd:
+        content = fd.read()
+    with open(dbname, 'w') as fd:
+        fd.write(content.replace('</body></html>', NEW_IMG + '\n</body></html>'))
+    assert load_index(dbname) is None
+    db3 = ImgDB(dbname)
+    assert isinstance(db3.store.buf, bytes)
+    assert 'x1234' in db3
+    db4 = ImgDB(dbname)
+    assert isinstance(db4.store.buf, mmap.mmap)
+    _same_store(db3, db4)
+
+    # the images can be changed after loading from the index, and the index is updated on save
+    el = db4.images[0]
+    el['data-iso'] = '800'
+    db4.remove('x1234')
+    db4.save()
+    db5 = ImgDB(dbname)
+    assert isinstance(db5.store.buf, mmap.mmap)
+    assert db5.get_by_id(el['id'])['iso'] == 800
+    assert db5.store.column('iso')[0] == 800
+    assert 'x1234' not in db5
+    _same_store(db4, db5)
+
+    # another version of the index is rebuilt
+    with open(index_name(dbname), 'r+b') as fd:
+        fd.seek(8)
+        fd.write(b'\xff')
+    assert load_index(dbname) is None
+    _same_store(db5, ImgDB(dbname))
+    assert load_index(dbname) is not None
@@ -1,8 +1,17 @@
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy
+import rawpy
 from bs4 import BeautifulSoup
 from PIL import Image
 
+import imgdb.img
 from imgdb.config import Config
-from imgdb.img import _post_process_mm, el_to_meta, img_to_meta, meta_to_html
+from imgdb.fsys import find_files
+from imgdb.img import ImgMeta, _post_process_mm, el_to_meta, img_to_meta, meta_to_html, raw_full_size, raw_to_img
+from imgdb.util import filter_stages
 
 
 def test_img_meta():
@@ -22,6 +31,35 @@ def test_img_meta():
     assert img is None and m == {}
 
 
+def test_img_meta_filter_stages(monkeypatch):
+    p = 'test/pics/Aldrin_Apollo_11.jpg'
+    file_f, header_f, exif_f, computed_f = filter_stages(
+        'bytes > 1 ; width > 1 ; date > 2000 ; illumination > 1', ('illumination',)
+    )
+    assert (file_f.props, header_f.props, exif_f.props, computed_f.props) == (
+        ['bytes'],
+        ['width'],
+        ['date'],
+        ['illumination'],
+    )
+    # the filter on the file and the header is checked before making the thumbs
+    monkeypatch.setattr(imgdb.img, 'make_thumbs', None)
+    assert img_to_meta(p, Config(filter='bytes > 999999')) == (None, {})
+    assert img_to_meta(p, Config(filter='pth ~ Aldrin ; format = PNG')) == (None, {})
+    assert img_to_meta(p, Config(filter='maker-model = X')) == (None, {})
+    monkeypatch.undo()
+    # the filter on the computed meta is checked after computing them
+    _, m = img_to_meta(p, Config(filter='illumination > 0 ; format = JPEG', algorithms='illumination'))
+    assert m['illumination'] > 0
+    assert img_to_meta(p, Config(filter='illumination > 100', algorithms='illumination')) == (None, {})
+    c = Config(filter='bytes < 500000 ; pth ~ .jpg$')
+    assert len(find_files(['test/pics'], c)) == 3
+    assert find_files(['test/pics'], c, filtered=True) == [
+        Path('test/pics/Aldrin_Apollo_11.jpg'),
+        Path('test/pics/Mona_Lisa_by_Leonardo_da_Vinci.jpg'),
+    ]
+
+
 def test_el_meta():
     soup = BeautifulSoup(
         """<img data-blake2b="8e67c10552405140d9f818baf3764224d48e98ae89440542" data-bytes="76" data-dhash="0000000000000000000000000000" data-format="PNG" data-mode="RGB" data-pth="Pictures/archive/8e67c10552405140d9f818baf3764224d48e98ae89440542.png" data-size="8,8" id="8e67c10552405140d9f818baf3764224d48e98ae89440542" src="data:image/webp;base64,UklGRjgAAABXRUJQVlA4ICwAAABwAQCdASoIAAgAAkA4JaACdAFAAAD+76xX/unr//aev/9p6/qZ8jnelRgAAA=="/>""",  # NOQA
@@ -38,6 +76,36 @@ def test_el_meta():
     assert isinstance(meta['height'], int) and meta['height'] == 8
 
 
+def test_img_meta_lazy():
+    attrs = {
+        'id': 'asdzxc123',
+        'data-pth': '/some/place/img.jpg',
+        'data-format': 'JPEG',
+        'data-mode': 'RGB',
+        'data-bytes': '1234',
+        'data-date': '2020-01-02 03:04:05',
+        'data-size': '640,480',
+        'data-iso': '400',
+        'data-unknown': 'x',
+        'src': 'data:image/webp;base64,',
+    }
+    meta = ImgMeta(attrs)
+    assert meta.get('format') == 'JPEG'
+    # only the used meta are converted
+    assert list(meta._cache) == ['format']
+    assert meta == el_to_meta(attrs)
+    assert meta['Date'].year == 2020
+    assert meta['width'] == 640 and meta['iso'] == 400
+    assert 'unknown' not in meta and meta.get('rating') is None
+    # the meta are converted again when the attributes are changed
+    attrs['data-date'] = '2021-01-02 03:04:05'
+    attrs['data-size'] = '800,600'
+    assert meta['Date'].year == 2021
+    assert meta['width'] == 800
+    assert dict(meta) == el_to_meta(attrs)
+    assert 'Pth' not in ImgMeta(attrs, native=False)
+
+
 def test_meta_to_html_back():
     m = {
         'id': 'asdzxc123',
@@ -70,3 +138,65 @@ def test_process_maker_model():
     assert _post_process_mm('SONY CORPORATION', 'SONY Dx') == 'Sony-Dx'
     assert _post_process_mm('SONY', 'Dx') == 'Sony-Dx'
     assert _post_process_mm('SONY', 'SONY Dx') == 'Sony-Dx'
+
+
+def test_img_meta_draft():
+    p = 'test/pics/Aldrin_Apollo_11.jpg'
+    c = {'c_hashes': '', 'uid': '{dhash}', 'v_hashes': 'dhash,rchash', 'algorithms': 'illumination'}
+    img1, m1 = img_to_meta(p, Config(**c))
+    img2, m2 = img_to_meta(p, Config(**c, draft=True))
+    # the draft image is decoded at a smaller size
+    assert img2.size[0] < img1.size[0] and img2.size[1] < img1.size[1]
+    # but the meta is the same as the original image
+    for k in ('format', 'mode', 'size', 'bytes', 'date'):
+        assert m1[k] == m2[k]
+    assert m1['dhash'] == m2['dhash']
+    assert abs(m1['illumination'] - m2['illumination']) < 1
+
+    # draft is disabled when a content hash is needed
+    img3, m3 = img_to_meta(p, Config(draft=True))
+    assert img3.size == img1.size
+    assert m3['blake2b']
+
+
+class FakeRaw:
+    """A RAW image 600x400 rotated 90 degrees, with a 240x160 JPEG preview."""
+
+    sizes = SimpleNamespace(width=600, height=400, flip=6)
+
+    def __init__(self, preview=True):
+        self.preview = preview
+        self.calls = []
+
+    def extract_thumb(self):
+        if not self.preview:
+            raise rawpy.LibRawNoThumbnailError()
+        buf = BytesIO()
+        Image.new('RGB', (240, 160), 'red').save(buf, 'JPEG')
+        return SimpleNamespace(format=rawpy.ThumbFormat.JPEG, data=buf.getvalue())
+
+    def postprocess(self, half_size=False, **_):
+        self.calls.append(half_size)
+        w, h = raw_full_size(self)
+        if half_size:
+            w, h = w // 2, h // 2
+        return numpy.zeros((h, w, 3), dtype=numpy.uint8)
+
+
+def test_raw_to_img():
+    assert raw_full_size(FakeRaw()) == (400, 600)
+    raw = FakeRaw()
+    assert raw_to_img(raw, 'full').size == (400, 600)
+    assert raw_to_img(raw, 'half').size == (200, 300)
+    assert raw.calls == [False, True]
+    # the preview is rotated like the processed image
+    raw = FakeRaw()
+    img = raw_to_img(raw, 'preview', 200)
+    assert img.size == (160, 240)
+    assert img.getpixel((10, 10))[0] > 200
+    assert not raw.calls
+    # the preview is too small, or missing
+    assert raw_to_img(raw, 'preview', 256).size == (200, 300)
+    assert raw_to_img(FakeRaw(preview=False), 'preview').size == (200, 300)
+    assert raw_to_img(raw, 'half', 301).size == (400, 600)
+    assert raw.calls == [True, False]
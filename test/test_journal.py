@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+import imgdb.db
+from imgdb.config import Config
+from imgdb.db import ImgDB, db_commit
+from imgdb.journal import append_journal, db_generation, journal_name, read_journal
+from imgdb.main import add_op
+
+NEW_IMG = '<img id="x1234" data-pth="test/pics/new.png" data-bytes="1" data-mode="RGB" data-format="PNG">'
+
+
+def test_db_journal(temp_dir, monkeypatch):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname))
+    # the small DBs are saved
+    db = ImgDB(dbname)
+    db.meta['x'] = 'y'
+    db.commit()
+    assert not journal_name(dbname).is_file()
+
+    monkeypatch.setattr(imgdb.db, 'INDEX_MIN_IMAGES', 0)
+    content = open(dbname).read()  # NOQA
+    db = ImgDB(dbname)
+    imgs = db.images
+    imgs[0]['data-iso'] = '800'
+    db.remove(imgs[1]['id'])
+    db.meta['x'] = 'z'
+    assert db.commit() > 0
+    assert db.commit() == 0
+    # the DB file is not changed, the changes are in the journal
+    assert open(dbname).read() == content  # NOQA
+    assert [tag for tag, _ in read_journal(dbname, db_generation(db.meta))] == ['del', 'meta', 'meta', 'img']
+
+    db2 = ImgDB(dbname)
+    assert len(db2) == len(imgs) - 1
+    assert db2.get_by_id(imgs[0]['id'])['iso'] == 800
+    assert imgs[1]['id'] not in db2
+    assert db2.meta['x'] == 'z'
+    assert db2.meta == db.meta
+    # the new images are added in the journal
+    db_commit(dbname, NEW_IMG)
+    assert open(dbname).read() == content  # NOQA
+    db3 = ImgDB(dbname)
+    assert 'x1234' in db3
+    db3.get_el_by_id('x1234')['id'] = 'x5678'
+    db3.commit()
+    db4 = ImgDB(dbname)
+    assert 'x5678' in db4
+    assert 'x1234' not in db4
+
+    # the journal is folded into the DB on save
+    db4.save()
+    assert not journal_name(dbname).is_file()
+    db5 = ImgDB(dbname)
+    assert [el.attrs for el in db5.images] == [el.attrs for el in db4.images]
+    assert db5.meta == db4.meta
+
+
+def test_journal_stale(temp_dir):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname))
+    gen = db_generation(ImgDB(dbname).meta)
+    append_journal(dbname, ['<del id="x1234"/>', '<meta content="y" name="x"/>'], gen)
+    with open(journal_name(dbname), 'ab') as fd:
+        fd.write(b'<meta content="z" na')
+    # the last line is not complete
+    assert [tag for tag, _ in read_journal(dbname, gen)] == ['del', 'meta']
+    assert ImgDB(dbname).meta['x'] == 'y'
+    # the DB was saved after the journal was written
+    db = ImgDB(dbname)
+    db.meta['x'] = 'w'
+    db.save()
+    journal_name(dbname).write_text(f'<journal gen="{gen}"/>\n<meta content="y" name="x"/>\n')
+    assert not list(read_journal(dbname, db_generation(db.meta)))
+    assert ImgDB(dbname).meta['x'] == 'w'
+    with pytest.raises(ValueError):
+        append_journal(dbname, ['<del id="x1234"/>'], db_generation(db.meta))
+
+
+def test_journal_touch(temp_dir, monkeypatch):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname))
+    monkeypatch.setattr(imgdb.db, 'INDEX_MIN_IMAGES', 0)
+    db = ImgDB(dbname)
+    ids = [el['id'] for el in db.images]
+    db.remove(ids[0])
+    db.commit()
+    assert journal_name(dbname).is_file()
+    # the stat of the DB doesn't matter, eg: touch, or a copy
+    os.utime(dbname)
+    db = ImgDB(dbname)
+    assert ids[0] not in db
+    db.remove(ids[1])
+    db.commit()
+    db = ImgDB(dbname)
+    assert [el['id'] for el in db.images] == ids[2:]
+
+    # the journal of another generation is not replayed, and it's not appended
+    gen = db_generation(db.meta)
+    journal_name(dbname).write_text(f'<journal gen="{gen}0"/>\n<del id="{ids[2]}"/>\n')
+    db = ImgDB(dbname)
+    assert ids[2] in db
+    db.meta['x'] = 'y'
+    db.commit()
+    assert not journal_name(dbname).is_file()
+    db = ImgDB(dbname)
+    assert db.meta['x'] == 'y' and ids[2] in db
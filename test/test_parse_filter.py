@@ -1,4 +1,4 @@
-from imgdb.util import parse_query_expr
+from imgdb.util import compile_query, parse_query_expr
 
 
 def _basic_assert(parsed):
@@ -30,3 +30,30 @@ def test_multi_expr():
     assert parsed[0][2] == '2020'
     assert parsed[1][0] == 'bytes'
     assert parsed[1][2] == 1000
+
+
+def test_compiled_filter():
+    m = {'format': 'JPEG', 'bytes': 1234, 'date': '2020-12-25 10:00:00', 'maker-model': 'Canon-EOS'}
+    assert compile_query('format = JPEG ; bytes > 1000')(m)
+    assert not compile_query('format = JPEG ; bytes > 2000')(m)
+    assert compile_query('date ~ 2[0-9]{3}-12-25 ; maker-model ~~ canon')(m)
+    assert not compile_query('maker-model ~ canon')(m)
+    assert compile_query('maker-model !~ canon ; format != PNG')(m)
+    # the missing meta are empty texts, and don't match the comparisons
+    assert compile_query('lens = "" ; lens !~ Sony')(m)
+    assert not compile_query('iso > 100')(m)
+    assert not compile_query('iso < 100')(m)
+    assert not compile_query('')
+    # the expressions are compiled once, the cheap ones are checked first
+    query = compile_query('date ~ 2020 ; bytes > 1000 ; format = JPEG')
+    assert query is compile_query('date ~ 2020 ; bytes > 1000 ; format = JPEG')
+    assert query.props == ['date', 'bytes', 'format']
+    checked = []
+
+    class Meta(dict):
+        def get(self, key, default=None):
+            checked.append(key)
+            return super().get(key, default)
+
+    assert not query(Meta(m, format='PNG'))
+    assert checked == ['format']
@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+from os import listdir
+
+import pytest
+
+import imgdb.pool
+from imgdb.config import Config
+from imgdb.fsys import ReadAhead
+from imgdb.pool import IngestPool
+
+IMGS = sorted(f'test/pics/{f}' for f in listdir('test/pics'))
+
+
+def test_pool_imap():
+    c = Config(workers=2)
+    pool = IngestPool(c, chunk_size=2, in_flight=2, ordered=True)
+    assert pool.workers == 2
+    results = list(pool.imap(IMGS))
+    assert [p for p, _ in results] == IMGS
+    assert all(m['pth'] == p for p, m in results)
+    # unordered, the results are the same
+    results2 = dict(IngestPool(c, chunk_size=1).imap(IMGS))
+    assert sorted(results2) == IMGS
+    assert {p: m['id'] for p, m in results} == {p: m['id'] for p, m in results2.items()}
+    # the filter is applied in the workers
+    results = list(IngestPool(Config(workers=2, filter='width > 9999')).imap(IMGS))
+    assert len(results) == len(IMGS)
+    assert not any(m for _, m in results)
+
+
+def test_read_ahead():
+    files = list(reversed(IMGS)) + ['test/pics/missing.jpg']
+    # the budget is smaller than the files, they are read one by one
+    reader = ReadAhead(files, budget=1)
+    result = []
+    for idx, pth, data in reader:
+        assert reader.used == len(data)
+        result.append((idx, pth))
+        if data:
+            assert data == open(pth, 'rb').read()  # NOQA
+        reader.release(len(data))
+    # the files are read in sorted order
+    assert [p for _, p in result] == sorted(files)
+    assert [files[i] for i, _ in result] == sorted(files)
+    assert reader.used == 0
+    # not sorted
+    reader = ReadAhead(files, budget=1024 * 1024 * 64, sort=False)
+    assert [p for _, p, _ in reader] == files
+
+
+def test_pool_read_ahead():
+    c = Config(workers=2, read_ahead=1)
+    results = dict(IngestPool(c).imap(IMGS))
+    assert sorted(results) == IMGS
+    assert all(m['pth'] == p for p, m in results.items())
+    # the same results, when reading from disk
+    results2 = dict(IngestPool(Config(workers=2)).imap(IMGS))
+    assert {p: m['id'] for p, m in results.items()} == {p: m['id'] for p, m in results2.items()}
+
+
+def _crash_on_aldrin(pth, c, data=b''):
+    if 'Aldrin' in str(pth):
+        os._exit(1)
+    return _img_to_meta(pth, c, data)
+
+
+_img_to_meta = imgdb.pool.img_to_meta
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='needs fork')
+def test_pool_worker_crash(monkeypatch):
+    monkeypatch.setattr(imgdb.pool, 'img_to_meta', _crash_on_aldrin)
+    pool = IngestPool(Config(workers=2), chunk_size=2, ordered=True)
+    results = list(pool.imap(IMGS))
+    assert pool.restarts >= 1
+    # the crashing file is isolated, all the others are processed
+    assert [p for p, _ in results] == IMGS
+    for p, m in results:
+        assert bool(m) == ('Aldrin' not in p)
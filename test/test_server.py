@@ -6,8 +6,10 @@ os.environ['UPLOAD_DIR'] = 'test/fixtures/uploads'
 import io
 import json
 import shutil
+from base64 import b64encode
 from pathlib import Path
 
+import numpy
 from fastapi.testclient import TestClient
 from PIL import Image
 
@@ -220,6 +222,18 @@ def test_create_and_explore_gallery(temp_dir):
         assert data['available'] == 3
         assert data['imported'] == 3
 
+        # Import again, the imported images are skipped before processing
+        response = client.post(
+            '/import',
+            params={'db': str(db_path)},
+            data={'input': 'test/pics', 'skip_imported': 'true'},
+        )
+        assert response.status_code == 200
+        lines = [line for line in response.text.split('\n') if line.strip()]
+        data = json.loads(lines[-1][len('data: ') :])
+        assert data['filename'] == 'done'
+        assert data['available'] == 0
+
         # Explore the gallery again to update RECENT_DBS_FILE
         response = client.get(f'/gallery?db={db_path}')
         assert response.status_code == 200
@@ -344,3 +358,34 @@ def test_import_negative_cases(temp_dir):
     finally:
         if run.RECENT_DBS.is_file():
             run.RECENT_DBS.unlink()
+
+
+def test_vector_index(temp_dir):
+    db_path = Path(temp_dir) / 'vectors.htm'
+    db = ImgDB(str(db_path))
+    for i in range(3):
+        vector = numpy.zeros(run.CLIP_DIM, numpy.float16)
+        vector[i] = 1
+        db.add(
+            {
+                'id': f'img{i}',
+                'data-pth': f'pics/{i}.jpg',
+                'data-date': f'202{i}-01-01 00:00:00',
+                'data-bytes': '1',
+                'data-mode': 'RGB',
+                'data-format': 'JPEG',
+                'data-embedding-clip': b64encode(vector.tobytes()).decode(),
+            }
+        )
+    db.save()
+    index, pths = run._vector_index(db_path, ImgDB(str(db_path)))
+    labels, _ = index.knn_query(numpy.eye(run.CLIP_DIM, dtype=numpy.float16)[0], k=1)
+    assert pths[labels[0][0]] == 'pics/0.jpg'
+    # the DB is changed, the index is rebuilt with the new labels
+    db = ImgDB(str(db_path))
+    db.remove('img2')
+    db.save()
+    index, pths = run._vector_index(db_path, ImgDB(str(db_path)))
+    assert sorted(pths) == ['pics/0.jpg', 'pics/1.jpg']
+    labels, _ = index.knn_query(numpy.eye(run.CLIP_DIM, dtype=numpy.float16)[0], k=1)
+    assert pths[labels[0][0]] == 'pics/0.jpg'
@@ -0,0 +1,73 @@
+import json
+from os import listdir
+
+import imgdb.db
+from imgdb.config import Config
+from imgdb.db import ImgDB
+from imgdb.main import add_op, generate_gallery
+from imgdb.shards import is_manifest, shard_file
+
+NEW_IMG = '<img id="x1234" data-pth="test/pics/new.png" data-bytes="1" data-mode="RGB" data-format="PNG">'
+
+
+def test_db_shards(temp_dir, monkeypatch):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname, v_hashes='dhash'))
+    db = ImgDB(dbname)
+    manifest = f'{temp_dir}/test-shards.json'
+    db.to_shards(manifest, 'id')
+    assert is_manifest(manifest)
+    assert not is_manifest(dbname)
+    keys = sorted({img_id[0] for img_id in db.store.ids})
+    assert sorted(sh['key'] for sh in json.load(open(manifest))['shards']) == keys  # NOQA
+    # each shard is a DB
+    assert sum(len(ImgDB(str(shard_file(manifest, key)))) for key in keys) == len(db)
+
+    db2 = ImgDB(manifest)
+    assert sorted(db2.store.ids) == sorted(db.store.ids)
+    assert db2.meta == db.meta
+    assert [el.attrs for el in db2.images] == [el.attrs for el in ImgDB(dbname).images]
+
+    # only the changed shards are written
+    el = db2.images[0]
+    el['data-iso'] = '800'
+    shard = shard_file(manifest, el['id'][0])
+    mtimes = {key: shard_file(manifest, key).stat().st_mtime_ns for key in keys}
+    db2.commit()
+    changed = [key for key in keys if shard_file(manifest, key).stat().st_mtime_ns != mtimes[key]]
+    assert changed == [el['id'][0]]
+    assert ImgDB(str(shard)).get_by_id(el['id'])['iso'] == 800
+    # the image moves to another shard
+    el['id'] = 'x1234'
+    db2.commit()
+    if len(keys) == 1:
+        assert not shard.is_file()
+    assert ImgDB(str(shard_file(manifest, 'x'))).get_by_id('x1234')['iso'] == 800
+    db3 = ImgDB(manifest)
+    assert sorted(db3.store.ids) == sorted(db2.store.ids)
+    db3.remove('x1234')
+    db3.save()
+    assert not shard_file(manifest, 'x').is_file()
+    assert len(ImgDB(manifest)) == len(db) - 1
+
+    # the shards with an index are loaded in parallel
+    monkeypatch.setattr(imgdb.db, 'INDEX_MIN_IMAGES', 0)
+    for key in keys:
+        shard_file(manifest, key).with_suffix('.htm.idx').unlink(missing_ok=True)
+    db4 = ImgDB(manifest)
+    assert all(shard_file(manifest, sh['key']).with_suffix('.htm.idx').is_file() for sh in db4.manifest['shards'])
+    assert [el.attrs for el in db4.images] == [el.attrs for el in db3.images]
+
+
+def test_shards_gallery(temp_dir):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname))
+    manifest = f'{temp_dir}/test-shards.json'
+    ImgDB(dbname).to_shards(manifest, 'year')
+    # the commands work with the sharded DB
+    add_op(['test/pics'], Config(db=manifest, v_hashes='ahash'))
+    assert all(m.get('ahash') for m in ImgDB(manifest))
+    c = Config(gallery=f'{temp_dir}/gallery.html', db=manifest)
+    generate_gallery(c)
+    txt = open(f'{temp_dir}/gallery-01.html').read()  # NOQA
+    assert txt.count('<img data') == len(listdir('test/pics'))
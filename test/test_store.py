@@ -0,0 +1,140 @@
+import numpy
+from bs4 import BeautifulSoup
+
+from imgdb.store import DATE_NA, RecordStore, img_to_html, parse_attrs
+from imgdb.util import compile_query
+
+IMGS = [
+    {
+        'id': 'img1',
+        'data-pth': 'a/img1.jpg',
+        'data-format': 'JPEG',
+        'data-mode': 'RGB',
+        'data-bytes': '1234',
+        'data-size': '640,480',
+        'data-date': '2020-01-02 03:04:05',
+        'data-maker-model': 'Canon-EOS-5D',
+        'data-iso': '400',
+        'src': 'data:image/webp;base64,AAAA',
+    },
+    {
+        'id': 'img2',
+        'data-pth': 'b/img2.png',
+        'data-format': 'PNG',
+        'data-mode': 'RGBA',
+        'data-bytes': '99',
+        'data-illumination': '45.5',
+        'data-top-colors': '#000000=50.0,#ffffff=50.0',
+    },
+    {'id': 'x', 'data-pth': 'invalid'},
+]
+
+
+def test_img_to_html():
+    for attrs in IMGS + [{'id': 'abc', 'data-x': 'a"b\'c <&>'}, {'id': 'abc', 'data-x': "it's"}]:
+        soup = BeautifulSoup('<img>', 'lxml')
+        soup.img.attrs = attrs
+        assert img_to_html(attrs) == str(soup.img)
+        assert parse_attrs(img_to_html(attrs)) == attrs
+
+
+def test_store_columns():
+    store = RecordStore.from_attrs(IMGS)
+    # the invalid image is skipped
+    assert len(store) == 2
+    assert store.ids == ['img1', 'img2']
+    assert store.pths == ['a/img1.jpg', 'b/img2.png']
+    assert store.column('bytes').tolist() == [1234, 99]
+    assert store.column('width')[0] == 640
+    assert numpy.isnan(store.column('width')[1])
+    assert store.column('date').tolist() == [1577934245, DATE_NA]
+    assert store.column('illumination')[1] == 45.5
+    assert store.value(0, 'format') == 'JPEG'
+    assert store.value(1, 'maker-model') == ''
+    # the records are created on demand, from the buffer
+    assert not store._recs
+    assert store.attrs(1) == IMGS[1]
+    assert store.line(0) == img_to_html(IMGS[0])
+    assert not store._recs
+
+
+def test_store_changes():
+    store = RecordStore.from_attrs(IMGS)
+    rec = store.record(1)
+    assert rec is store.record(1)
+    # the columns follow the changes of the records
+    rec['data-size'] = '100,200'
+    rec['data-format'] = 'JPEG'
+    rec.update({'data-date': '2021-01-01 00:00:00', 'data-bytes': '100'})
+    assert store.column('height')[1] == 200
+    assert store.column('bytes')[1] == 100
+    assert store.column('date')[1] == 1609459200
+    assert store.column('format').tolist() == [0, 0]
+    del rec['data-illumination']
+    assert numpy.isnan(store.column('illumination')[1])
+    assert 'data-illumination' not in store.line(1)
+    # append more than the capacity
+    for i in range(100):
+        store.append({**IMGS[0], 'id': f'new{i}', 'data-iso': str(i)})
+    assert len(store) == 102
+    assert store.column('iso')[-1] == 99
+    # keep some rows, in another order
+    store.take([101, 1, 0])
+    assert store.ids == ['new99', 'img2', 'img1']
+    assert store.record(1) is rec
+    rec['data-iso'] = '800'
+    assert store.column('iso').tolist() == [99, 800, 400]
+
+
+def test_store_lookups():
+    store = RecordStore.from_attrs([IMGS[0], IMGS[1], {**IMGS[0], 'data-pth': 'c/img1.jpg'}])
+    assert store.row_of_id('img1') == 0
+    assert store.row_of_pth('c/img1.jpg') == 2
+    assert store.row_of_id('x') is None
+    # the duplicated ID moves to the next row
+    store.record(0)['id'] = 'img0'
+    assert store.row_of_id('img0') == 0
+    assert store.row_of_id('img1') == 2
+    store.record(1)['data-pth'] = 'b/img3.png'
+    assert store.row_of_pth('b/img2.png') is None
+    assert store.row_of_pth('b/img3.png') == 1
+    store.append({**IMGS[1], 'id': 'img4'})
+    assert store.row_of_id('img4') == 3
+    store.take([3, 1])
+    assert store.row_of_id('img4') == 0
+    assert store.row_of_pth('b/img3.png') == 1
+    assert store.row_of_id('img0') is None
+
+
+def test_store_indexes():
+    imgs = [
+        {**IMGS[0], 'id': f'img{i}', 'data-date': f'{2000 + i % 50}-01-02 03:04:05', 'data-format': f'F{i % 20}'}
+        for i in range(200)
+    ]
+    imgs[7].update({'data-date': '', 'data-lens': 'EF-50mm'})
+    store = RecordStore.from_attrs(imgs)
+
+    def scan(prop, op, val):
+        rows = numpy.flatnonzero(store.mask(prop, op, val, compile_query(f'{prop} {op} {val}').clauses[0][3]))
+        return rows.tolist()
+
+    for prop, op, val in (
+        ('date', '>', '2048'),
+        ('date', '<', '2003-06'),
+        ('format', '=', 'F3'),
+        ('lens', '=', 'EF-50mm'),
+    ):
+        assert store.index_rows(prop, op, val).tolist() == scan(prop, op, val)
+    assert store.index_rows('format', '=', 'X').tolist() == []
+    # too many rows match, the whole column is checked
+    assert store.index_rows('date', '>', '2010') is None
+    assert store.index_rows('format', '!=', 'F3') is None
+    # the indexes follow the changes of the records
+    store.record(1)['data-date'] = '2049-01-01 00:00:00'
+    store.record(3)['data-format'] = 'F4'
+    store.append({**IMGS[0], 'id': 'new', 'data-format': 'F3', 'data-date': '2050-01-01 00:00:00'})
+    assert store.index_rows('date', '>', '2048').tolist() == scan('date', '>', '2048')
+    assert store.index_rows('format', '=', 'F3').tolist() == scan('format', '=', 'F3')
+    assert 3 not in store.index_rows('format', '=', 'F3')
+    store.take(range(100, 201))
+    assert store.index_rows('format', '=', 'F3').tolist() == scan('format', '=', 'F3')
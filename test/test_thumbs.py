@@ -0,0 +1,68 @@
+import os
+from os import listdir
+
+from imgdb.config import Config
+from imgdb.db import ImgDB, db_commit
+from imgdb.main import add_op, generate_gallery
+from imgdb.thumbs import PACK_META, THUMB_ATTR, ThumbPack
+
+NEW_IMG = (
+    '<img id="x1234" data-pth="test/pics/new.png" data-bytes="1" data-mode="RGB" data-format="PNG" '
+    'src="data:image/webp;base64,UklGRg==">'
+)
+
+
+def test_db_thumbs(temp_dir):
+    dbname = f'{temp_dir}/test-db.htm'
+    add_op(['test/pics'], Config(db=dbname))
+    db = ImgDB(dbname)
+    srcs = {el['id']: el['src'] for el in db.images}
+    size = os.path.getsize(dbname)
+    assert db.pack_thumbs() == len(srcs)
+    assert os.path.getsize(dbname) < size / 2
+
+    db2 = ImgDB(dbname)
+    assert db2.meta[PACK_META] == 'test-db.htm.1.thumbs'
+    assert all('src' not in el.attrs and THUMB_ATTR in el.attrs for el in db2.images)
+    # the thumbs are inlined in copies of the images
+    assert {el['id']: el['src'] for el in db2.with_thumbs(db2.images)} == srcs
+    assert all('src' not in el.attrs for el in db2.images)
+
+    # the new thumbs are moved in the pack
+    db_commit(dbname, NEW_IMG)
+    db3 = ImgDB(dbname)
+    assert db3.thumb_src(db3.get_el_by_id('x1234').attrs) == 'data:image/webp;base64,UklGRg=='
+    db3.remove('x1234')
+    # the pack is rebuilt, without the removed images
+    db3.pack_thumbs()
+    assert sorted(listdir(temp_dir)) == ['test-db.htm', 'test-db.htm.2.thumbs']
+
+    db4 = ImgDB(dbname)
+    assert db4.unpack_thumbs() == len(srcs)
+    assert sorted(listdir(temp_dir)) == ['test-db.htm']
+    assert {el['id']: el['src'] for el in ImgDB(dbname).images} == srcs
+
+
+def test_thumbs_gallery(temp_dir):
+    c = Config(gallery=f'{temp_dir}/gallery.html', db=f'{temp_dir}/test-db.htm')
+    add_op(['test/pics'], c)
+    ImgDB(c.db).pack_thumbs()
+    generate_gallery(c)
+    txt = open(f'{temp_dir}/gallery-01.html').read()  # NOQA
+    assert txt.count('src="data:image/webp;base64,') == len(listdir('test/pics'))
+    assert THUMB_ATTR not in txt
+
+
+def test_thumbs_pack(temp_dir):
+    for use_mmap in (True, False):
+        pack = ThumbPack(f'{temp_dir}/test-{use_mmap}.thumbs', use_mmap=use_mmap)
+        ref1 = pack.add('data:image/webp;base64,UklGRg==')
+        assert pack.add('https://example.com/x.webp') is None
+        pack.flush()
+        ref2 = pack.add('data:image/png;base64,iVBORw==')
+        assert ref2 == 'png,4,4'
+        assert pack.src(ref1) == 'data:image/webp;base64,UklGRg=='
+        assert pack.src(ref2) == 'data:image/png;base64,iVBORw=='
+        pack.flush()
+        assert pack.read(ref2) == ('png', b'\x89PNG')
+        pack.close()
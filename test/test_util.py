@@ -1,6 +1,19 @@
+import hashlib
+
 from PIL import Image
 
-from imgdb.util import hamming_distance, hex_to_rgb, levenshtein_distance, make_thumb, rgb_to_hex, slugify
+from imgdb.config import Config
+from imgdb.img import img_to_meta
+from imgdb.util import (
+    hamming_distance,
+    hash_pixels,
+    hex_to_rgb,
+    levenshtein_distance,
+    make_thumb,
+    make_thumbs,
+    rgb_to_hex,
+    slugify,
+)
 
 
 def prepare_thumbs(img: Image.Image) -> dict[str, Image.Image]:
@@ -34,3 +47,57 @@ def test_rgb_hex():
     assert hex_to_rgb('#000000') == (0, 0, 0)
     assert hex_to_rgb('#ffff00') == (255, 255, 0)
     assert hex_to_rgb('#010203') == (1, 2, 3)
+
+
+def test_make_thumbs(temp_dir):
+    img = Image.open('test/pics/Mona_Lisa_by_Leonardo_da_Vinci.jpg')
+    thumbs = make_thumbs(img, {'thumb': 128, '64px': 64, '256px': 256})
+    assert list(thumbs) == ['256px', 'thumb', '64px']
+    assert thumbs['256px'].size == (172, 256)
+    assert thumbs['thumb'].size == (86, 128)
+    assert thumbs['64px'].size == (43, 64)
+    # the largest thumb is the same as the PIL thumbnail
+    expected = img.copy()
+    expected.thumbnail((256, 256))
+    assert thumbs['256px'].tobytes() == expected.tobytes()
+    # don't enlarge small images
+    assert make_thumb(img, 2000).size == img.size
+    # the exact thumbs are resized from the original image
+    thumbs = make_thumbs(img, {'thumb': 128, '64px': 64, '256px': 256}, exact=('64px', '256px'))
+    expected = img.copy()
+    expected.thumbnail((64, 64))
+    assert thumbs['64px'].tobytes() == expected.tobytes()
+    assert thumbs['thumb'].size == (86, 128)
+
+    # the EXIF orientation is applied
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    Image.new('RGB', (400, 200)).save(f'{temp_dir}/rotated.jpg', exif=exif)
+    thumbs = make_thumbs(Image.open(f'{temp_dir}/rotated.jpg'), {'a': 100, 'b': 50})
+    assert thumbs['a'].size == (50, 100)
+    assert thumbs['b'].size == (25, 50)
+
+
+def test_thumb_hashes():
+    # the visual hashes must not change between versions, or the same images will not match
+    c = Config(v_hashes='dhash,ahash,vhash', algorithms='illumination')
+    _, m = img_to_meta('test/pics/Claudius_Ptolemy_The_World.png', c)
+    assert (m['dhash'], m['ahash'], m['vhash']) == ('60h2uno', 'qxmbvi4', '3irpu4s')
+    _, m = img_to_meta('test/pics/Mona_Lisa_by_Leonardo_da_Vinci.jpg', c)
+    assert (m['dhash'], m['ahash'], m['vhash']) == ('hlkizjl', 'vjaz9c0', '4g0dds0')
+
+
+def test_hash_pixels():
+    for pth in ('test/pics/Aldrin_Apollo_11.jpg', 'test/pics/Claudius_Ptolemy_The_World.png'):
+        img = Image.open(pth)
+        raw = img.tobytes()
+        expected = {
+            'blake2b': hashlib.new('blake2b', raw, digest_size=24).hexdigest(),
+            'sha256': hashlib.new('sha256', raw).hexdigest(),
+            'sha3_512': hashlib.new('sha3_512', raw).hexdigest(),
+        }
+        # one hash, default strips
+        assert hash_pixels(img, ['blake2b']) == {'blake2b': expected['blake2b']}
+        # multiple hashes, in threads, with lots of small strips
+        assert hash_pixels(img, list(expected), strip_sz=10_000) == expected
+    assert hash_pixels(img, []) == {}